@@ -14,16 +14,13 @@ class MessageSerializer(serializers.ModelSerializer):
 
 
 class ChatListSerializer(serializers.ModelSerializer):
-    opponent = UserFullNameSerializer(read_only=True)
+    opponent = serializers.SerializerMethodField()
     last_message = MessageSerializer(read_only=True)
 
     class Meta:
         model = Chat
         fields = ['id', 'opponent', 'last_message']
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        user = self.context.get('user')
-        opponent_user = get_chat_opponent(instance, user)
-        representation['opponent'] = UserFullNameSerializer(opponent_user).data
-        return representation
+    def get_opponent(self, instance: Chat) -> dict:
+        opponent_user = get_chat_opponent(instance, self.context.get('user'))
+        return UserFullNameSerializer(opponent_user).data
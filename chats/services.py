@@ -10,11 +10,10 @@ def get_messages(chat: Chat) -> QuerySet[Message]:
 
 
 def get_chat_opponent(chat: Chat, current_user: User) -> User:
-    """Get the opponent user in a chat."""
-    try:
-        opponent = chat.users.exclude(pk=current_user.pk).get()
-        return opponent
-    except User.DoesNotExist:
+    """Get the opponent user in a chat, prefetched chat users are used if present."""
+    opponents = [user for user in chat.users.all() if user.pk != current_user.pk]
+    if not opponents:
         raise User.DoesNotExist("Opponent user not found in the chat.")
-    except User.MultipleObjectsReturned:
+    if len(opponents) > 1:
         raise User.MultipleObjectsReturned("Multiple users found in the chat, expected only one.")
+    return opponents[0]
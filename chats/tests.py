@@ -1,3 +1,33 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from chats.models import Chat, Message
+from core.tests_setup import APITestCaseWithSetUp
+from users.models import User
+
+
+class ChatListQueryBudgetTest(APITestCaseWithSetUp):
+
+    def create_chat(self, number: int) -> Chat:
+        opponent = User.objects.create_user(email=f"opponent{number}@example.com", password="Test123",
+                                            first_name=f"Opponent{number}", last_name="Doe")
+        chat = Chat.objects.create_chat(self.user1, opponent)
+        chat.last_message = Message.objects.create(chat=chat, user=opponent, content="Привет")
+        chat.save()
+        return chat
+
+    def test_chat_list_opponents(self):
+        chat = self.create_chat(1)
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse("user-chat-list"))
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["id"], str(chat.id))
+        self.assertEqual(response.data[0]["opponent"]["first_name"], "Opponent1")
+        self.assertEqual(response.data[0]["last_message"]["content"], "Привет")
+
+    def test_chat_list_query_count_is_constant(self):
+        self.client.force_login(self.user1)
+        self.create_chat(1)
+        queries = self.get_query_count(reverse("user-chat-list"))
+        for number in range(2, 6):
+            self.create_chat(number)
+        self.assertQueryBudget(reverse("user-chat-list"), queries)
@@ -1,4 +1,4 @@
-from django.db.models import QuerySet
+from django.db.models import Prefetch, QuerySet
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics
@@ -8,13 +8,14 @@ from rest_framework.response import Response
 
 from chats.models import Chat, Message
 from chats.serializers import ChatListSerializer, MessageSerializer
+from users.models import User
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_chat_list(request) -> Response:
-    user_chats = Chat.objects.filter(users=request.user.id).prefetch_related(
-        'messages').select_related('last_message__user')
+    user_chats = Chat.objects.filter(users=request.user.id).select_related('last_message__user').prefetch_related(
+        Prefetch('users', queryset=User.objects.only('id', 'first_name', 'last_name')))
     serializer = ChatListSerializer(user_chats, many=True, context={'user': request.user})
     return Response(serializer.data)
 
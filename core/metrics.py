@@ -0,0 +1,45 @@
+import time
+from contextvars import ContextVar
+
+
+class RequestMetrics:
+    """SQL and cache counters of a single request, also used as database execute wrapper.
+
+    EXPLAIN statements issued by profilers such as silk are not counted.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        explain_prefix = context["connection"].ops.explain_prefix
+        if explain_prefix and sql.startswith(explain_prefix):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def get_server_timing(self, total_time: float) -> str:
+        return (f'db;desc="queries={self.queries}";dur={self.db_time * 1000:.2f}, '
+                f'cache;desc="hits={self.cache_hits} misses={self.cache_misses}", '
+                f'app;dur={total_time * 1000:.2f}')
+
+
+current_request_metrics: ContextVar[RequestMetrics | None] = ContextVar("current_request_metrics", default=None)
+
+
+def record_cache_lookup(hit: bool) -> None:
+    """Count cache hit or miss of the current request"""
+    metrics = current_request_metrics.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.cache_hits += 1
+    else:
+        metrics.cache_misses += 1
@@ -0,0 +1,49 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from core.metrics import RequestMetrics, current_request_metrics
+
+logger = logging.getLogger("core.requests")
+
+
+class RequestMetricsMiddleware:
+    """Count SQL queries, database time and cache lookups made while handling request.
+
+    Metrics are attached to response as request_metrics, written to the core.requests log
+    and exposed through Server-Timing header when REQUEST_METRICS_SERVER_TIMING is enabled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        total_time = time.perf_counter() - started
+
+        response.request_metrics = metrics
+        if settings.REQUEST_METRICS_SERVER_TIMING:
+            response["Server-Timing"] = metrics.get_server_timing(total_time)
+        logger.info(
+            "method=%s path=%s status=%s queries=%d db_ms=%.2f cache_hits=%d cache_misses=%d total_ms=%.2f",
+            request.method, request.path, response.status_code, metrics.queries, metrics.db_time * 1000,
+            metrics.cache_hits, metrics.cache_misses, total_time * 1000,
+            extra={"method": request.method, "path": request.path, "status": response.status_code,
+                   "queries": metrics.queries, "db_ms": round(metrics.db_time * 1000, 2),
+                   "cache_hits": metrics.cache_hits, "cache_misses": metrics.cache_misses,
+                   "total_ms": round(total_time * 1000, 2)},
+        )
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -28,6 +29,7 @@ SECRET_KEY = str(os.getenv('SECRET_KEY'))
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 DOCKER = False
+TESTING = 'test' in sys.argv
 
 INTERNAL_IPS = [
     "127.0.0.1",
@@ -81,6 +83,7 @@ MIDDLEWARE = [
 
     "corsheaders.middleware.CorsMiddleware",
     'silk.middleware.SilkyMiddleware',
+    'core.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -143,6 +146,16 @@ ELASTICSEARCH_DSL = {
         'verify_certs': False,
     },
 }
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'cottages.indexing.QueuedSignalProcessor'
+SEARCH_INDEX_FLUSH_DELAY = int(os.getenv('SEARCH_INDEX_FLUSH_DELAY', 5))
+SEARCH_INDEX_BATCH_SIZE = int(os.getenv('SEARCH_INDEX_BATCH_SIZE', 500))
+SEARCH_INDEX_MAX_BATCHES = int(os.getenv('SEARCH_INDEX_MAX_BATCHES', 100))
+SEARCH_INDEX_CLAIM_TIMEOUT = int(os.getenv('SEARCH_INDEX_CLAIM_TIMEOUT', 60 * 5))
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'cottages.search_backends.ElasticsearchBackend')
+SEARCH_FALLBACK_BACKEND = os.getenv('SEARCH_FALLBACK_BACKEND', 'cottages.search_backends.LocalSearchBackend')
+SEARCH_LOCAL_INDEX_TTL = int(os.getenv('SEARCH_LOCAL_INDEX_TTL', 60 * 5))
+SEARCH_PRICE_FACET_INTERVAL = int(os.getenv('SEARCH_PRICE_FACET_INTERVAL', 5000))
+SEARCH_PIT_KEEP_ALIVE = os.getenv('SEARCH_PIT_KEEP_ALIVE', '2m')
 
 # For localhost
 CELERY_BROKER_URL = (f"{str(os.getenv('REDIS_HOST_DOCKER')) if DOCKER else str(os.getenv('REDIS_HOST'))}:"
@@ -158,6 +171,16 @@ CACHES = {
     }
 }
 
+SEARCH_ANALYTICS_ENABLED = os.getenv('SEARCH_ANALYTICS_ENABLED', str(not TESTING)) == 'True'
+SEARCH_ANALYTICS_BUFFER = os.getenv('SEARCH_ANALYTICS_BUFFER', 'cottages.analytics.RedisEventBuffer')
+SEARCH_ANALYTICS_REDIS_URL = os.getenv('SEARCH_ANALYTICS_REDIS_URL', CACHES['default']['LOCATION'])
+SEARCH_ANALYTICS_FLUSH_DELAY = int(os.getenv('SEARCH_ANALYTICS_FLUSH_DELAY', 60))
+SEARCH_ANALYTICS_BATCH_SIZE = int(os.getenv('SEARCH_ANALYTICS_BATCH_SIZE', 1000))
+SEARCH_ANALYTICS_MAX_BATCHES = int(os.getenv('SEARCH_ANALYTICS_MAX_BATCHES', 100))
+SEARCH_ANALYTICS_TOP_RESULTS = int(os.getenv('SEARCH_ANALYTICS_TOP_RESULTS', 5))
+SEARCH_ANALYTICS_RETENTION_DAYS = int(os.getenv('SEARCH_ANALYTICS_RETENTION_DAYS', 90))
+SEARCH_POPULARITY_DAYS = int(os.getenv('SEARCH_POPULARITY_DAYS', 30))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -263,8 +286,60 @@ ALLOWED_HOSTS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
-CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken']
+CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken', 'Server-Timing']
 
 # YooMoney
 YOOMONEY_SHOP_ID = str(os.getenv('YOOMONEY_SHOP_ID'))
 YOOMONEY_SHOP_SECRET = str(os.getenv('YOOMONEY_SHOP_SECRET'))
+PAYMENTS_GATEWAY = os.getenv('PAYMENTS_GATEWAY', 'payments.gateways.YooKassaGateway')
+PAYMENTS_FAKE_LATENCY = float(os.getenv('PAYMENTS_FAKE_LATENCY', 0.2))
+PAYMENTS_FAKE_FAILURE_RATE = float(os.getenv('PAYMENTS_FAKE_FAILURE_RATE', 0))
+PAYMENTS_FAKE_SUCCESS_RATE = float(os.getenv('PAYMENTS_FAKE_SUCCESS_RATE', 0.9))
+PAYMENTS_FAKE_CONFIRM_DELAY = int(os.getenv('PAYMENTS_FAKE_CONFIRM_DELAY', 30))
+PAYMENTS_ASYNC_CREATION = os.getenv('PAYMENTS_ASYNC_CREATION', 'True') == 'True'
+PAYMENTS_SWEEP_INTERVAL = int(os.getenv('PAYMENTS_SWEEP_INTERVAL', 60))
+PAYMENTS_SWEEP_BATCH_SIZE = int(os.getenv('PAYMENTS_SWEEP_BATCH_SIZE', 100))
+PAYMENTS_SWEEP_CONCURRENCY = int(os.getenv('PAYMENTS_SWEEP_CONCURRENCY', 8))
+PAYMENTS_SWEEP_MAX_BATCHES = int(os.getenv('PAYMENTS_SWEEP_MAX_BATCHES', 100))
+PAYMENTS_CHECK_INTERVAL = int(os.getenv('PAYMENTS_CHECK_INTERVAL', 60 * 2))
+PAYMENTS_TIMEOUT = int(os.getenv('PAYMENTS_TIMEOUT', 60 * 60))
+PAYMENTS_NOTIFICATIONS_APPLY_DELAY = int(os.getenv('PAYMENTS_NOTIFICATIONS_APPLY_DELAY', 2))
+PAYMENTS_NOTIFICATIONS_BATCH_SIZE = int(os.getenv('PAYMENTS_NOTIFICATIONS_BATCH_SIZE', 500))
+PAYMENTS_NOTIFICATIONS_INTERVAL = int(os.getenv('PAYMENTS_NOTIFICATIONS_INTERVAL', 60))
+
+CELERY_BEAT_SCHEDULE = {
+    "sweep-payments": {
+        "task": "payments.tasks.sweep_payments",
+        "schedule": PAYMENTS_SWEEP_INTERVAL,
+    },
+    "apply-payment-notifications": {
+        "task": "payments.tasks.apply_payment_notifications",
+        "schedule": PAYMENTS_NOTIFICATIONS_INTERVAL,
+    },
+}
+
+# Cottages
+OCCUPIED_DATES_HORIZON_DAYS = int(os.getenv('OCCUPIED_DATES_HORIZON_DAYS', 365))
+COTTAGES_CACHE_TIMEOUT = int(os.getenv('COTTAGES_CACHE_TIMEOUT', 60 * 10))
+COTTAGES_SUGGEST_CACHE_TIMEOUT = int(os.getenv('COTTAGES_SUGGEST_CACHE_TIMEOUT', 30))
+COTTAGES_QUOTE_CACHE_TIMEOUT = int(os.getenv('COTTAGES_QUOTE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Request metrics
+REQUEST_METRICS_SERVER_TIMING = os.getenv('REQUEST_METRICS_SERVER_TIMING', str(DEBUG)) == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_METRICS_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -1,6 +1,6 @@
 import datetime
 
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from cottages.models import Cottage, CottageCategory
 from relations.models import UserCottageReview
@@ -8,7 +8,20 @@ from towns.models import Town, TownAttraction
 from users.models import User
 
 
-class APITestCaseWithSetUp(APITestCase):
+class QueryBudgetMixin:
+    """Assertions on SQL queries counted by RequestMetricsMiddleware, queries of profiling middleware are not counted"""
+
+    def get_query_count(self, url: str, data: dict = None) -> int:
+        response = self.client.get(url, data)
+        self.assertLess(response.status_code, 400, response.content)
+        return response.request_metrics.queries
+
+    def assertQueryBudget(self, url: str, budget: int, data: dict = None) -> None:
+        queries = self.get_query_count(url, data)
+        self.assertLessEqual(queries, budget, f"{url} made {queries} SQL queries, budget is {budget}")
+
+
+class SetUpMixin:
     def setUp(self):
         self.user1 = User.objects.create_user(
             email='test@example.com',
@@ -66,3 +79,11 @@ class APITestCaseWithSetUp(APITestCase):
             value_rating=5,
             comment="Все отлично",
         )
+
+
+class APITestCaseWithSetUp(SetUpMixin, QueryBudgetMixin, APITestCase):
+    pass
+
+
+class APITransactionTestCaseWithSetUp(SetUpMixin, APITransactionTestCase):
+    """Data is committed, so it is visible to threads with own database connections"""
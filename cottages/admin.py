@@ -1,13 +1,19 @@
 from django.contrib import admin
 from ordered_model.admin import OrderedModelAdmin
 
-from cottages.models import Cottage, CottageCategory, CottageImage
+from cottages.models import Cottage, CottageCategory, CottageImage, CottagePriceRule
+
+
+class CottagePriceRuleInline(admin.TabularInline):
+    model = CottagePriceRule
+    extra = 0
 
 
 @admin.register(Cottage)
 class CottageAdmin(admin.ModelAdmin):
     list_display = ("id", "town", "name", "price", "guests")
     list_display_links = ("town", "name")
+    inlines = (CottagePriceRuleInline, )
 
 
 @admin.register(CottageCategory)
@@ -0,0 +1,134 @@
+import abc
+import datetime
+import json
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Iterable
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.celery import app
+from cottages.models import Cottage, SearchEvent
+from cottages.search import normalize_suggest_query
+
+logger = logging.getLogger(__name__)
+
+EVENTS_KEY = "cottages:search-events"
+FLUSH_SCHEDULED_KEY = "cottages:search-events:flush-scheduled"
+
+
+class EventBuffer(abc.ABC):
+    """Storage of search events between request and flush to the database"""
+    unavailable_errors: tuple[type[Exception], ...] = ()
+
+    @abc.abstractmethod
+    def push(self, events: list[dict]) -> None:
+        """Append events to the buffer"""
+
+    @abc.abstractmethod
+    def pop(self, count: int) -> list[dict]:
+        """Remove and return up to count oldest events"""
+
+
+class RedisEventBuffer(EventBuffer):
+    """Events in a Redis list, shared by all processes and flushed by Celery"""
+    unavailable_errors = (redis.RedisError,)
+
+    def __init__(self):
+        self.client = redis.Redis.from_url(settings.SEARCH_ANALYTICS_REDIS_URL)
+
+    def push(self, events: list[dict]) -> None:
+        self.client.rpush(EVENTS_KEY, *[json.dumps(event) for event in events])
+
+    def pop(self, count: int) -> list[dict]:
+        with self.client.pipeline() as pipeline:
+            pipeline.lrange(EVENTS_KEY, 0, count - 1)
+            pipeline.ltrim(EVENTS_KEY, count, -1)
+            events, _ = pipeline.execute()
+        return [json.loads(event) for event in events]
+
+
+class LocalEventBuffer(EventBuffer):
+    """Events in memory of the process, for development and tests without Redis"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = deque()
+
+    def push(self, events: list[dict]) -> None:
+        with self._lock:
+            self._events.extend(events)
+
+    def pop(self, count: int) -> list[dict]:
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(count, len(self._events)))]
+
+
+@lru_cache
+def get_event_buffer() -> EventBuffer:
+    return import_string(settings.SEARCH_ANALYTICS_BUFFER)()
+
+
+def record_search_event(kind: int, query: str = "", cottage_ids: Iterable = ()) -> None:
+    """Buffer search event with top results, the request does not touch the database"""
+    if not settings.SEARCH_ANALYTICS_ENABLED:
+        return
+    event = {
+        "kind": kind,
+        "query": normalize_suggest_query(query)[:255],
+        "cottages": list(dict.fromkeys(str(pk) for pk in cottage_ids))[:settings.SEARCH_ANALYTICS_TOP_RESULTS],
+        "at": timezone.now().isoformat(),
+    }
+    buffer = get_event_buffer()
+    try:
+        buffer.push([event])
+    except buffer.unavailable_errors as error:
+        logger.warning("Search event is not recorded: %s", error)
+        return
+    transaction.on_commit(schedule_flush)
+
+
+def schedule_flush() -> None:
+    """Schedule one flush task per delay window, events buffered meanwhile are written together"""
+    delay = settings.SEARCH_ANALYTICS_FLUSH_DELAY
+    if cache.add(FLUSH_SCHEDULED_KEY, True, timeout=delay):
+        app.send_task("cottages.tasks.flush_search_events", countdown=delay)
+
+
+def flush_event_buffer(batch_size: int) -> int:
+    """Write one batch of buffered events to the database, return number of processed events.
+
+    Search and suggest events are stored as one row per shown cottage, events without results as one row.
+    Events of deleted cottages are dropped.
+    """
+    events = get_event_buffer().pop(batch_size)
+    if not events:
+        return 0
+    cottage_ids = {pk for event in events for pk in event["cottages"]}
+    existing = {str(pk) for pk in Cottage.objects.filter(pk__in=cottage_ids).values_list("pk", flat=True)}
+    rows = []
+    for event in events:
+        cottages = [pk for pk in event["cottages"] if pk in existing]
+        if not cottages and event["kind"] == SearchEvent.VIEW:
+            continue
+        created_at = datetime.datetime.fromisoformat(event["at"])
+        rows += [
+            SearchEvent(kind=event["kind"], query=event["query"], cottage_id=pk, created_at=created_at)
+            for pk in cottages or [None]
+        ]
+    SearchEvent.objects.bulk_create(rows, batch_size=batch_size)
+    return len(events)
+
+
+def delete_old_events() -> int:
+    """Delete events older than SEARCH_ANALYTICS_RETENTION_DAYS, return number of deleted"""
+    since = timezone.now() - datetime.timedelta(days=settings.SEARCH_ANALYTICS_RETENTION_DAYS)
+    deleted, _ = SearchEvent.objects.filter(created_at__lt=since).delete()
+    return deleted
@@ -5,3 +5,6 @@ class CottagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cottages'
     verbose_name = "Коттеджи"
+
+    def ready(self):
+        from cottages import search_backends  # noqa: connects local suggest index signals
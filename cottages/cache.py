@@ -0,0 +1,114 @@
+import hashlib
+import uuid
+from typing import Iterable
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+
+COTTAGE_LIST_VERSION_KEY = "cottages:list:version"
+COTTAGE_AVAILABILITY_VERSION_KEY = "cottages:availability:version"
+COTTAGE_DETAIL_VERSION_KEY = "cottages:detail:{cottage_id}:version"
+COTTAGE_PRICES_VERSION_KEY = "cottages:prices:{cottage_id}:version"
+
+
+def get_cache_version(key: str) -> str:
+    """Return current version token stored under key, create it if missing"""
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_cache_versions(keys: list[str]) -> dict[str, str]:
+    """Return version tokens of keys by one cache request, missing ones are created"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = get_cache_version(key)
+    return versions
+
+
+def bump_cache_version(key: str) -> None:
+    """Replace version token so every key built with the previous one is never read again"""
+    cache.set(key, uuid.uuid4().hex, timeout=None)
+
+
+def build_cache_key(prefix: str, version: str, params: Iterable[tuple[str, object]]) -> str:
+    """Return cache key for normalized params"""
+    query = urlencode(sorted((key, str(value)) for key, value in params if value not in (None, "")))
+    return f"{prefix}:{version}:{hashlib.md5(query.encode()).hexdigest()}"
+
+
+def get_cottage_list_cache_key(params: Iterable[tuple[str, object]], with_dates: bool = False) -> str:
+    """Return cottage list cache key, list filtered by dates also changes with availability of cottages"""
+    version = get_cache_version(COTTAGE_LIST_VERSION_KEY)
+    if with_dates:
+        version = f"{version}.{get_cache_version(COTTAGE_AVAILABILITY_VERSION_KEY)}"
+    return build_cache_key("cottages:list", version, params)
+
+
+def get_cottage_detail_cache_key(cottage_id: uuid.UUID, params: Iterable[tuple[str, object]]) -> str:
+    version = get_cache_version(COTTAGE_DETAIL_VERSION_KEY.format(cottage_id=cottage_id))
+    return build_cache_key(f"cottages:detail:{cottage_id}", version, params)
+
+
+def get_cottage_facets_cache_key(params: Iterable[tuple[str, object]]) -> str:
+    return build_cache_key("cottages:facets", get_cache_version(COTTAGE_LIST_VERSION_KEY), params)
+
+
+def get_cottage_suggest_cache_key(query: str) -> str:
+    return build_cache_key("cottages:suggest", get_cache_version(COTTAGE_LIST_VERSION_KEY), [("query", query)])
+
+
+def get_cottage_quote_cache_keys(cottage_ids: list, start_date, end_date) -> dict:
+    """Return quote cache keys by cottage ID, a key changes with the cottage prices version"""
+    version_keys = {cottage_id: COTTAGE_PRICES_VERSION_KEY.format(cottage_id=cottage_id) for cottage_id in cottage_ids}
+    versions = get_cache_versions(list(version_keys.values()))
+    return {
+        cottage_id: build_cache_key(f"cottages:quote:{cottage_id}", versions[version_key],
+                                    [("start_date", start_date), ("end_date", end_date)])
+        for cottage_id, version_key in version_keys.items()
+    }
+
+
+def invalidate_cottage_cache(cottage_id: uuid.UUID = None) -> None:
+    """Invalidate cottage list and detail of cottage now and once more after transaction commit"""
+    keys = [COTTAGE_LIST_VERSION_KEY]
+    if cottage_id:
+        keys.append(COTTAGE_DETAIL_VERSION_KEY.format(cottage_id=cottage_id))
+
+    def bump_versions():
+        for key in keys:
+            bump_cache_version(key)
+
+    bump_versions()
+    transaction.on_commit(bump_versions)
+
+
+def invalidate_cottage_availability(cottage_ids: Iterable[uuid.UUID]) -> None:
+    """Invalidate detail of cottages and lists filtered by dates now and once more after transaction commit.
+
+    Rents do not change cottage cards, so other lists, suggestions and facets stay cached.
+    """
+    cottage_ids = set(cottage_ids)
+    if not cottage_ids:
+        return
+    keys = [COTTAGE_AVAILABILITY_VERSION_KEY]
+    keys += [COTTAGE_DETAIL_VERSION_KEY.format(cottage_id=cottage_id) for cottage_id in cottage_ids]
+
+    def bump_versions():
+        for key in keys:
+            bump_cache_version(key)
+
+    bump_versions()
+    transaction.on_commit(bump_versions)
+
+
+def invalidate_cottage_prices(cottage_id: uuid.UUID) -> None:
+    """Invalidate cached quotes of cottage now and once more after transaction commit"""
+    key = COTTAGE_PRICES_VERSION_KEY.format(cottage_id=cottage_id)
+    bump_cache_version(key)
+    transaction.on_commit(lambda: bump_cache_version(key))
@@ -1,33 +1,100 @@
+from django.db.models import Prefetch, QuerySet
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
 
-from cottages.models import Cottage
+from cottages.models import Cottage, CottageCategory, CottageImage
 from towns.models import Town
 
 
 @registry.register_document
 class CottageDocument(Document):
+    POPULARITY_WEIGHTS = {"popularity_queries": 1, "popularity_views": 5, "popularity_bookings": 20}
+    MAX_SUGGEST_WEIGHT = 2 ** 31 - 1
+
     name = fields.TextField(
         attr='name',
         fields={
             'raw': fields.TextField(),
-            'suggest': fields.CompletionField(),
         }
     )
+    name_suggest = fields.CompletionField()
     town_name = fields.TextField(
         attr='town.name',
         fields={
             'raw': fields.KeywordField(),
-            'suggest': fields.CompletionField(),
         }
     )
+    town_name_suggest = fields.CompletionField()
+    town = fields.ObjectField(properties={
+        'id': fields.KeywordField(),
+        'name': fields.TextField(),
+    })
+    category = fields.ObjectField(properties={
+        'id': fields.KeywordField(),
+        'name': fields.KeywordField(),
+    })
+    price = fields.FloatField()
+    amenities = fields.KeywordField(multi=True)
+    images = fields.ObjectField(enabled=False)
 
     class Index:
         name = "cottage"
 
     class Django:
         model = Cottage
-        fields = ["id",]
+        fields = ["id", "guests", "beds", "rooms", "total_area", "is_ready", "average_rating", "reviews_count"]
+        related_models = [Town, CottageCategory, CottageImage]
+
+    def get_queryset(self) -> QuerySet[Cottage]:
+        return super().get_queryset().select_related("town", "category").prefetch_related(
+            Prefetch("images", CottageImage.objects.only("id", "cottage_id", "image", "order"))
+        ).annotate(**Cottage.objects.get_popularity_annotations())
+
+    def get_instances_from_related(self, related_instance):
+        if isinstance(related_instance, CottageImage):
+            return related_instance.cottage
+        if isinstance(related_instance, Town):
+            return self.get_queryset().filter(town=related_instance)
+        return self.get_queryset().filter(category=related_instance)
+
+    def get_suggest_weight(self, instance: Cottage) -> int:
+        """Return completion weight from popularity annotations, suggestions of popular cottages go first"""
+        weight = sum(getattr(instance, name, 0) * factor for name, factor in self.POPULARITY_WEIGHTS.items())
+        return min(weight, self.MAX_SUGGEST_WEIGHT)
+
+    def prepare_name_suggest(self, instance: Cottage) -> dict:
+        return {"input": [instance.name], "weight": self.get_suggest_weight(instance)}
+
+    def prepare_town_name_suggest(self, instance: Cottage) -> dict | None:
+        if instance.town is None:
+            return None
+        return {"input": [instance.town.name], "weight": self.get_suggest_weight(instance)}
+
+    # noinspection PyMethodMayBeStatic
+    def prepare_town(self, instance: Cottage) -> dict | None:
+        town = instance.town
+        return {"id": str(town.id), "name": town.name} if town else None
+
+    # noinspection PyMethodMayBeStatic
+    def prepare_category(self, instance: Cottage) -> dict:
+        return {"id": str(instance.category.id), "name": instance.category.name}
+
+    # noinspection PyMethodMayBeStatic
+    def prepare_price(self, instance: Cottage) -> float | None:
+        return float(instance.price) if instance.price is not None else None
+
+    # noinspection PyMethodMayBeStatic
+    def prepare_amenities(self, instance: Cottage) -> list[str]:
+        return instance.amenities or []
+
+    # noinspection PyMethodMayBeStatic
+    def prepare_images_with_related(self, instance: Cottage, related_to_ignore=None) -> list[dict]:
+        """Return images needed to render a card, image being deleted is skipped"""
+        return [
+            {"id": str(image.id), "image": image.image.name, "order": image.order}
+            for image in instance.images.all()
+            if image != related_to_ignore and image.image
+        ]
 
 
 @registry.register_document
@@ -0,0 +1,66 @@
+import django_filters
+from django.db.models import QuerySet
+from rest_framework.exceptions import ValidationError
+
+from cottages.geo import get_bbox_around, get_bbox_filter, get_distance_expression
+from cottages.models import Cottage
+
+
+class FloatCSVFilter(django_filters.BaseCSVFilter, django_filters.NumberFilter):
+    pass
+
+
+class CottageFilter(django_filters.FilterSet):
+    DEFAULT_RADIUS_KM = 10
+    MAX_RADIUS_KM = 500
+
+    price_min = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    price_max = django_filters.NumberFilter(field_name="price", lookup_expr="lte")
+    guests = django_filters.NumberFilter(field_name="guests", lookup_expr="gte")
+    beds = django_filters.NumberFilter(field_name="beds", lookup_expr="gte")
+    rooms = django_filters.NumberFilter(field_name="rooms", lookup_expr="gte")
+    category = django_filters.UUIDFilter(field_name="category_id")
+    town = django_filters.UUIDFilter(field_name="town_id")
+    average_rating_min = django_filters.NumberFilter(field_name="average_rating", lookup_expr="gte")
+    bbox = FloatCSVFilter(method="filter_bbox", help_text="min_lat,min_lon,max_lat,max_lon")
+    near = FloatCSVFilter(method="filter_near", help_text="lat,lon")
+    radius_km = django_filters.NumberFilter(method="filter_radius_km", min_value=0)
+
+    class Meta:
+        model = Cottage
+        fields = []
+
+    # noinspection PyMethodMayBeStatic
+    def filter_bbox(self, queryset: QuerySet, name: str, value: list) -> QuerySet:
+        if len(value) != 4:
+            raise ValidationError({name: "Expected min_lat,min_lon,max_lat,max_lon"})
+        min_latitude, min_longitude, max_latitude, max_longitude = self._get_coordinates(name, value)
+        if min_latitude > max_latitude:
+            raise ValidationError({name: "min_lat must not exceed max_lat"})
+        return queryset.filter(get_bbox_filter((min_latitude, min_longitude, max_latitude, max_longitude)))
+
+    def filter_near(self, queryset: QuerySet, name: str, value: list) -> QuerySet:
+        """Return cottages within radius_km from the point annotated with distance in km"""
+        if len(value) != 2:
+            raise ValidationError({name: "Expected lat,lon"})
+        latitude, longitude = self._get_coordinates(name, value)
+        radius_km = float(min(self.form.cleaned_data.get("radius_km") or self.DEFAULT_RADIUS_KM, self.MAX_RADIUS_KM))
+        return queryset.filter(get_bbox_filter(get_bbox_around(latitude, longitude, radius_km))).annotate(
+            distance=get_distance_expression(latitude, longitude)
+        ).filter(distance__lte=radius_km)
+
+    # noinspection PyMethodMayBeStatic
+    def filter_radius_km(self, queryset: QuerySet, name: str, value) -> QuerySet:
+        """Radius is applied together with near"""
+        return queryset
+
+    @staticmethod
+    def _get_coordinates(name: str, value: list) -> list[float]:
+        coordinates = [float(number) for number in value]
+        for latitude in coordinates[::2]:
+            if not -90 <= latitude <= 90:
+                raise ValidationError({name: "Latitude must be between -90 and 90"})
+        for longitude in coordinates[1::2]:
+            if not -180 <= longitude <= 180:
+                raise ValidationError({name: "Longitude must be between -180 and 180"})
+        return coordinates
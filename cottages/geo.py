@@ -0,0 +1,75 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import CombinedExpression
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_LATITUDE_DEGREE = 111.32
+GRID_CELL_DEGREES = 0.1
+GRID_ROWS = 1800
+GRID_COLUMNS = 3600
+MAX_GRID_ROWS = 60
+
+BoundingBox = tuple[float, float, float, float]
+
+
+def _get_grid_row(latitude: float) -> int:
+    return min(max(int((latitude + 90) / GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+
+
+def _get_grid_column(longitude: float) -> int:
+    return min(max(int((longitude + 180) / GRID_CELL_DEGREES), 0), GRID_COLUMNS - 1)
+
+
+def get_grid_cell(latitude: float | None, longitude: float | None) -> int | None:
+    """Return row-major number of 0.1° grid cell containing the point"""
+    if latitude is None or longitude is None:
+        return None
+    return _get_grid_row(latitude) * GRID_COLUMNS + _get_grid_column(longitude)
+
+
+def get_bbox_filter(bbox: BoundingBox) -> Q:
+    """Return filter of points inside (min_lat, min_lon, max_lat, max_lon), longitudes may cross 180°.
+
+    Each grid row covered by the box is a contiguous range of cell numbers, so the filter is a few
+    range scans on the geo_cell index refined by exact coordinates.
+    """
+    min_latitude, min_longitude, max_latitude, max_longitude = bbox
+    first_column, last_column = _get_grid_column(min_longitude), _get_grid_column(max_longitude)
+    if min_longitude <= max_longitude:
+        column_spans = [(first_column, last_column)]
+        longitude_filter = Q(longitude__gte=min_longitude, longitude__lte=max_longitude)
+    else:
+        column_spans = [(first_column, GRID_COLUMNS - 1), (0, last_column)]
+        longitude_filter = Q(longitude__gte=min_longitude) | Q(longitude__lte=max_longitude)
+
+    rows = range(_get_grid_row(min_latitude), _get_grid_row(max_latitude) + 1)
+    cells_filter = Q()
+    if len(rows) <= MAX_GRID_ROWS:
+        for row in rows:
+            for first, last in column_spans:
+                cells_filter |= Q(geo_cell__range=(row * GRID_COLUMNS + first, row * GRID_COLUMNS + last))
+    return cells_filter & Q(latitude__gte=min_latitude, latitude__lte=max_latitude) & longitude_filter
+
+
+def get_bbox_around(latitude: float, longitude: float, radius_km: float) -> BoundingBox:
+    """Return bounding box of circle with center at the point"""
+    latitude_delta = radius_km / KM_PER_LATITUDE_DEGREE
+    min_latitude, max_latitude = max(latitude - latitude_delta, -90.0), min(latitude + latitude_delta, 90.0)
+    cos_latitude = math.cos(math.radians(max(abs(min_latitude), abs(max_latitude))))
+    if cos_latitude < 1e-6 or radius_km / (KM_PER_LATITUDE_DEGREE * cos_latitude) >= 180:
+        return min_latitude, -180.0, max_latitude, 180.0
+    longitude_delta = radius_km / (KM_PER_LATITUDE_DEGREE * cos_latitude)
+    min_longitude = (longitude - longitude_delta + 540) % 360 - 180
+    max_longitude = (longitude + longitude_delta + 540) % 360 - 180
+    return min_latitude, min_longitude, max_latitude, max_longitude
+
+
+def get_distance_expression(latitude: float, longitude: float) -> CombinedExpression:
+    """Return haversine distance in km from the point to cottage coordinates"""
+    latitude_delta = Radians(F("latitude") - Value(latitude)) / 2
+    longitude_delta = Radians(F("longitude") - Value(longitude)) / 2
+    haversine = (Power(Sin(latitude_delta), 2) + Cos(Radians(Value(latitude))) * Cos(Radians(F("latitude"))) *
+                 Power(Sin(longitude_delta), 2))
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Least(Sqrt(haversine), Value(1.0)))
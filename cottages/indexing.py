@@ -0,0 +1,264 @@
+import logging
+import multiprocessing
+from collections import defaultdict
+from typing import Iterator
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections as db_connections
+from django.db import models
+from django.db.models import QuerySet
+from django.utils import timezone
+from django_elasticsearch_dsl import Document
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import BaseSignalProcessor
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl.connections import connections as es_connections
+
+from cottages.models import SearchIndexQueue
+
+logger = logging.getLogger(__name__)
+
+REINDEX_LOCK_KEY = "cottages:search-index:reindexing"
+REINDEX_TARGETS_KEY = "cottages:search-index:reindex-targets"
+
+
+def get_related_documents(model: type[models.Model]) -> set[type[Document]]:
+    """Return documents which include data of related model"""
+    return {
+        document for document in registry.get_documents(registry._related_models.get(model, []))
+        if model in document.django.related_models
+    }
+
+
+def get_related_pks(document: type[Document], instance: models.Model) -> list:
+    """Return primary keys of document instances that include data of the related instance"""
+    try:
+        related = document().get_instances_from_related(instance)
+    except ObjectDoesNotExist:
+        return []
+    if related is None:
+        return []
+    if isinstance(related, QuerySet):
+        return list(related.prefetch_related(None).order_by().values_list("pk", flat=True))
+    if isinstance(related, models.Model):
+        return [related.pk]
+    return [item.pk for item in related]
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """Record changed instances in SearchIndexQueue, documents are updated in bulk by Celery.
+
+    Changes of related models are resolved to documents in the worker, so renaming a town
+    does not reindex its cottages inside the request.
+    """
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+        models.signals.m2m_changed.connect(self.handle_m2m_changed)
+        models.signals.pre_delete.connect(self.handle_pre_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+        models.signals.m2m_changed.disconnect(self.handle_m2m_changed)
+        models.signals.pre_delete.disconnect(self.handle_pre_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+        if instance.__class__ in registry:
+            SearchIndexQueue.objects.enqueue(instance.__class__, [instance.pk])
+
+    def handle_pre_delete(self, sender, instance, **kwargs):
+        """Queue documents including the instance while relation still exists"""
+        for document in get_related_documents(instance.__class__):
+            SearchIndexQueue.objects.enqueue(document.django.model, get_related_pks(document, instance))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if instance.__class__ in registry.get_models():
+            SearchIndexQueue.objects.enqueue(instance.__class__, [instance.pk])
+
+
+def get_pending_updates(entries: list[SearchIndexQueue], chunk_size: int,
+                        only: type[Document] | None = None) -> Iterator[tuple[type[Document], list, set[str]]]:
+    """Yield document, instances to index and ids to delete for queued entries, chunk_size ids at a time.
+
+    A change of related instance, like a town, expands to every document including it, so they are loaded by chunks.
+    With only, updates of other documents are skipped.
+    """
+    pks_by_model = defaultdict(set)
+    for entry in entries:
+        pks_by_model[apps.get_model(entry.model)].add(entry.object_id)
+
+    requested = defaultdict(set)
+    for model, pks in pks_by_model.items():
+        for document in registry.get_documents([model]):
+            if only in (None, document):
+                requested[document] |= pks
+        related_documents = {document for document in get_related_documents(model) if only in (None, document)}
+        if related_documents:
+            for instance in model._default_manager.filter(pk__in=pks):
+                for document in related_documents:
+                    requested[document] |= {str(pk) for pk in get_related_pks(document, instance)}
+
+    for document, pks in requested.items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), chunk_size):
+            chunk = set(pks[start:start + chunk_size])
+            instances = list(document().get_queryset().filter(pk__in=chunk))
+            yield document, instances, chunk - {str(instance.pk) for instance in instances}
+
+
+def write_documents(document: type[Document], index_name: str, instances: list, deleted_pks: set[str]) -> None:
+    """Write documents of instances into index and delete documents of deleted ids from it"""
+    document_instance = document()
+    client = document_instance._get_connection()
+    if instances:
+        actions = ({**action, "_index": index_name} for action in document_instance.get_actions(instances, "index"))
+        bulk(client, actions)
+    if deleted_pks:
+        actions = ({"_op_type": "delete", "_index": index_name, "_id": pk} for pk in deleted_pks)
+        bulk(client, actions, raise_on_error=False)
+
+
+def get_index_lag() -> float:
+    """Return age in seconds of the oldest change not yet written to Elasticsearch"""
+    oldest = SearchIndexQueue.objects.filter(written_at__isnull=True).order_by("queued_at").values_list(
+        "queued_at", flat=True
+    ).first()
+    return (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+
+def flush_index_queue(batch_size: int) -> int:
+    """Write one batch of queued changes to Elasticsearch, return number of processed entries.
+
+    Entries are claimed by a short transaction, Elasticsearch is called without database locks so requests
+    queueing the same objects do not wait for it. Entries are removed after they are written and released
+    if Elasticsearch fails, claims of a dead worker expire.
+    While a new index is filled by reindex_search, changes are written to the live alias and to the new index,
+    and their entries are kept to be replayed into the new index before alias swap, as fill workers may have
+    overwritten them with rows read earlier.
+    """
+    lag = get_index_lag()
+    entries = SearchIndexQueue.objects.claim(batch_size, skip_written=bool(cache.get(REINDEX_TARGETS_KEY)))
+    if not entries:
+        return 0
+    targets = cache.get(REINDEX_TARGETS_KEY) or {}
+    indexed = deleted = 0
+    try:
+        for document, instances, deleted_pks in get_pending_updates(entries, batch_size):
+            if instances:
+                document().update(instances)
+                indexed += len(instances)
+            if deleted_pks:
+                write_documents(document, document._index._name, [], deleted_pks)
+                deleted += len(deleted_pks)
+            if document._index._name in targets:
+                write_documents(document, targets[document._index._name], instances, deleted_pks)
+    except Exception:
+        SearchIndexQueue.objects.release(entries)
+        raise
+    if targets:
+        SearchIndexQueue.objects.mark_written(entries)
+    else:
+        SearchIndexQueue.objects.complete(entries)
+    logger.info("search index flush: entries=%d indexed=%d deleted=%d lag_seconds=%.1f",
+                len(entries), indexed, deleted, lag, extra={"entries": len(entries), "indexed": indexed,
+                                                            "deleted": deleted, "lag_seconds": round(lag, 1)})
+    return len(entries)
+
+
+def replay_written_changes(document: type[Document], index_name: str, chunk_size: int) -> int:
+    """Write again into new index changes flushed while it was filled, return number of replayed entries.
+
+    Changes flushed during a pass may be overwritten by rows the pass read earlier, so passes repeat
+    until no change is flushed meanwhile.
+    """
+    replayed = 0
+    written_since = None
+    while True:
+        started_at = timezone.now()
+        entries = SearchIndexQueue.objects.filter(written_at__isnull=False)
+        if written_since is not None:
+            entries = entries.filter(written_at__gte=written_since)
+        entries = list(entries)
+        if not entries:
+            return replayed
+        for _, instances, deleted_pks in get_pending_updates(entries, chunk_size, only=document):
+            write_documents(document, index_name, instances, deleted_pks)
+        replayed += len(entries)
+        written_since = started_at
+
+
+def get_pk_ranges(queryset: QuerySet, size: int) -> list[tuple]:
+    """Split queryset into ranges of size primary keys, the last range is open"""
+    pks = queryset.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=size)
+    boundaries = [pk for number, pk in enumerate(pks) if number % size == 0]
+    return list(zip(boundaries, boundaries[1:] + [None]))
+
+
+def index_pk_range(document: type[Document], index_name: str, pk_range: tuple, chunk_size: int) -> int:
+    """Write documents of instances with primary keys in range into index, return number of indexed"""
+    start, end = pk_range
+    queryset = document().get_queryset().filter(pk__gte=start).order_by("pk")
+    if end is not None:
+        queryset = queryset.filter(pk__lt=end)
+    document_instance = document()
+    actions = (
+        {**action, "_index": index_name}
+        for action in document_instance.get_actions(queryset.iterator(chunk_size=chunk_size), "index")
+    )
+    indexed, _ = bulk(document_instance._get_connection(), actions, chunk_size=chunk_size)
+    return indexed
+
+
+def init_reindex_worker() -> None:
+    """Open own Elasticsearch connection in forked worker, database connections are opened lazily"""
+    es_connections.remove_connection("default")
+    es_connections.configure(**settings.ELASTICSEARCH_DSL)
+
+
+def reindex_document(document: type[Document], workers: int, batch_size: int, chunk_size: int,
+                     keep_old: bool = False) -> tuple[str, int]:
+    """Build new versioned index of document in parallel and atomically point the alias to it.
+
+    Changes flushed meanwhile are written to the new index too and replayed into it before alias swap.
+    Return name of the new index and number of indexed documents.
+    """
+    alias = document._index._name
+    client = document._get_connection()
+    index_name = f"{alias}-{timezone.now():%Y%m%d%H%M%S%f}"
+    index = document._index.clone(name=index_name)
+    index.settings(refresh_interval="-1")
+    index.create()
+
+    cache.set(REINDEX_TARGETS_KEY, {alias: index_name}, timeout=None)
+    try:
+        ranges = get_pk_ranges(document().get_queryset(), batch_size)
+        tasks = [(document, index_name, pk_range, chunk_size) for pk_range in ranges]
+        if workers > 1 and len(tasks) > 1:
+            db_connections.close_all()
+            with multiprocessing.get_context("fork").Pool(min(workers, len(tasks)), init_reindex_worker) as pool:
+                indexed = sum(pool.starmap(index_pk_range, tasks))
+        else:
+            indexed = sum(index_pk_range(*task) for task in tasks)
+        replay_written_changes(document, index_name, chunk_size)
+        client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": None}})
+        client.indices.refresh(index=index_name)
+
+        actions = [{"add": {"index": index_name, "alias": alias}}]
+        old_indexes = []
+        if client.indices.exists_alias(name=alias):
+            old_indexes = list(client.indices.get_alias(name=alias))
+            actions = [{"remove": {"index": old_index, "alias": alias}} for old_index in old_indexes] + actions
+        elif client.indices.exists(index=alias):
+            actions.insert(0, {"remove_index": {"index": alias}})
+        client.indices.update_aliases(actions=actions)
+    finally:
+        cache.delete(REINDEX_TARGETS_KEY)
+    if not keep_old:
+        for old_index in old_indexes:
+            client.indices.delete(index=old_index, ignore_unavailable=True)
+    return index_name, indexed
@@ -0,0 +1,63 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from cottages.models import Cottage, CottageCategory, CottageImage
+from cottages.serializers import CottageInfoWithRatingSerializer
+from towns.models import Town
+
+
+class FieldsCottageInfoSerializer(CottageInfoWithRatingSerializer):
+    """Card rendering through declared serializer fields, as it was done before"""
+
+    def to_representation(self, instance):
+        data = serializers.ModelSerializer.to_representation(self, instance)
+        data['average_rating'] = round(float(data['average_rating']), 1)
+        data['price'] = int(instance.price)
+        return data
+
+
+class Command(BaseCommand):
+    help = "Measure cottage card serialization time without database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1000, help="Number of cottages in list")
+        parser.add_argument("--images", type=int, default=5, help="Number of images per cottage")
+        parser.add_argument("--repeat", type=int, default=5, help="Number of measurements, best is reported")
+
+    def handle(self, *args, **options):
+        cottages = self.build_cottages(options["count"], options["images"])
+        results = {}
+        for name, serializer_class in (("fields", FieldsCottageInfoSerializer),
+                                       ("hand-rolled", CottageInfoWithRatingSerializer)):
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                data = serializer_class(cottages, many=True).data
+                timings.append(time.perf_counter() - started)
+            results[name] = data
+            per_thousand = min(timings) / len(cottages) * 1000 * 1000
+            self.stdout.write(f"{name:>12}: {per_thousand:.1f} ms per 1000 cottages")
+        if [dict(card) for card in results["fields"]] != list(results["hand-rolled"]):
+            self.stderr.write("Serializers output differs")
+
+    @staticmethod
+    def build_cottages(count: int, images: int) -> list[Cottage]:
+        town = Town(id=uuid.uuid4(), name="Fiagdon")
+        category = CottageCategory(id=uuid.uuid4(), name="Коттедж")
+        cottages = []
+        for number in range(count):
+            cottage = Cottage(
+                id=uuid.uuid4(), town=town, category=category, name=f"Cottage {number}",
+                price=Decimal(5000 + number), guests=6, total_area=120, beds=4, rooms=3, average_rating=4.67
+            )
+            cottage._prefetched_objects_cache = {"images": [
+                CottageImage(id=uuid.uuid4(), cottage=cottage, image=f"cottage_images/{number}/{order}.jpg",
+                             order=order)
+                for order in range(images)
+            ]}
+            cottages.append(cottage)
+        return cottages
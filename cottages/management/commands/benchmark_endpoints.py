@@ -0,0 +1,117 @@
+import datetime
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chats.models import Chat
+from cottages.cache import invalidate_cottage_cache
+from cottages.models import Cottage
+from relations.models import UserCottageRent
+from users.models import User
+
+PROFILING_MIDDLEWARE = [
+    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'debug_toolbar_force.middleware.ForceDebugToolbarMiddleware',
+    'silk.middleware.SilkyMiddleware',
+]
+
+
+def percentile(values: list[float], percent: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(round(percent / 100 * (len(ordered) - 1)), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Measure latency percentiles and SQL query counts of main endpoints. "
+            "With --sizes sample data is generated into the configured database before each round")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=str, default="", help="Comma separated numbers of ready cottages")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint")
+        parser.add_argument("--cold", action="store_true", help="Invalidate cottage cache before each request")
+        parser.add_argument("--output", type=str, default="", help="Write results to JSON file")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size] or [None]
+        middleware = [name for name in settings.MIDDLEWARE if name not in PROFILING_MIDDLEWARE]
+        results = []
+        logging.getLogger("core.requests").setLevel(logging.WARNING)
+        with override_settings(MIDDLEWARE=middleware):
+            for size in sizes:
+                if size:
+                    self.fill_database(size)
+                results += self.run_round(options["requests"], options["cold"])
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+
+    def fill_database(self, size: int) -> None:
+        missing = size - Cottage.objects.filter(is_ready=True).count()
+        if missing > 0:
+            call_command("generate_sample_data", cottages=missing, users=max(missing // 10, 2),
+                         towns=max(missing // 100, 1), chats=max(missing // 10, 1), stdout=self.stdout)
+
+    def get_endpoints(self) -> list[tuple[str, list[str], User | None]]:
+        cottage_ids = list(Cottage.objects.filter(is_ready=True).values_list("id", flat=True)[:100])
+        today = timezone.localdate()
+        dates = f"start_date={today + datetime.timedelta(days=7)}&end_date={today + datetime.timedelta(days=10)}"
+        endpoints = [
+            ("cottage-list", [reverse("cottage-list")], None),
+            ("cottage-list-dates", [f"{reverse('cottage-list')}?{dates}"], None),
+            ("cottage-detail", [reverse("cottage-detail", args=[cottage_id]) for cottage_id in cottage_ids], None),
+            ("cottage-search", [f"{reverse('cottage-search')}?query=Cottage"], None),
+        ]
+        renter = UserCottageRent.objects.values("user_id").annotate(rents=Count("id")).order_by("-rents").first()
+        if renter:
+            endpoints.append(("my-rents", [reverse("my-rents")], User.objects.get(pk=renter["user_id"])))
+        chat = Chat.objects.annotate(messages_count=Count("messages")).order_by("-messages_count").first()
+        if chat:
+            member = chat.users.first()
+            endpoints.append(("user-chat-list", [reverse("user-chat-list")], member))
+            endpoints.append(("user-chat-detail", [reverse("user-chat-detail", args=[chat.id])], member))
+        return endpoints
+
+    def run_round(self, requests: int, cold: bool) -> list[dict]:
+        size = Cottage.objects.filter(is_ready=True).count()
+        results = []
+        for name, urls, user in self.get_endpoints():
+            client = Client(SERVER_NAME="localhost")
+            if user:
+                client.force_login(user)
+            timings, queries_counts, errors = [], [], 0
+            for number in range(requests):
+                if cold:
+                    invalidate_cottage_cache()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    try:
+                        response = client.get(urls[number % len(urls)])
+                        errors += response.status_code >= 400
+                    except Exception:
+                        errors += 1
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries_counts.append(len(queries))
+            results.append({
+                "size": size, "endpoint": name, "requests": requests, "errors": errors,
+                "p50_ms": round(percentile(timings, 50), 2), "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "queries_avg": round(sum(queries_counts) / len(queries_counts), 1), "queries_max": max(queries_counts),
+            })
+        return results
+
+    def print_results(self, results: list[dict]) -> None:
+        columns = ["size", "endpoint", "requests", "errors", "p50_ms", "p95_ms", "p99_ms", "queries_avg", "queries_max"]
+        self.stdout.write(" ".join(f"{column:>18}" for column in columns))
+        for row in results:
+            self.stdout.write(" ".join(f"{row[column]:>18}" for column in columns))
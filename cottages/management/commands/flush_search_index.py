@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cottages.indexing import flush_index_queue, get_index_lag
+from cottages.models import SearchIndexQueue
+
+
+class Command(BaseCommand):
+    help = "Show Elasticsearch update queue lag and write queued changes to Elasticsearch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.SEARCH_INDEX_BATCH_SIZE)
+        parser.add_argument("--stats", action="store_true", help="Only show queue size and lag")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Queued: {SearchIndexQueue.objects.count()}, lag: {get_index_lag():.1f} s")
+        if options["stats"]:
+            return
+        total = 0
+        while processed := flush_index_queue(options["batch_size"]):
+            total += processed
+        self.stdout.write(self.style.SUCCESS(f"Flushed {total} queued changes"))
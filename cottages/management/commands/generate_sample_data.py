@@ -0,0 +1,161 @@
+import datetime
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from chats.models import Chat, Message
+from cottages.cache import invalidate_cottage_cache
+from cottages.geo import get_grid_cell
+from cottages.models import Cottage, CottageCategory, CottageImage
+from relations.models import UserCottageLike, UserCottageRent, UserCottageReview
+from towns.models import Town
+from users.models import User
+
+CATEGORIES = ["Коттедж", "Дом", "Шале", "Глэмпинг"]
+RULES = ["with_children", "with_pets", "parties", "need_documents"]
+AMENITIES = ["wifi", "tv", "air_conditioner", "hair_dryer", "electric_kettle", "parking", "sauna"]
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, towns, cottages, reviews, rents, likes and chats with bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--towns", type=int, default=10)
+        parser.add_argument("--cottages", type=int, default=1000)
+        parser.add_argument("--images", type=int, default=3, help="Images per cottage")
+        parser.add_argument("--reviews", type=int, default=5, help="Reviews per cottage")
+        parser.add_argument("--rents", type=int, default=10, help="Rents per cottage")
+        parser.add_argument("--likes", type=int, default=5, help="Liked cottages per user")
+        parser.add_argument("--chats", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=20, help="Messages per chat")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.token = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            users = self.create_users(options["users"])
+            towns = self.create_towns(options["towns"])
+            categories = [CottageCategory.objects.get_or_create(name=name)[0].id for name in CATEGORIES]
+            cottages = self.create_cottages(options, users, towns, categories)
+            self.create_likes(users, cottages, options["likes"])
+            self.create_chats(users, options["chats"], options["messages"])
+            Cottage.objects.rebuild_rating_summary(batch_size=self.batch_size)
+        invalidate_cottage_cache()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(users)} users, {len(towns)} towns, {len(cottages)} cottages, {options['chats']} chats. "
+            f"Run ./manage.py reindex_search to index them"
+        ))
+
+    def create_users(self, count: int) -> list[uuid.UUID]:
+        password = make_password("Sample123")
+        users = [
+            User(email=f"user-{self.token}-{number}@example.com", password=password,
+                 first_name=f"Имя{number}", last_name=f"Фамилия{number}")
+            for number in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return [user.id for user in users]
+
+    def create_towns(self, count: int) -> list[uuid.UUID]:
+        towns = [Town(name=f"Town {self.token}-{number}", description="Населенный пункт") for number in range(count)]
+        Town.objects.bulk_create(towns, batch_size=self.batch_size)
+        return [town.id for town in towns]
+
+    def create_cottages(self, options: dict, users: list, towns: list, categories: list) -> list[uuid.UUID]:
+        cottage_ids = []
+        image_order = (CottageImage.objects.aggregate(Max("order"))["order__max"] or 0) + 1
+        for offset in range(0, options["cottages"], self.batch_size):
+            cottages = []
+            for number in range(offset, min(offset + self.batch_size, options["cottages"])):
+                latitude = round(self.random.uniform(42.6, 43.3), 6)
+                longitude = round(self.random.uniform(43.9, 44.9), 6)
+                guests = self.random.randint(1, 20)
+                cottages.append(Cottage(
+                    owner_id=self.random.choice(users), town_id=self.random.choice(towns),
+                    category_id=self.random.choice(categories), name=f"Cottage {self.token}-{number}",
+                    description="Синтетический коттедж", address=f"Улица {number}",
+                    latitude=latitude, longitude=longitude, geo_cell=get_grid_cell(latitude, longitude),
+                    price=Decimal(self.random.randrange(2000, 40000, 500)), guests=guests,
+                    beds=max(guests // 2, 1), rooms=min(max(guests // 3, 1), 15),
+                    total_area=self.random.randint(30, 500), parking_places=self.random.randint(0, 5),
+                    check_in_time=datetime.time(hour=14), check_out_time=datetime.time(hour=12),
+                    rules=self.random.sample(RULES, 2), amenities=self.random.sample(AMENITIES, 4), is_ready=True,
+                ))
+            Cottage.objects.bulk_create(cottages)
+            batch_ids = [cottage.id for cottage in cottages]
+            image_order = self.create_images(batch_ids, options["images"], image_order)
+            self.create_reviews(batch_ids, users, options["reviews"])
+            self.create_rents(batch_ids, users, options["rents"])
+            cottage_ids += batch_ids
+        return cottage_ids
+
+    def create_images(self, cottages: list, count: int, order: int) -> int:
+        images = []
+        for cottage_id in cottages:
+            for number in range(count):
+                images.append(CottageImage(cottage_id=cottage_id, image=f"cottage_images/{cottage_id}/{number}.jpg",
+                                           order=order))
+                order += 1
+        CottageImage.objects.bulk_create(images, batch_size=self.batch_size)
+        return order
+
+    def create_reviews(self, cottages: list, users: list, count: int) -> None:
+        reviews = []
+        for cottage_id in cottages:
+            for _ in range(count):
+                ratings = {field: self.random.randint(1, 5) for field in UserCottageReview.RATING_FIELDS}
+                reviews.append(UserCottageReview(
+                    cottage_id=cottage_id, user_id=self.random.choice(users), comment="Синтетический отзыв",
+                    rating=sum(ratings.values()) / 4.0, **ratings
+                ))
+        UserCottageReview.objects.bulk_create(reviews, batch_size=self.batch_size)
+
+    def create_rents(self, cottages: list, users: list, count: int) -> None:
+        """Create consecutive not overlapping rents ending about a month ahead of today"""
+        rents = []
+        for cottage_id in cottages:
+            start_date = timezone.localdate() - datetime.timedelta(days=int(count * 4.5) - 30)
+            for _ in range(count):
+                start_date += datetime.timedelta(days=self.random.randint(0, 3))
+                end_date = start_date + datetime.timedelta(days=self.random.randint(1, 5))
+                rents.append(UserCottageRent(
+                    cottage_id=cottage_id, user_id=self.random.choice(users), start_date=start_date,
+                    end_date=end_date, status=self.random.choice([1, 2, 2, 3, 4]),
+                ))
+                start_date = end_date
+        UserCottageRent.objects.bulk_create(rents, batch_size=self.batch_size)
+
+    def create_likes(self, users: list, cottages: list, count: int) -> None:
+        likes = [
+            UserCottageLike(user_id=user_id, cottage_id=cottage_id)
+            for user_id in users
+            for cottage_id in self.random.sample(cottages, min(count, len(cottages)))
+        ]
+        UserCottageLike.objects.bulk_create(likes, batch_size=self.batch_size)
+
+    def create_chats(self, users: list, count: int, messages_count: int) -> None:
+        if len(users) < 2:
+            return
+        chats = [Chat() for _ in range(count)]
+        Chat.objects.bulk_create(chats, batch_size=self.batch_size)
+        memberships, messages = [], []
+        for chat in chats:
+            members = self.random.sample(users, 2)
+            memberships += [Chat.users.through(chat_id=chat.id, user_id=user_id) for user_id in members]
+            for number in range(messages_count):
+                messages.append(Message(chat_id=chat.id, user_id=members[number % 2], content=f"Сообщение {number}"))
+            if messages_count:
+                chat.last_message = messages[-1]
+        Chat.users.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+        Message.objects.bulk_create(messages, batch_size=self.batch_size)
+        Chat.objects.bulk_update(chats, ["last_message"], batch_size=self.batch_size)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from cottages.models import Cottage
+
+
+class Command(BaseCommand):
+    help = "Rebuild rating summary of cottages from reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of cottages updated per query")
+
+    def handle(self, *args, **options):
+        updated = Cottage.objects.rebuild_rating_summary(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rating summary rebuilt for {updated} cottages"))
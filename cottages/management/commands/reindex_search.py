@@ -0,0 +1,42 @@
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from cottages.documents import CottageDocument, TownDocument
+from cottages.indexing import REINDEX_LOCK_KEY, flush_index_queue, reindex_document
+
+DOCUMENTS = {"cottage": CottageDocument, "town": TownDocument}
+
+
+class Command(BaseCommand):
+    help = ("Rebuild search indexes without downtime: fill new versioned indexes from parallel workers "
+            "and atomically swap aliases, changes flushed meanwhile are written to both indexes")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=str, default=",".join(DOCUMENTS), help="Comma separated indexes")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per worker task")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per query and bulk request")
+        parser.add_argument("--lock-timeout", type=int, default=60 * 60 * 2)
+        parser.add_argument("--keep-old", action="store_true", help="Do not delete previous indexes")
+
+    def handle(self, *args, **options):
+        names = [name for name in options["documents"].split(",") if name]
+        unknown = set(names) - set(DOCUMENTS)
+        if unknown:
+            raise CommandError(f"Unknown indexes: {', '.join(sorted(unknown))}")
+        if not cache.add(REINDEX_LOCK_KEY, True, timeout=options["lock_timeout"]):
+            raise CommandError("Reindex is already running")
+        try:
+            for name in names:
+                index_name, indexed = reindex_document(DOCUMENTS[name], options["workers"], options["batch_size"],
+                                                       options["chunk_size"], options["keep_old"])
+                self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} documents into {index_name}"))
+        finally:
+            cache.delete(REINDEX_LOCK_KEY)
+        flushed = 0
+        while processed := flush_index_queue(settings.SEARCH_INDEX_BATCH_SIZE):
+            flushed += processed
+        self.stdout.write(self.style.SUCCESS(f"Applied {flushed} changes queued during reindex"))
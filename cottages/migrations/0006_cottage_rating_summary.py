@@ -0,0 +1,84 @@
+# Generated by Django 4.2 on 2026-10-18 11:45
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+RATING_FIELDS = ("location_rating", "cleanliness_rating", "communication_rating", "value_rating")
+
+
+def fill_rating_summary(apps, schema_editor):
+    Cottage = apps.get_model("cottages", "Cottage")
+    UserCottageReview = apps.get_model("relations", "UserCottageReview")
+    summaries = UserCottageReview.objects.order_by().values("cottage_id").annotate(
+        reviews_count=Count("id"), **{f"{field}_sum": Sum(field) for field in RATING_FIELDS}
+    )
+    for summary in summaries:
+        count = summary["reviews_count"]
+        values = {"reviews_count": count}
+        for field in RATING_FIELDS:
+            values[f"{field}_sum"] = summary[f"{field}_sum"]
+            values[f"average_{field}"] = round(summary[f"{field}_sum"] / count, 1)
+        values["average_rating"] = round(sum(summary[f"{field}_sum"] for field in RATING_FIELDS) / (count * 4), 1)
+        Cottage.objects.filter(pk=summary["cottage_id"]).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0005_alter_cottage_is_ready'),
+        ('relations', '0005_alter_usercottagerent_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cottage',
+            name='average_cleanliness_rating',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='Рейтинг чистоты'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='average_communication_rating',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='Рейтинг общения'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='average_location_rating',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='Рейтинг местоположения'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='average_rating',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='Рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='average_value_rating',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='Рейтинг цена/качество'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='cleanliness_rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='communication_rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='location_rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во отзывов'),
+        ),
+        migrations.AddField(
+            model_name='cottage',
+            name='value_rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0006_cottage_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['average_rating', 'id'], name='cottage_ready_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['price', 'id'], name='cottage_ready_price_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+def fill_geo_cell(apps, schema_editor):
+    Cottage = apps.get_model("cottages", "Cottage")
+    cottages = []
+    for cottage in Cottage.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+            "id", "latitude", "longitude").iterator():
+        row = min(max(int((cottage.latitude + 90) / 0.1), 0), 1799)
+        column = min(max(int((cottage.longitude + 180) / 0.1), 0), 3599)
+        cottage.geo_cell = row * 3600 + column
+        cottages.append(cottage)
+    Cottage.objects.bulk_update(cottages, ["geo_cell"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0007_cottage_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cottage',
+            name='geo_cell',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['geo_cell'], name='cottage_ready_geo_cell_idx'),
+        ),
+        migrations.RunPython(fill_geo_cell, migrations.RunPython.noop),
+    ]
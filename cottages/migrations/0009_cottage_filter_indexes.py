@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0008_cottage_geo_cell'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['town', 'average_rating', 'id'], name='cottage_ready_town_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['town', 'price', 'id'], name='cottage_ready_town_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cottage',
+            index=models.Index(condition=models.Q(('is_ready', True)), fields=['category', 'average_rating', 'id'], name='cottage_ready_category_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 12:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0009_cottage_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='Модель')),
+                ('object_id', models.CharField(max_length=64, verbose_name='ID объекта')),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время изменения')),
+            ],
+            options={
+                'verbose_name': 'Обновление поискового индекса',
+                'verbose_name_plural': 'Очередь обновлений поискового индекса',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchindexqueue',
+            index=models.Index(fields=['queued_at'], name='search_index_queue_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchindexqueue',
+            constraint=models.UniqueConstraint(fields=('model', 'object_id'), name='search_index_queue_unique_object'),
+        ),
+    ]
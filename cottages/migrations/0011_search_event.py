@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 12:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0010_search_index_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.IntegerField(choices=[(1, 'Поиск'), (2, 'Подсказка'), (3, 'Просмотр')], verbose_name='Тип')),
+                ('query', models.CharField(blank=True, max_length=255, verbose_name='Запрос')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время')),
+                ('cottage', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_events', to='cottages.cottage', verbose_name='Коттедж')),
+            ],
+            options={
+                'verbose_name': 'Поисковое событие',
+                'verbose_name_plural': 'Поисковые события',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchevent',
+            index=models.Index(fields=['cottage', 'created_at'], name='search_event_cottage_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchevent',
+            index=models.Index(fields=['created_at'], name='search_event_time_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 12:48
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0011_search_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CottagePriceRule',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='Название')),
+                ('start_date', models.DateField(blank=True, null=True, verbose_name='Первая ночь')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='Последняя ночь')),
+                ('weekdays', models.JSONField(blank=True, default=list, verbose_name='Дни недели (0 - понедельник)')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена за ночь')),
+                ('priority', models.PositiveSmallIntegerField(default=0, verbose_name='Приоритет')),
+                ('cottage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_rules', to='cottages.cottage', verbose_name='Коттедж')),
+            ],
+            options={
+                'verbose_name': 'Цена коттеджа',
+                'verbose_name_plural': 'Цены коттеджей',
+            },
+        ),
+    ]
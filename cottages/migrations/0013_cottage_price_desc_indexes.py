@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 13:05
+
+from django.db import migrations
+
+PRICE_DESC_INDEXES = {
+    "cottage_ready_price_desc_idx": "(price DESC NULLS LAST, id DESC)",
+    "cottage_town_price_desc_idx": "(town_id, price DESC NULLS LAST, id DESC)",
+}
+
+
+def create_price_desc_indexes(apps, schema_editor):
+    """Serve descending price ordering with cottages without price last, SQLite has no NULLS LAST in indexes"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, columns in PRICE_DESC_INDEXES.items():
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON cottages_cottage {columns} WHERE is_ready")
+
+
+def drop_price_desc_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in PRICE_DESC_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0012_cottage_price_rule'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_price_desc_indexes, drop_price_desc_indexes),
+    ]
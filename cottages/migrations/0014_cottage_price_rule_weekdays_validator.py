@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+import cottages.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0013_cottage_price_desc_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cottagepricerule',
+            name='weekdays',
+            field=models.JSONField(blank=True, default=list, validators=[cottages.models.validate_weekdays], verbose_name='Дни недели (0 - понедельник)'),
+        ),
+    ]
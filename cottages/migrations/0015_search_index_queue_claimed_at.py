@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0014_cottage_price_rule_weekdays_validator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время начала записи'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cottages', '0015_search_index_queue_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='written_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время записи при переиндексации'),
+        ),
+    ]
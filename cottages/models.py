@@ -1,16 +1,25 @@
+import datetime
 import os
 import uuid
-from typing import Union
+from typing import Iterable, Union
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Avg, ExpressionWrapper, FloatField, Q
-from django.db.models.functions import Coalesce, Round
-from django.db.models.signals import pre_delete
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q, QuerySet, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
+from django_elasticsearch_dsl.apps import DEDConfig
 from ordered_model.models import OrderedModel
 
-from relations.models import UserCottageRent
+from core.celery import app
+from cottages.cache import invalidate_cottage_availability, invalidate_cottage_cache, invalidate_cottage_prices
+from cottages.geo import get_grid_cell
+from relations.models import UserCottageRent, UserCottageReview
 from towns.models import Town
 from users.models import User
 
@@ -27,39 +36,82 @@ class CottageCategory(models.Model):
         return self.name
 
 
+def count_subquery(queryset: QuerySet) -> Coalesce:
+    """Return number of rows of queryset filtered by OuterRef("pk") of cottage"""
+    return Coalesce(Subquery(queryset.order_by().values("cottage").annotate(count=Count("pk")).values("count")), 0)
+
+
 class CottageManager(models.Manager):
 
     def get_cottages_list(self, start_date: str = None, end_date: str = None) -> models.QuerySet:
-        """Return cottages with annotated rating"""
+        """Return cottages with rating summary, only fields shown on cottage card are loaded"""
+        images = CottageImage.objects.only("id", "cottage_id", "image", "order")
         cottages = self.filter(is_ready=True).select_related("category", "town").prefetch_related(
-            "images", "reviews").annotate(
-            average_rating=Coalesce(ExpressionWrapper(Round(Avg("reviews__rating"), 1),
-                                                      output_field=FloatField()), 0.0)
-        )
+            Prefetch("images", queryset=images)).only(*Cottage.CARD_FIELDS)
         if start_date and end_date:
-            booked_cottages_ids = self._get_booked_cottages_ids(start_date, end_date)
-            cottages = cottages.exclude(id__in=booked_cottages_ids)
+            booked_rents = UserCottageRent.objects.get_overlapping_rents(start_date, end_date)
+            cottages = cottages.filter(~Exists(booked_rents.filter(cottage=OuterRef("pk"))))
         return cottages
 
     def get_cottage_by_id(self, id: uuid.UUID) -> Union["Cottage", None]:
         """Return cottage by ID"""
-        cottage = self.filter(id=id).select_related("town", "category", "owner").prefetch_related("images").annotate(
-            average_rating=Coalesce(Avg("reviews__rating"), 0.0),
-            average_location_rating=Coalesce(Avg("reviews__location_rating"), 0.0),
-            average_cleanliness_rating=Coalesce(Avg("reviews__cleanliness_rating"), 0.0),
-            average_communication_rating=Coalesce(Avg("reviews__communication_rating"), 0.0),
-            average_value_rating=Coalesce(Avg("reviews__value_rating"), 0.0)
-        ).first()
+        cottage = self.filter(id=id).select_related("town", "category", "owner").prefetch_related("images").first()
         return cottage
 
-    # noinspection PyMethodMayBeStatic
-    def _get_booked_cottages_ids(self, start_date: str, end_date: str) -> list[uuid.UUID]:
-        """Return id's of booked cottages on current dates"""
-        booked_cottages_ids = UserCottageRent.objects.filter(
-            Q(start_date__gte=start_date, start_date__lt=end_date) |
-            Q(start_date__lte=start_date, end_date__gt=start_date)
-        ).exclude(status=3).values_list('cottage')
-        return booked_cottages_ids
+    def get_popularity_annotations(self) -> dict:
+        """Return counts of submitted search results, views and bookings of cottage for the last SEARCH_POPULARITY_DAYS.
+
+        Suggest requests are not counted, every typed letter would be a query.
+        """
+        since = timezone.now() - datetime.timedelta(days=settings.SEARCH_POPULARITY_DAYS)
+        events = SearchEvent.objects.filter(cottage=OuterRef("pk"), created_at__gte=since)
+        bookings = UserCottageRent.objects.filter(cottage=OuterRef("pk"), start_date__gte=since.date()).exclude(
+            status=3)
+        return {
+            "popularity_queries": count_subquery(events.filter(kind=SearchEvent.SEARCH)),
+            "popularity_views": count_subquery(events.filter(kind=SearchEvent.VIEW)),
+            "popularity_bookings": count_subquery(bookings),
+        }
+
+    def update_rating_summary(self, cottage_id: uuid.UUID, added: dict = None, removed: dict = None) -> None:
+        """Apply ratings of added and removed reviews to the rating summary of cottage"""
+        cottage = self.select_for_update().filter(pk=cottage_id).only(*Cottage.RATING_SUMMARY_FIELDS).first()
+        if cottage is None:
+            return
+        for ratings, sign in ((added, 1), (removed, -1)):
+            if not ratings:
+                continue
+            cottage.reviews_count += sign
+            for field, value in ratings.items():
+                setattr(cottage, f"{field}_sum", getattr(cottage, f"{field}_sum") + sign * value)
+        cottage.calculate_average_ratings()
+        self.filter(pk=cottage_id).update(
+            **{field: getattr(cottage, field) for field in Cottage.RATING_SUMMARY_FIELDS}
+        )
+        SearchIndexQueue.objects.enqueue(Cottage, [cottage_id])
+
+    def rebuild_rating_summary(self, batch_size: int = 500) -> int:
+        """Recalculate rating summary of all cottages from reviews, return number of cottages"""
+        summaries = {
+            summary.pop("cottage_id"): summary
+            for summary in UserCottageReview.objects.order_by().values("cottage_id").annotate(
+                reviews_count=Count("id"),
+                **{f"{field}_sum": Sum(field) for field in UserCottageReview.RATING_FIELDS}
+            )
+        }
+        updated, batch = 0, []
+        for cottage in self.only("id").iterator(chunk_size=batch_size):
+            summary = summaries.get(cottage.id, {})
+            for field in Cottage.RATING_SUMMARY_FIELDS:
+                setattr(cottage, field, summary.get(field, 0))
+            cottage.calculate_average_ratings()
+            batch.append(cottage)
+            if len(batch) >= batch_size:
+                updated += self.bulk_update(batch, Cottage.RATING_SUMMARY_FIELDS)
+                batch = []
+        if batch:
+            updated += self.bulk_update(batch, Cottage.RATING_SUMMARY_FIELDS)
+        return updated
 
 
 class Cottage(models.Model):
@@ -90,25 +142,68 @@ class Cottage(models.Model):
     rules = models.JSONField(verbose_name="Правила", blank=True, null=True)
     amenities = models.JSONField(verbose_name="Условия", blank=True, null=True)
     is_ready = models.BooleanField(default=False)
+    geo_cell = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    reviews_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Кол-во отзывов")
+    location_rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    cleanliness_rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    communication_rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    value_rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0.0, editable=False, verbose_name="Рейтинг")
+    average_location_rating = models.FloatField(default=0.0, editable=False, verbose_name="Рейтинг местоположения")
+    average_cleanliness_rating = models.FloatField(default=0.0, editable=False, verbose_name="Рейтинг чистоты")
+    average_communication_rating = models.FloatField(default=0.0, editable=False, verbose_name="Рейтинг общения")
+    average_value_rating = models.FloatField(default=0.0, editable=False, verbose_name="Рейтинг цена/качество")
+
+    CARD_FIELDS = [
+        "id", "name", "price", "guests", "total_area", "beds", "rooms", "average_rating",
+        "town__id", "town__name", "category__id", "category__name",
+    ]
+    RATING_SUMMARY_FIELDS = [
+        "reviews_count", "location_rating_sum", "cleanliness_rating_sum", "communication_rating_sum",
+        "value_rating_sum", "average_rating", "average_location_rating", "average_cleanliness_rating",
+        "average_communication_rating", "average_value_rating",
+    ]
 
     objects = CottageManager()
 
     class Meta:
         verbose_name = 'Коттедж'
         verbose_name_plural = 'Коттеджи'
+        indexes = [
+            models.Index(fields=["average_rating", "id"], condition=Q(is_ready=True), name="cottage_ready_rating_idx"),
+            models.Index(fields=["price", "id"], condition=Q(is_ready=True), name="cottage_ready_price_idx"),
+            models.Index(fields=["geo_cell"], condition=Q(is_ready=True), name="cottage_ready_geo_cell_idx"),
+            models.Index(fields=["town", "average_rating", "id"], condition=Q(is_ready=True),
+                         name="cottage_ready_town_rating_idx"),
+            models.Index(fields=["town", "price", "id"], condition=Q(is_ready=True),
+                         name="cottage_ready_town_price_idx"),
+            models.Index(fields=["category", "average_rating", "id"], condition=Q(is_ready=True),
+                         name="cottage_ready_category_idx"),
+        ]
 
     def __str__(self):
         return f'{self.name} in {self.town.name}'
 
+    def save(self, *args, **kwargs):
+        self.geo_cell = get_grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "geo_cell"}
+        super().save(*args, **kwargs)
+
+    def calculate_average_ratings(self) -> None:
+        """Calculate rounded average ratings from rating sums"""
+        ratings_sum = 0
+        for field in UserCottageReview.RATING_FIELDS:
+            field_sum = getattr(self, f"{field}_sum")
+            ratings_sum += field_sum
+            setattr(self, f"average_{field}", round(field_sum / self.reviews_count, 1) if self.reviews_count else 0.0)
+        reviews_ratings_count = self.reviews_count * len(UserCottageReview.RATING_FIELDS)
+        self.average_rating = round(ratings_sum / reviews_ratings_count, 1) if reviews_ratings_count else 0.0
+
     def is_available(self, start_date: str, end_date: str):
         """Return True if cottage is available else False"""
-        existing_rents = self.rents.exclude(status=3)
-        is_available = not existing_rents.filter(
-            Q(start_date__gte=start_date, start_date__lt=end_date) |
-            Q(start_date__lte=start_date, end_date__gt=start_date)
-        ).exists()
-
-        return is_available
+        return not self.rents.get_overlapping_rents(start_date, end_date).exists()
 
 
 def cottage_image_path(instance, filename):
@@ -129,6 +224,197 @@ class CottageImage(OrderedModel):
         return f'Photo for {self.cottage.name}'
 
 
+class CottagePriceRuleManager(models.Manager):
+
+    def get_rules_for_period(self, start_date: datetime.date, end_date: datetime.date) -> QuerySet:
+        """Return rules applicable to nights from start_date to end_date, the first matching rule of night wins"""
+        return self.filter(
+            Q(start_date__isnull=True) | Q(start_date__lt=end_date),
+            Q(end_date__isnull=True) | Q(end_date__gte=start_date),
+        ).order_by("-priority", F("start_date").desc(nulls_last=True), "id")
+
+
+def validate_weekdays(value) -> None:
+    if not isinstance(value, list) or any(type(day) is not int or not 0 <= day <= 6 for day in value):
+        raise ValidationError("Дни недели должны быть списком чисел от 0 до 6")
+
+
+class CottagePriceRule(models.Model):
+    """Nightly price of cottage for a season or for weekdays, it replaces the base price of matching nights"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    cottage = models.ForeignKey(Cottage, on_delete=models.CASCADE, related_name="price_rules", verbose_name="Коттедж")
+    name = models.CharField(max_length=255, blank=True, verbose_name="Название")
+    start_date = models.DateField(blank=True, null=True, verbose_name="Первая ночь")
+    end_date = models.DateField(blank=True, null=True, verbose_name="Последняя ночь")
+    weekdays = models.JSONField(default=list, blank=True, validators=[validate_weekdays],
+                                verbose_name="Дни недели (0 - понедельник)")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена за ночь")
+    priority = models.PositiveSmallIntegerField(default=0, verbose_name="Приоритет")
+
+    objects = CottagePriceRuleManager()
+
+    class Meta:
+        verbose_name = 'Цена коттеджа'
+        verbose_name_plural = 'Цены коттеджей'
+
+    def __str__(self):
+        return f'{self.name or "Price"} {self.price} for cottage {self.cottage_id}'
+
+    def clean(self):
+        if self.start_date and self.end_date and self.start_date > self.end_date:
+            raise ValidationError({"end_date": "Последняя ночь не может быть раньше первой"})
+
+    def matches(self, night: datetime.date) -> bool:
+        """Return True if rule sets price of the night starting on the date"""
+        return ((self.start_date is None or self.start_date <= night) and
+                (self.end_date is None or night <= self.end_date) and
+                (not self.weekdays or night.weekday() in self.weekdays))
+
+
+class SearchIndexQueueManager(models.Manager):
+    FLUSH_SCHEDULED_KEY = "cottages:search-index:flush-scheduled"
+
+    def enqueue(self, model: type[models.Model], pks: Iterable) -> None:
+        """Queue Elasticsearch update of instances, repeated updates of an instance are coalesced.
+
+        Entry claimed by a running flush or written during a reindex is queued again, so the change is flushed
+        once more.
+        """
+        if not DEDConfig.autosync_enabled():
+            return
+        queued_at = timezone.now()
+        entries = [self.model(model=model._meta.label, object_id=str(pk), queued_at=queued_at) for pk in pks]
+        if not entries:
+            return
+        self.bulk_create(entries, update_conflicts=True, unique_fields=["model", "object_id"],
+                         update_fields=["claimed_at", "written_at"])
+        transaction.on_commit(self.schedule_flush)
+
+    def claim(self, batch_size: int, skip_written: bool = False) -> list["SearchIndexQueue"]:
+        """Claim up to batch_size oldest entries for a flush.
+
+        Entries stay in the queue until they are written, claims older than SEARCH_INDEX_CLAIM_TIMEOUT seconds
+        are taken over, so changes are not lost if a worker dies. Entries already written during a running reindex
+        are skipped with skip_written.
+        """
+        now = timezone.now()
+        expired_before = now - datetime.timedelta(seconds=settings.SEARCH_INDEX_CLAIM_TIMEOUT)
+        entries = self.select_for_update(skip_locked=True).filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=expired_before)
+        )
+        if skip_written:
+            entries = entries.filter(written_at__isnull=True)
+        with transaction.atomic(using=self.db):
+            entries = list(entries.order_by("queued_at")[:batch_size])
+            self.filter(pk__in=[entry.pk for entry in entries]).update(claimed_at=now)
+        for entry in entries:
+            entry.claimed_at = now
+        return entries
+
+    def complete(self, entries: list["SearchIndexQueue"]) -> None:
+        """Remove entries claimed together after they are written, entries queued again since the claim are kept"""
+        if entries:
+            self.filter(pk__in=[entry.pk for entry in entries], claimed_at=entries[0].claimed_at).delete()
+
+    def mark_written(self, entries: list["SearchIndexQueue"]) -> None:
+        """Keep entries claimed together after they are written during a reindex, they are replayed into new index"""
+        if entries:
+            self.filter(pk__in=[entry.pk for entry in entries], claimed_at=entries[0].claimed_at).update(
+                claimed_at=None, written_at=timezone.now()
+            )
+
+    def release(self, entries: list["SearchIndexQueue"]) -> None:
+        """Return entries claimed together by a failed flush to the queue"""
+        if entries:
+            self.filter(pk__in=[entry.pk for entry in entries], claimed_at=entries[0].claimed_at).update(
+                claimed_at=None
+            )
+
+    def schedule_flush(self) -> None:
+        """Schedule one flush task per delay window, updates queued meanwhile are flushed together"""
+        delay = settings.SEARCH_INDEX_FLUSH_DELAY
+        if cache.add(self.FLUSH_SCHEDULED_KEY, True, timeout=delay):
+            app.send_task("cottages.tasks.flush_search_index", countdown=delay)
+
+
+class SearchIndexQueue(models.Model):
+    model = models.CharField(max_length=100, verbose_name="Модель")
+    object_id = models.CharField(max_length=64, verbose_name="ID объекта")
+    queued_at = models.DateTimeField(default=timezone.now, verbose_name="Время изменения")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Время начала записи")
+    written_at = models.DateTimeField(null=True, blank=True, verbose_name="Время записи при переиндексации")
+
+    objects = SearchIndexQueueManager()
+
+    class Meta:
+        verbose_name = 'Обновление поискового индекса'
+        verbose_name_plural = 'Очередь обновлений поискового индекса'
+        constraints = [
+            models.UniqueConstraint(fields=["model", "object_id"], name="search_index_queue_unique_object"),
+        ]
+        indexes = [
+            models.Index(fields=["queued_at"], name="search_index_queue_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}"
+
+
+class SearchEvent(models.Model):
+    SEARCH = 1
+    SUGGEST = 2
+    VIEW = 3
+    KIND_CHOICES = [
+        (SEARCH, 'Поиск'),
+        (SUGGEST, 'Подсказка'),
+        (VIEW, 'Просмотр'),
+    ]
+    kind = models.IntegerField(choices=KIND_CHOICES, verbose_name="Тип")
+    query = models.CharField(max_length=255, blank=True, verbose_name="Запрос")
+    cottage = models.ForeignKey(Cottage, on_delete=models.CASCADE, null=True, blank=True, db_index=False,
+                                related_name="search_events", verbose_name="Коттедж")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Время")
+
+    class Meta:
+        verbose_name = 'Поисковое событие'
+        verbose_name_plural = 'Поисковые события'
+        indexes = [
+            models.Index(fields=["cottage", "created_at"], name="search_event_cottage_time_idx"),
+            models.Index(fields=["created_at"], name="search_event_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.query}"
+
+
 @receiver(pre_delete, sender=CottageImage)
 def delete_cottage_image(sender, instance, **kwargs):
     instance.image.delete(False)
+
+
+@receiver([post_save, post_delete], sender=Cottage)
+def invalidate_cottage_cache_on_cottage_change(sender, instance, **kwargs):
+    invalidate_cottage_cache(instance.pk)
+    invalidate_cottage_prices(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=CottagePriceRule)
+def invalidate_cottage_prices_on_rule_change(sender, instance, **kwargs):
+    invalidate_cottage_prices(instance.cottage_id)
+
+
+@receiver([post_save, post_delete], sender=CottageImage)
+@receiver([post_save, post_delete], sender=UserCottageReview)
+def invalidate_cottage_cache_on_relation_change(sender, instance, **kwargs):
+    invalidate_cottage_cache(instance.cottage_id)
+
+
+@receiver([post_save, post_delete], sender=UserCottageRent)
+def invalidate_cottage_availability_on_rent_change(sender, instance, **kwargs):
+    invalidate_cottage_availability([instance.cottage_id])
+
+
+@receiver([post_save, post_delete], sender=Town)
+@receiver([post_save, post_delete], sender=CottageCategory)
+def invalidate_cottage_list_cache(sender, instance, **kwargs):
+    invalidate_cottage_cache()
@@ -0,0 +1,143 @@
+import base64
+import json
+import uuid
+from collections import OrderedDict
+
+from django.db.models import F, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CottageKeysetPagination(BasePagination):
+    """Keyset pagination of cottages by (ordering field, id) with opaque cursors.
+
+    Cottages without value of a nullable ordering field go last in both directions.
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    ordering_query_param = "ordering"
+    ordering_fields = ("average_rating", "price", "distance")
+    nullable_fields = ("price",)
+    default_ordering = "-average_rating"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None) -> list:
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset)
+        self.page_size = self.get_page_size(request)
+        self.field = self.ordering.lstrip("-")
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor["reverse"])
+        descending = self.ordering.startswith("-") != reverse
+
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(cursor["value"], cursor["id"], descending, reverse))
+        results = list(queryset.order_by(*self.get_query_ordering(descending, reverse))[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = True if reverse else has_more
+        self.has_previous = has_more if reverse else bool(cursor)
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_ordering(self, request: Request, queryset: QuerySet) -> str:
+        """Return requested ordering if it is allowed, distance is allowed only for annotated queryset"""
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        field = ordering.lstrip("-")
+        if field not in self.ordering_fields or field == "distance" and field not in queryset.query.annotations:
+            return self.default_ordering
+        return ordering
+
+    def get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def get_query_ordering(self, descending: bool, reverse: bool) -> tuple:
+        if self.field not in self.nullable_fields:
+            return (f"-{self.field}", "-id") if descending else (self.field, "id")
+        field = F(self.field).desc(nulls_first=reverse, nulls_last=not reverse) if descending else F(
+            self.field).asc(nulls_first=reverse, nulls_last=not reverse)
+        return field, "-id" if descending else "id"
+
+    def get_keyset_filter(self, value: str | None, id: uuid.UUID, descending: bool, reverse: bool) -> Q:
+        """Return filter selecting rows after (value, id) in the current ordering, NULL values follow others"""
+        lookup = "lt" if descending else "gt"
+        if value is None:
+            after_nulls = Q(**{f"{self.field}__isnull": True, f"id__{lookup}": id})
+            return after_nulls | Q(**{f"{self.field}__isnull": False}) if reverse else after_nulls
+        after = Q(**{f"{self.field}__{lookup}": value}) | Q(**{self.field: value, f"id__{lookup}": id})
+        if self.field in self.nullable_fields and not reverse:
+            after |= Q(**{f"{self.field}__isnull": True})
+        return after
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        value = getattr(instance, self.field)
+        payload = {"v": str(value) if value is not None else None, "id": str(instance.id), "r": reverse}
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.ordering_query_param, self.ordering)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request: Request) -> dict | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if payload["v"] is not None:
+                float(payload["v"])
+            return {"value": payload["v"], "id": uuid.UUID(payload["id"]), "reverse": bool(payload["r"])}
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+def encode_search_cursor(offset: int, after: list | None = None, pit_id: str | None = None) -> str:
+    """Return opaque cursor of search results page.
+
+    Elasticsearch continues after sort values of the last hit in the point in time, the offset is used by
+    search backends without search_after.
+    """
+    payload = {"o": offset, "a": after, "p": pit_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_search_cursor(encoded: str) -> dict:
+    """Return offset, sort values and point in time id of search cursor, raise ValueError if it is invalid"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        cursor = {"offset": int(payload["o"]), "after": payload["a"], "pit": payload["p"]}
+    except (TypeError, KeyError, AttributeError):
+        raise ValueError("Invalid cursor")
+    if cursor["offset"] < 0 or cursor["after"] is not None and not isinstance(cursor["after"], list):
+        raise ValueError("Invalid cursor")
+    if cursor["pit"] is not None and not isinstance(cursor["pit"], str):
+        raise ValueError("Invalid cursor")
+    return cursor
@@ -0,0 +1,69 @@
+import datetime
+import uuid
+from decimal import Decimal
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from core.metrics import record_cache_lookup
+from cottages.cache import get_cottage_quote_cache_keys
+from cottages.models import Cottage, CottagePriceRule
+
+
+def get_nights(start_date: datetime.date, end_date: datetime.date) -> list[datetime.date]:
+    """Return dates of nights from check-in start_date to check-out end_date"""
+    return [start_date + datetime.timedelta(days=number) for number in range((end_date - start_date).days)]
+
+
+def calculate_stay_price(base_price: Decimal | None, rules: Iterable[CottagePriceRule],
+                         start_date: datetime.date, end_date: datetime.date) -> Decimal | None:
+    """Return sum of nightly prices, night price is the price of its first matching rule or the base price.
+
+    None is returned if price of some night is unknown.
+    """
+    rules = list(rules)
+    total = Decimal("0.00")
+    for night in get_nights(start_date, end_date):
+        price = next((rule.price for rule in rules if rule.matches(night)), base_price)
+        if price is None:
+            return None
+        total += price
+    return total
+
+
+def get_stay_price(cottage: Cottage, start_date: datetime.date, end_date: datetime.date) -> Decimal | None:
+    """Return current price of the stay without cache, used for payments"""
+    rules = cottage.price_rules.get_rules_for_period(start_date, end_date)
+    return calculate_stay_price(cottage.price, rules, start_date, end_date)
+
+
+def get_stay_quotes(cottage_ids: list[uuid.UUID], start_date: datetime.date, end_date: datetime.date) -> list[dict]:
+    """Return quotes of the stay for existing cottages in order of cottage_ids.
+
+    Quotes are cached per cottage and its prices version, missing ones are calculated by two queries.
+    """
+    cottage_ids = list(dict.fromkeys(cottage_ids))
+    keys = get_cottage_quote_cache_keys(cottage_ids, start_date, end_date)
+    cached = cache.get_many(list(keys.values()))
+    quotes = {cottage_id: cached[key] for cottage_id, key in keys.items() if key in cached}
+    missing = [cottage_id for cottage_id in cottage_ids if cottage_id not in quotes]
+    record_cache_lookup(not missing)
+    if missing:
+        rules = CottagePriceRule.objects.get_rules_for_period(start_date, end_date)
+        cottages = Cottage.objects.filter(pk__in=missing).only("id", "price").prefetch_related(
+            Prefetch("price_rules", queryset=rules)
+        )
+        calculated = {}
+        for cottage in cottages:
+            total = calculate_stay_price(cottage.price, cottage.price_rules.all(), start_date, end_date)
+            calculated[cottage.pk] = {
+                "cottage_id": str(cottage.pk), "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(), "nights": (end_date - start_date).days,
+                "total": str(total) if total is not None else None,
+            }
+        cache.set_many({keys[cottage_id]: quote for cottage_id, quote in calculated.items()},
+                       settings.COTTAGES_QUOTE_CACHE_TIMEOUT)
+        quotes.update(calculated)
+    return [quotes[cottage_id] for cottage_id in cottage_ids if cottage_id in quotes]
@@ -0,0 +1,286 @@
+from django.conf import settings
+from django.core.cache import cache
+from elastic_transport import TransportError
+from elasticsearch import ApiError, BadRequestError, NotFoundError
+from elasticsearch_dsl import MultiSearch, Search
+from elasticsearch_dsl.response import Response as SearchResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.metrics import record_cache_lookup
+from cottages.cache import get_cottage_facets_cache_key, get_cottage_suggest_cache_key
+from cottages.documents import CottageDocument, TownDocument
+from cottages.models import CottageImage
+from cottages.pagination import encode_search_cursor
+from cottages.serializers import get_file_url
+
+CARD_SOURCE_FIELDS = ["id", "town", "category", "name", "price", "guests", "total_area", "beds", "rooms",
+                      "average_rating", "images"]
+SORTING = {
+    "relevance": ["_score", {"average_rating": "desc"}, {"id": "asc"}],
+    "price": [{"price": "asc"}, {"id": "asc"}],
+    "-price": [{"price": "desc"}, {"id": "asc"}],
+    "-average_rating": [{"average_rating": "desc"}, {"id": "asc"}],
+}
+KEYWORD_SORT_FIELDS = {"id"}
+FACET_SIZE = 20
+GUESTS_FACET_RANGES = [("1-2", 1, 3), ("3-4", 3, 5), ("5-8", 5, 9), ("9+", 9, None)]
+NOT_FACET_PARAMS = ("page", "page_size", "ordering", "facets", "cursor")
+
+
+def get_search_offset(params: dict) -> int:
+    """Return number of results before the requested page"""
+    if params.get("cursor"):
+        return params["cursor"]["offset"]
+    return (params["page"] - 1) * params["page_size"]
+
+
+def build_cottage_search(params: dict, with_facets: bool = False) -> Search:
+    """Return search of ready cottages filtered, sorted and paginated in Elasticsearch.
+
+    One extra hit is requested to know if there is a next page. Pages of a cursor continue after sort values
+    of the previous hit, in its point in time if it is open, so deep pages cost the same as the first one.
+    With facets the matched cottages are also aggregated by category, town, guests and price.
+    """
+    search = CottageDocument.search().filter("term", is_ready=True)
+    if params.get("query"):
+        search = search.query("multi_match", query=params["query"], fields=["name", "town.name"])
+    for param, field, lookup in (("price_min", "price", "gte"), ("price_max", "price", "lte"),
+                                 ("guests", "guests", "gte"), ("beds", "beds", "gte"), ("rooms", "rooms", "gte"),
+                                 ("average_rating_min", "average_rating", "gte")):
+        if params.get(param) is not None:
+            search = search.filter("range", **{field: {lookup: params[param]}})
+    for param in ("category", "town"):
+        if params.get(param):
+            search = search.filter("term", **{f"{param}.id": str(params[param])})
+    for amenity in params.get("amenities", []):
+        search = search.filter("term", amenities=amenity)
+
+    if with_facets:
+        for name, field in (("categories", "category"), ("towns", "town")):
+            search.aggs.bucket(name, "terms", field=f"{field}.id", size=FACET_SIZE).metric(
+                "top", "top_hits", size=1, _source=[f"{field}.name"]
+            )
+        search.aggs.bucket("guests", "range", field="guests", ranges=[
+            {"key": key, "from": start, **({"to": end} if end else {})} for key, start, end in GUESTS_FACET_RANGES
+        ])
+        search.aggs.bucket("price", "histogram", field="price", interval=settings.SEARCH_PRICE_FACET_INTERVAL,
+                           min_doc_count=1)
+
+    search = search.sort(*SORTING[params["ordering"]]).source(CARD_SOURCE_FIELDS)
+    cursor = params.get("cursor")
+    if cursor and cursor["after"] is not None:
+        search = search.extra(search_after=cursor["after"])
+        if cursor["pit"]:
+            search = search.index().extra(pit={"id": cursor["pit"], "keep_alive": settings.SEARCH_PIT_KEEP_ALIVE})
+        return search[:params["page_size"] + 1]
+    offset = get_search_offset(params)
+    return search[offset:offset + params["page_size"] + 1]
+
+
+def get_facets(aggregations) -> dict:
+    """Return facets from aggregations of cottage search"""
+    interval = settings.SEARCH_PRICE_FACET_INTERVAL
+    facets = {
+        name: [
+            {"id": bucket.key, "name": bucket.top.hits.hits[0]._source[field].name, "count": bucket.doc_count}
+            for bucket in aggregations[name].buckets
+        ]
+        for name, field in (("categories", "category"), ("towns", "town"))
+    }
+    facets["guests"] = [
+        {"key": bucket.key, "count": bucket.doc_count} for bucket in aggregations.guests.buckets
+    ]
+    facets["price"] = [
+        {"from": int(bucket.key), "to": int(bucket.key) + interval, "count": bucket.doc_count}
+        for bucket in aggregations.price.buckets
+    ]
+    return facets
+
+
+def get_facets_cache_key(params: dict) -> str:
+    """Return cache key of facets, they depend only on the query and filters"""
+    normalized = {name: value for name, value in params.items() if name not in NOT_FACET_PARAMS}
+    normalized["query"] = normalize_suggest_query(normalized.get("query", ""))
+    normalized["amenities"] = ",".join(sorted(normalized.get("amenities", [])))
+    return get_cottage_facets_cache_key(normalized.items())
+
+
+def get_cached_facets(params: dict) -> dict | None:
+    facets = cache.get(get_facets_cache_key(params))
+    record_cache_lookup(facets is not None)
+    return facets
+
+
+def set_cached_facets(params: dict, facets: dict) -> None:
+    cache.set(get_facets_cache_key(params), facets, settings.COTTAGES_CACHE_TIMEOUT)
+
+
+def get_cottage_card(source: dict, request: Request = None) -> dict:
+    """Return cottage card from indexed document, the output matches CottageInfoWithRatingSerializer"""
+    storage = CottageImage._meta.get_field("image").storage
+    price = source.get("price")
+    return {
+        "id": source["id"],
+        "town": source.get("town"),
+        "category": source["category"],
+        "name": source["name"],
+        "price": int(price) if price is not None else None,
+        "guests": source["guests"],
+        "total_area": source["total_area"],
+        "beds": source["beds"],
+        "rooms": source["rooms"],
+        "average_rating": round(float(source["average_rating"]), 1),
+        "images": [
+            {"id": image["id"], "image": get_file_url(storage, image["image"], request), "order": image["order"]}
+            for image in source.get("images", [])
+        ],
+    }
+
+
+def get_search_page(params: dict, count: int, results: list[dict], request: Request,
+                    next_cursor: str | None = None) -> dict:
+    """Return search response page, next link has a cursor and previous link is given only for numbered pages"""
+    url = request.build_absolute_uri()
+    page = params["page"]
+    return {
+        "count": count,
+        "next": replace_query_param(remove_query_param(url, "page"), "cursor", next_cursor) if next_cursor else None,
+        "previous": replace_query_param(url, "page", page - 1) if page > 1 and not params.get("cursor") else None,
+        "results": results,
+    }
+
+
+def open_point_in_time() -> str | None:
+    """Return id of new point in time of cottage index or None if it is disabled or not supported by cluster"""
+    if not settings.SEARCH_PIT_KEEP_ALIVE:
+        return None
+    try:
+        return CottageDocument._get_connection().open_point_in_time(
+            index=CottageDocument._index._name, keep_alive=settings.SEARCH_PIT_KEEP_ALIVE
+        )["id"]
+    except ApiError:
+        return None
+
+
+def close_point_in_time(pit_id: str) -> None:
+    """Release point in time early, otherwise it expires after SEARCH_PIT_KEEP_ALIVE"""
+    try:
+        CottageDocument._get_connection().close_point_in_time(id=pit_id)
+    except (ApiError, TransportError):
+        pass
+
+
+def with_point_in_time(params: dict) -> dict:
+    """Return params with point in time opened for continued search.
+
+    The first page is searched in the live index and its cursor has no point in time, so searches which
+    are not continued do not hold one. It is opened by the second page and kept by the next ones.
+    """
+    cursor = params.get("cursor")
+    if not cursor or cursor["after"] is None or cursor["pit"]:
+        return params
+    return {**params, "cursor": {**cursor, "pit": open_point_in_time()}}
+
+
+def is_valid_search_after(ordering: str, after: list) -> bool:
+    """Return whether cursor sort values match sort keys of ordering, keyword fields are sorted by strings"""
+    keys = [key if isinstance(key, str) else next(iter(key)) for key in SORTING[ordering]]
+    return len(after) == len(keys) and all(
+        isinstance(value, str) if key in KEYWORD_SORT_FIELDS else
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        for key, value in zip(keys, after)
+    )
+
+
+def execute_cottage_search(params: dict, with_facets: bool = False) -> tuple[SearchResponse, dict]:
+    """Return search response and params it was made with, expired point in time is replaced by live index.
+
+    Cursor not matching the ordering or rejected by Elasticsearch is a validation error.
+    """
+    cursor = params.get("cursor")
+    if cursor and cursor["after"] is not None and not is_valid_search_after(params["ordering"], cursor["after"]):
+        raise ValidationError({"cursor": "Invalid cursor"})
+    params = with_point_in_time(params)
+    try:
+        return build_cottage_search(params, with_facets=with_facets).execute(), params
+    except (BadRequestError, NotFoundError) as error:
+        if not cursor:
+            raise
+        if isinstance(error, BadRequestError) or not params["cursor"]["pit"]:
+            raise ValidationError({"cursor": "Invalid cursor"})
+    params = {**params, "cursor": {**params["cursor"], "pit": None}}
+    try:
+        return build_cottage_search(params, with_facets=with_facets).execute(), params
+    except (BadRequestError, NotFoundError):
+        raise ValidationError({"cursor": "Invalid cursor"})
+
+
+def get_next_cursor(params: dict, response: SearchResponse) -> str | None:
+    """Return cursor after the last hit of the page, point in time of the search is closed after the last page"""
+    cursor = params.get("cursor")
+    pit_id = response.to_dict().get("pit_id", cursor["pit"]) if cursor and cursor["pit"] else None
+    if len(response.hits) <= params["page_size"]:
+        if pit_id:
+            close_point_in_time(pit_id)
+        return None
+    last_hit = response.hits[params["page_size"] - 1]
+    return encode_search_cursor(get_search_offset(params) + params["page_size"], list(last_hit.meta.sort), pit_id)
+
+
+def search_cottages(params: dict, request: Request) -> dict:
+    """Return page of cottage cards built from one Elasticsearch search, facets are aggregated in it if not cached"""
+    facets = get_cached_facets(params) if params.get("facets") else None
+    with_facets = params.get("facets") and facets is None
+    response, params = execute_cottage_search(params, with_facets=with_facets)
+    cards = [get_cottage_card(hit.to_dict()) for hit in response.hits[:params["page_size"]]]
+    page = get_search_page(params, response.hits.total.value, cards, request, get_next_cursor(params, response))
+    if with_facets:
+        facets = get_facets(response.aggregations)
+        set_cached_facets(params, facets)
+    if facets is not None:
+        page["facets"] = facets
+    return page
+
+
+def build_suggest_search(query: str) -> MultiSearch:
+    """Return one multi search request for cottage name, cottage town and town name suggestions"""
+    cottages = CottageDocument.search().source(["id", "name", "town_name"])[:0]
+    cottages = cottages.suggest("name_suggestions", query, completion={"field": "name_suggest"})
+    cottages = cottages.suggest("town_name_suggestions", query, completion={"field": "town_name_suggest"})
+    towns = TownDocument.search().source(["id", "name"])[:0]
+    towns = towns.suggest("name_suggestions", query, completion={"field": "name.suggest"})
+    return MultiSearch().add(cottages).add(towns)
+
+
+def normalize_suggest_query(query: str) -> str:
+    return " ".join(query.split()).lower()
+
+
+def get_suggestions(query: str) -> dict:
+    """Return cottage and town suggestions for the prefix, cached for a short time"""
+    query = normalize_suggest_query(query)
+    if not query:
+        return {"cottages": [], "towns": []}
+    cache_key = get_cottage_suggest_cache_key(query)
+    data = cache.get(cache_key)
+    record_cache_lookup(data is not None)
+    if data is not None:
+        return data
+
+    cottages_response, towns_response = build_suggest_search(query).execute()
+    cottage_options = (cottages_response.suggest.name_suggestions[0].options +
+                       cottages_response.suggest.town_name_suggestions[0].options)
+    data = {
+        "cottages": [
+            {"id": option._source.id, "name": option._source.name, "town_name": option._source.town_name}
+            for option in cottage_options
+        ],
+        "towns": [
+            {"id": option._source.id, "name": option._source.name}
+            for option in towns_response.suggest.name_suggestions[0].options
+        ],
+    }
+    cache.set(cache_key, data, settings.COTTAGES_SUGGEST_CACHE_TIMEOUT)
+    return data
@@ -0,0 +1,308 @@
+import abc
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, QuerySet
+from django.db.models.functions import Floor
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from elastic_transport import TransportError
+from rest_framework.request import Request
+
+from cottages.filters import CottageFilter
+from cottages.models import Cottage
+from cottages.pagination import encode_search_cursor
+from cottages.search import (
+    FACET_SIZE,
+    GUESTS_FACET_RANGES,
+    get_cached_facets,
+    get_search_offset,
+    get_search_page,
+    get_suggestions,
+    normalize_suggest_query,
+    search_cottages,
+    set_cached_facets,
+)
+from cottages.serializers import CottageInfoWithRatingSerializer
+from towns.models import Town
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBackend(abc.ABC):
+    """Cottage search and suggest implementation"""
+    unavailable_errors: tuple[type[Exception], ...] = ()
+
+    @abc.abstractmethod
+    def search_cottages(self, params: dict, request: Request) -> dict:
+        """Return page of cottage cards matching validated CottageSearchSerializer params"""
+
+    @abc.abstractmethod
+    def suggest(self, query: str) -> dict:
+        """Return cottages and towns with names starting with the query"""
+
+
+class ElasticsearchBackend(SearchBackend):
+    unavailable_errors = (TransportError,)
+
+    def search_cottages(self, params: dict, request: Request) -> dict:
+        return search_cottages(params, request)
+
+    def suggest(self, query: str) -> dict:
+        return get_suggestions(query)
+
+
+class PrefixIndex:
+    """Sorted (key, value) pairs, values of keys starting with a prefix are found by binary search.
+
+    Every word suffix of a text is a key, so "Лесной домик" is found by "лес" and by "дом".
+    """
+
+    def __init__(self):
+        self._entries: list[tuple[str, str]] = []
+        self._keys: dict[str, list[str]] = {}
+
+    @staticmethod
+    def get_keys(text: str) -> list[str]:
+        words = normalize_suggest_query(text).split()
+        return list(dict.fromkeys(" ".join(words[number:]) for number in range(len(words))))
+
+    def load(self, items: list[tuple[str, str]]) -> None:
+        """Replace index content with (value, text) items"""
+        self._keys = {value: self.get_keys(text) for value, text in items}
+        self._entries = sorted((key, value) for value, keys in self._keys.items() for key in keys)
+
+    def add(self, value: str, text: str) -> None:
+        self.remove(value)
+        self._keys[value] = self.get_keys(text)
+        for key in self._keys[value]:
+            bisect.insort(self._entries, (key, value))
+
+    def remove(self, value: str) -> None:
+        for key in self._keys.pop(value, []):
+            index = bisect.bisect_left(self._entries, (key, value))
+            if index < len(self._entries) and self._entries[index] == (key, value):
+                del self._entries[index]
+
+    def find(self, prefix: str, limit: int) -> list[str]:
+        values = []
+        index = bisect.bisect_left(self._entries, (prefix, ""))
+        while index < len(self._entries) and len(values) < limit:
+            key, value = self._entries[index]
+            if not key.startswith(prefix):
+                break
+            if value not in values:
+                values.append(value)
+            index += 1
+        return values
+
+
+class LocalSuggestIndex:
+    """In-process suggest index of cottage and town names.
+
+    It is loaded from the database on first use and kept up to date by model signals of this process,
+    changes made by other processes are picked up by reload after SEARCH_LOCAL_INDEX_TTL seconds.
+    """
+    size = 5
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._cottages: dict[str, tuple[str, str | None]] = {}
+        self._towns: dict[str, str] = {}
+        self._town_cottages: dict[str, set[str]] = defaultdict(set)
+        self._cottage_names = PrefixIndex()
+        self._town_names = PrefixIndex()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.SEARCH_LOCAL_INDEX_TTL
+
+    def load(self) -> None:
+        with self._lock:
+            self._towns = {str(pk): name for pk, name in Town.objects.values_list("id", "name")}
+            self._cottages = {
+                str(pk): (name, str(town_id) if town_id else None)
+                for pk, name, town_id in Cottage.objects.values_list("id", "name", "town_id")
+            }
+            self._town_cottages = defaultdict(set)
+            for pk, (_, town_id) in self._cottages.items():
+                self._town_cottages[town_id].add(pk)
+            self._cottage_names.load([(pk, name) for pk, (name, _) in self._cottages.items()])
+            self._town_names.load(list(self._towns.items()))
+            self._loaded_at = time.monotonic()
+
+    def update_cottage(self, pk: str, name: str, town_id: str | None) -> None:
+        with self._lock:
+            self.remove_cottage(pk)
+            self._cottages[pk] = (name, town_id)
+            self._town_cottages[town_id].add(pk)
+            self._cottage_names.add(pk, name)
+
+    def remove_cottage(self, pk: str) -> None:
+        with self._lock:
+            if pk in self._cottages:
+                self._town_cottages[self._cottages.pop(pk)[1]].discard(pk)
+                self._cottage_names.remove(pk)
+
+    def update_town(self, pk: str, name: str) -> None:
+        with self._lock:
+            self._towns[pk] = name
+            self._town_names.add(pk, name)
+
+    def remove_town(self, pk: str) -> None:
+        with self._lock:
+            self._towns.pop(pk, None)
+            self._town_names.remove(pk)
+
+    def suggest(self, query: str) -> dict:
+        query = normalize_suggest_query(query)
+        if not query:
+            return {"cottages": [], "towns": []}
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            town_ids = self._town_names.find(query, self.size)
+            town_cottage_ids = []
+            for town_id in town_ids:
+                town_cottage_ids += sorted(self._town_cottages.get(town_id, ()))[:self.size - len(town_cottage_ids)]
+            return {
+                "cottages": [
+                    self._get_cottage(pk) for pk in self._cottage_names.find(query, self.size) + town_cottage_ids
+                ],
+                "towns": [{"id": pk, "name": self._towns[pk]} for pk in town_ids],
+            }
+
+    def _get_cottage(self, pk: str) -> dict:
+        name, town_id = self._cottages[pk]
+        return {"id": pk, "name": name, "town_name": self._towns.get(town_id)}
+
+
+local_suggest_index = LocalSuggestIndex()
+
+
+class LocalSearchBackend(SearchBackend):
+    """Search in the database and suggest from memory, does not need Elasticsearch"""
+
+    def search_cottages(self, params: dict, request: Request) -> dict:
+        cottages = self.get_queryset(params)
+        offset = get_search_offset(params)
+        page = list(cottages[offset:offset + params["page_size"] + 1])
+        next_cursor = encode_search_cursor(offset + params["page_size"]) if len(page) > params["page_size"] else None
+        response = get_search_page(params, cottages.count(),
+                                   CottageInfoWithRatingSerializer(page[:params["page_size"]], many=True).data,
+                                   request, next_cursor)
+        if params.get("facets"):
+            facets = get_cached_facets(params)
+            if facets is None:
+                facets = self.get_facets(cottages)
+                set_cached_facets(params, facets)
+            response["facets"] = facets
+        return response
+
+    # noinspection PyMethodMayBeStatic
+    def get_queryset(self, params: dict) -> QuerySet[Cottage]:
+        filters = {name: value for name, value in params.items() if name in CottageFilter.base_filters}
+        cottages = CottageFilter(filters, queryset=Cottage.objects.get_cottages_list()).qs
+        if params.get("query"):
+            cottages = cottages.filter(Q(name__icontains=params["query"]) | Q(town__name__icontains=params["query"]))
+        for amenity in params.get("amenities", []):
+            cottages = cottages.filter(amenities__icontains=f'"{amenity}"')
+        ordering = {"price": ("price", "id"), "-price": ("-price", "id")}
+        return cottages.order_by(*ordering.get(params["ordering"], ("-average_rating", "id")))
+
+    # noinspection PyMethodMayBeStatic
+    def get_facets(self, cottages: QuerySet[Cottage]) -> dict:
+        """Return the same facets as Elasticsearch aggregations of cottage search"""
+        cottages = cottages.order_by()
+        facets = {}
+        for name, field in (("categories", "category"), ("towns", "town")):
+            rows = cottages.filter(**{f"{field}__isnull": False}).values(f"{field}_id", f"{field}__name").annotate(
+                count=Count("id")).order_by("-count", f"{field}__name")[:FACET_SIZE]
+            facets[name] = [
+                {"id": str(row[f"{field}_id"]), "name": row[f"{field}__name"], "count": row["count"]} for row in rows
+            ]
+        guests = cottages.aggregate(**{
+            f"guests_{number}": Count("id", filter=Q(guests__gte=start, **({"guests__lt": end} if end else {})))
+            for number, (_, start, end) in enumerate(GUESTS_FACET_RANGES)
+        })
+        facets["guests"] = [
+            {"key": key, "count": guests[f"guests_{number}"]} for number, (key, _, _) in enumerate(GUESTS_FACET_RANGES)
+        ]
+        interval = settings.SEARCH_PRICE_FACET_INTERVAL
+        prices = cottages.filter(price__isnull=False).annotate(bucket=Floor(F("price") / interval)).values(
+            "bucket").annotate(count=Count("id")).order_by("bucket")
+        facets["price"] = [
+            {"from": int(row["bucket"]) * interval, "to": (int(row["bucket"]) + 1) * interval, "count": row["count"]}
+            for row in prices
+        ]
+        return facets
+
+    def suggest(self, query: str) -> dict:
+        return local_suggest_index.suggest(query)
+
+
+class FallbackSearchBackend(SearchBackend):
+    """Use fallback backend when primary one is unavailable"""
+
+    def __init__(self, primary: SearchBackend, fallback: SearchBackend):
+        self.primary = primary
+        self.fallback = fallback
+
+    def search_cottages(self, params: dict, request: Request) -> dict:
+        try:
+            return self.primary.search_cottages(params, request)
+        except self.primary.unavailable_errors as error:
+            logger.warning("Search backend is unavailable, fallback is used: %s", error)
+            return self.fallback.search_cottages(params, request)
+
+    def suggest(self, query: str) -> dict:
+        try:
+            return self.primary.suggest(query)
+        except self.primary.unavailable_errors as error:
+            logger.warning("Search backend is unavailable, fallback is used: %s", error)
+            return self.fallback.suggest(query)
+
+
+@lru_cache
+def get_search_backend() -> SearchBackend:
+    """Return SEARCH_BACKEND, wrapped with SEARCH_FALLBACK_BACKEND if it is set"""
+    backend = import_string(settings.SEARCH_BACKEND)()
+    if settings.SEARCH_FALLBACK_BACKEND:
+        backend = FallbackSearchBackend(backend, import_string(settings.SEARCH_FALLBACK_BACKEND)())
+    return backend
+
+
+@receiver(post_save, sender=Cottage)
+def update_local_suggest_cottage(sender, instance, **kwargs):
+    if local_suggest_index.loaded:
+        pk, name, town_id = str(instance.pk), instance.name, str(instance.town_id) if instance.town_id else None
+        transaction.on_commit(lambda: local_suggest_index.update_cottage(pk, name, town_id))
+
+
+@receiver(post_delete, sender=Cottage)
+def remove_local_suggest_cottage(sender, instance, **kwargs):
+    if local_suggest_index.loaded:
+        pk = str(instance.pk)
+        transaction.on_commit(lambda: local_suggest_index.remove_cottage(pk))
+
+
+@receiver(post_save, sender=Town)
+def update_local_suggest_town(sender, instance, **kwargs):
+    if local_suggest_index.loaded:
+        pk, name = str(instance.pk), instance.name
+        transaction.on_commit(lambda: local_suggest_index.update_town(pk, name))
+
+
+@receiver(post_delete, sender=Town)
+def remove_local_suggest_town(sender, instance, **kwargs):
+    if local_suggest_index.loaded:
+        pk = str(instance.pk)
+        transaction.on_commit(lambda: local_suggest_index.remove_town(pk))
@@ -1,14 +1,28 @@
+import datetime
 from decimal import Decimal
 
-from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
 
 from cottages.models import Cottage, CottageCategory, CottageImage
-from relations.models import UserCottageRent
+from cottages.pagination import decode_search_cursor
+from cottages.services import encode_occupancy_bitmap, get_occupied_periods
 from towns.serializers import TownNameSerializer
 from users.serializers import UserFullNameSerializer
 
 
+def get_file_url(storage, name: str, request=None) -> str:
+    """Return file URL, for file system storage it is joined without urljoin which dominates render time"""
+    if isinstance(storage, FileSystemStorage):
+        url = storage.base_url + filepath_to_uri(name).lstrip("/")
+    else:
+        url = storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
 class CottageImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = CottageImage
@@ -32,11 +46,31 @@ class CottageInfoWithRatingSerializer(serializers.ModelSerializer):
         fields = ['id', 'town', 'category', "name", "price", "guests", "total_area",
                   "beds", "rooms", "average_rating", "images"]
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['average_rating'] = round(float(data['average_rating']), 1)
-        data['price'] = int(instance.price)
-        return data
+    def to_representation(self, instance: Cottage) -> dict:
+        """Build card by hand, the output matches the declared fields"""
+        town, category = instance.town, instance.category
+        return {
+            "id": str(instance.id),
+            "town": {"id": str(town.id), "name": town.name} if town else None,
+            "category": {"id": str(category.id), "name": category.name},
+            "name": instance.name,
+            "price": int(instance.price) if instance.price is not None else None,
+            "guests": instance.guests,
+            "total_area": instance.total_area,
+            "beds": instance.beds,
+            "rooms": instance.rooms,
+            "average_rating": round(float(instance.average_rating), 1),
+            "images": [
+                {"id": str(image.id), "image": self.get_image_url(image), "order": image.order}
+                for image in instance.images.all()
+            ],
+        }
+
+    def get_image_url(self, image: CottageImage) -> str | None:
+        file = image.image
+        if not file:
+            return None
+        return get_file_url(file.storage, file.name, self.context.get("request"))
 
 
 class CottageCreateUpdateSerializer(serializers.ModelSerializer):
@@ -105,23 +139,23 @@ class CottageDetailSerializer(CottageCreateUpdateSerializer):
         data['average_value_rating'] = round(float(data['average_value_rating']), 1)
         return data
 
-    @staticmethod
-    def get_occupied_dates(obj: Cottage) -> dict:
-        """Return occupied days of cottage"""
-        all_dates = UserCottageRent.objects.filter(cottage=obj.pk).values_list('start_date', 'end_date')
-        closed_days = []
-        start_days = []
-        for start_date, end_date in all_dates:
-            start_days.append(start_date)
-            current_date = start_date + relativedelta(days=1)
-            while current_date < end_date:
-                closed_days.append(current_date)
-                current_date += relativedelta(days=1)
-        return {"closed_days": closed_days, "start_days": start_days}
+    def get_occupied_dates(self, obj: Cottage) -> dict:
+        """Return merged occupied periods of cottage within booking horizon"""
+        start_date = timezone.localdate()
+        days = settings.OCCUPIED_DATES_HORIZON_DAYS
+        periods = get_occupied_periods(obj.pk, start_date, start_date + datetime.timedelta(days=days))
+        data = {
+            "start_date": start_date,
+            "end_date": start_date + datetime.timedelta(days=days),
+            "periods": [{"start_date": start, "end_date": end} for start, end in periods],
+        }
+        if self.context.get("occupancy_format") == "bitmap":
+            data["bitmap"] = encode_occupancy_bitmap(periods, start_date, days)
+        return data
 
     @staticmethod
     def get_price(obj: Cottage):
-        return int(obj.price)
+        return int(obj.price) if obj.price is not None else None
 
 
 class ImageUpdateSerializer(serializers.ModelSerializer):
@@ -138,3 +172,57 @@ class ImageUpdateSerializer(serializers.ModelSerializer):
         if not isinstance(value, int):
             raise serializers.ValidationError("Order должен быть целым числом.")
         return value
+
+
+class CottageSearchSerializer(serializers.Serializer):
+    ORDERING_CHOICES = ["relevance", "price", "-price", "-average_rating"]
+    MAX_RESULT_WINDOW = 10000
+
+    query = serializers.CharField(required=False, allow_blank=True, default="")
+    price_min = serializers.FloatField(required=False, min_value=0)
+    price_max = serializers.FloatField(required=False, min_value=0)
+    guests = serializers.IntegerField(required=False, min_value=1)
+    beds = serializers.IntegerField(required=False, min_value=1)
+    rooms = serializers.IntegerField(required=False, min_value=1)
+    category = serializers.UUIDField(required=False)
+    town = serializers.UUIDField(required=False)
+    average_rating_min = serializers.FloatField(required=False, min_value=0, max_value=5)
+    amenities = serializers.CharField(required=False, help_text="Comma separated amenities, all are required")
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, default="relevance")
+    facets = serializers.BooleanField(required=False, default=False,
+                                      help_text="Add counts by category, town, guests and price to response")
+    page = serializers.IntegerField(required=False, min_value=1, default=1)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=100, default=20)
+    cursor = serializers.CharField(required=False, help_text="Cursor from next link, page is ignored with it")
+
+    # noinspection PyMethodMayBeStatic
+    def validate_amenities(self, value: str) -> list[str]:
+        return [amenity.strip() for amenity in value.split(",") if amenity.strip()]
+
+    # noinspection PyMethodMayBeStatic
+    def validate_cursor(self, value: str) -> dict:
+        try:
+            return decode_search_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor")
+
+    def validate(self, attrs: dict) -> dict:
+        if "cursor" not in attrs and attrs["page"] * attrs["page_size"] > self.MAX_RESULT_WINDOW:
+            raise serializers.ValidationError({"page": f"Only first {self.MAX_RESULT_WINDOW} results are available"})
+        return attrs
+
+
+class CottageQuoteSerializer(serializers.Serializer):
+    MAX_COTTAGES = 100
+    MAX_NIGHTS = 90
+
+    cottage_ids = serializers.ListField(child=serializers.UUIDField(), min_length=1, max_length=MAX_COTTAGES)
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, attrs: dict) -> dict:
+        if attrs["start_date"] >= attrs["end_date"]:
+            raise serializers.ValidationError("Дата выезда должна быть позже даты заезда")
+        if (attrs["end_date"] - attrs["start_date"]).days > self.MAX_NIGHTS:
+            raise serializers.ValidationError({"end_date": f"Only stays up to {self.MAX_NIGHTS} nights are quoted"})
+        return attrs
@@ -0,0 +1,35 @@
+import base64
+import datetime
+from typing import Iterable
+from uuid import UUID
+
+from relations.models import UserCottageRent
+
+Period = tuple[datetime.date, datetime.date]
+
+
+def get_occupied_periods(cottage_id: UUID, start_date: datetime.date, end_date: datetime.date) -> list[Period]:
+    """Return merged occupied periods of cottage clipped to [start_date, end_date)."""
+    rents = UserCottageRent.objects.get_overlapping_rents(start_date, end_date).filter(
+        cottage_id=cottage_id).order_by("start_date").values_list("start_date", "end_date")
+    return merge_periods((max(start, start_date), min(end, end_date)) for start, end in rents)
+
+
+def merge_periods(periods: Iterable[Period]) -> list[Period]:
+    """Merge overlapping and adjacent periods sorted by start date."""
+    merged = []
+    for start, end in periods:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def encode_occupancy_bitmap(periods: Iterable[Period], base_date: datetime.date, days: int) -> str:
+    """Return base64 bitmap where bit N (most significant first) is set if night base_date + N is occupied."""
+    bitmap = bytearray((days + 7) // 8)
+    for start, end in periods:
+        for day in range(max((start - base_date).days, 0), min((end - base_date).days, days)):
+            bitmap[day // 8] |= 0x80 >> (day % 8)
+    return base64.b64encode(bytes(bitmap)).decode()
@@ -0,0 +1,36 @@
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from cottages.analytics import FLUSH_SCHEDULED_KEY, delete_old_events, flush_event_buffer, schedule_flush
+from cottages.indexing import flush_index_queue
+from cottages.models import SearchIndexQueue
+
+
+@shared_task
+def flush_search_index() -> int:
+    """Write queued changes to Elasticsearch in batches until the queue is empty"""
+    cache.delete(SearchIndexQueue.objects.FLUSH_SCHEDULED_KEY)
+    flushed = total = 0
+    while processed := flush_index_queue(settings.SEARCH_INDEX_BATCH_SIZE):
+        total += processed
+        flushed += 1
+        if flushed >= settings.SEARCH_INDEX_MAX_BATCHES:
+            SearchIndexQueue.objects.schedule_flush()
+            break
+    return total
+
+
+@shared_task
+def flush_search_events() -> int:
+    """Write buffered search events to the database until the buffer is empty and delete old events"""
+    cache.delete(FLUSH_SCHEDULED_KEY)
+    flushed = total = 0
+    while processed := flush_event_buffer(settings.SEARCH_ANALYTICS_BATCH_SIZE):
+        total += processed
+        flushed += 1
+        if flushed >= settings.SEARCH_ANALYTICS_MAX_BATCHES:
+            schedule_flush()
+            break
+    delete_old_events()
+    return total
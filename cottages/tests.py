@@ -1,7 +1,60 @@
+import base64
+import datetime
+import json
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
+from elastic_transport import ApiResponseMeta
+from elastic_transport import ConnectionError as TransportConnectionError
+from elastic_transport import HttpHeaders, NodeConfig
+from elasticsearch import BadRequestError, NotFoundError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response as ElasticResponse
 from rest_framework import status
 
 from core.tests_setup import APITestCaseWithSetUp
+from cottages.analytics import flush_event_buffer, get_event_buffer, record_search_event
+from cottages.cache import get_cottage_suggest_cache_key, invalidate_cottage_cache
+from cottages.documents import CottageDocument, TownDocument
+from cottages.geo import GRID_COLUMNS, GRID_ROWS, get_grid_cell
+from cottages.indexing import (
+    REINDEX_TARGETS_KEY,
+    flush_index_queue,
+    get_index_lag,
+    get_pending_updates,
+    get_pk_ranges,
+    replay_written_changes,
+)
+from cottages.models import Cottage, CottageImage, CottagePriceRule, SearchEvent, SearchIndexQueue
+from cottages.pagination import decode_search_cursor, encode_search_cursor
+from cottages.pricing import get_stay_price, get_stay_quotes
+from cottages.search import (
+    build_cottage_search,
+    build_suggest_search,
+    get_cottage_card,
+    get_facets,
+    get_next_cursor,
+    with_point_in_time,
+)
+from cottages.search_backends import (
+    FallbackSearchBackend,
+    LocalSearchBackend,
+    PrefixIndex,
+    SearchBackend,
+    get_search_backend,
+    local_suggest_index,
+)
+from cottages.serializers import CottageInfoWithRatingSerializer, CottageSearchSerializer
+from cottages.services import encode_occupancy_bitmap, get_occupied_periods
+from relations.models import UserCottageRent, UserCottageReview
+from towns.models import Town
 
 
 class CottageViewSetTest(APITestCaseWithSetUp):
@@ -47,7 +100,7 @@ class CottageViewSetTest(APITestCaseWithSetUp):
     def test_cottage_list(self):
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(1, len(response.data))
+        self.assertEqual(1, len(response.data["results"]))
 
     def test_cottage_detail(self):
         response = self.client.get(self.detail_url)
@@ -74,3 +127,811 @@ class CottageViewSetTest(APITestCaseWithSetUp):
         self.client.force_login(self.user1)
         response = self.client.delete(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class CottageRatingSummaryTest(APITestCaseWithSetUp):
+
+    def create_review(self, **ratings):
+        data = {"location_rating": 5, "cleanliness_rating": 5, "communication_rating": 5, "value_rating": 5}
+        data.update(ratings)
+        return UserCottageReview.objects.create(cottage=self.cottage1, user=self.user2, comment="Отзыв", **data)
+
+    def test_summary_updated_on_review_save(self):
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 1)
+        self.assertEqual(self.cottage1.average_rating, 5.0)
+
+        review = self.create_review(location_rating=2, value_rating=4)
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 2)
+        self.assertEqual(self.cottage1.average_location_rating, 3.5)
+        self.assertEqual(self.cottage1.average_value_rating, 4.5)
+        self.assertEqual(self.cottage1.average_rating, 4.5)
+
+        review.location_rating = 5
+        review.save()
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 2)
+        self.assertEqual(self.cottage1.average_location_rating, 5.0)
+
+    def test_summary_updated_on_review_delete(self):
+        self.create_review(cleanliness_rating=1)
+        self.review1.delete()
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 1)
+        self.assertEqual(self.cottage1.average_cleanliness_rating, 1.0)
+
+        UserCottageReview.objects.all().delete()
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 0)
+        self.assertEqual(self.cottage1.average_rating, 0.0)
+
+    def test_rebuild_rating_summary(self):
+        Cottage.objects.filter(pk=self.cottage1.pk).update(reviews_count=0, average_rating=0.0)
+        call_command("rebuild_cottage_ratings", stdout=StringIO())
+        self.cottage1.refresh_from_db()
+        self.assertEqual(self.cottage1.reviews_count, 1)
+        self.assertEqual(self.cottage1.average_rating, 5.0)
+
+
+class CottageAvailabilityTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        self.rent = UserCottageRent.objects.create(
+            cottage=self.cottage1, user=self.user2, status=1,
+            start_date=datetime.date(2024, 7, 10), end_date=datetime.date(2024, 7, 15)
+        )
+
+    def test_is_available(self):
+        self.assertFalse(self.cottage1.is_available("2024-07-08", "2024-07-11"))
+        self.assertFalse(self.cottage1.is_available("2024-07-12", "2024-07-13"))
+        self.assertFalse(self.cottage1.is_available("2024-07-14", "2024-07-20"))
+        self.assertTrue(self.cottage1.is_available("2024-07-05", "2024-07-10"))
+        self.assertTrue(self.cottage1.is_available("2024-07-15", "2024-07-20"))
+
+        self.rent.status = 3
+        self.rent.save()
+        self.assertTrue(self.cottage1.is_available("2024-07-12", "2024-07-13"))
+
+    def test_cottages_list_excludes_booked(self):
+        self.assertEqual(Cottage.objects.get_cottages_list("2024-07-11", "2024-07-12").count(), 0)
+        self.assertEqual(Cottage.objects.get_cottages_list("2024-07-15", "2024-07-16").count(), 1)
+
+
+class CottageListPaginationTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.list_url = reverse("cottage-list")
+        for number in range(5):
+            Cottage.objects.create(
+                owner=self.user1, town=self.town1, category=self.category1, name=f"Cottage {number}",
+                price=1000 + number * 500, is_ready=True
+            )
+        Cottage.objects.filter(name__in=["Cottage 1", "Cottage 2"]).update(average_rating=4.5)
+
+    def get_all_pages(self, params: dict) -> list[dict]:
+        results = []
+        response = self.client.get(self.list_url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results += response.data["results"]
+            if not response.data["next"]:
+                return results
+            response = self.client.get(response.data["next"])
+
+    def test_pages_cover_all_cottages_in_order(self):
+        results = self.get_all_pages({"page_size": 2})
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len({cottage["id"] for cottage in results}), 5)
+        ratings = [cottage["average_rating"] for cottage in results]
+        self.assertEqual(ratings, sorted(ratings, reverse=True))
+
+        results = self.get_all_pages({"page_size": 2, "ordering": "price"})
+        self.assertEqual([cottage["price"] for cottage in results], [1000, 1500, 2000, 2500, 3000])
+
+    def test_cottages_without_price_go_last(self):
+        for name in ("No price 1", "No price 2", "No price 3"):
+            Cottage.objects.create(owner=self.user1, town=self.town1, category=self.category1, name=name, is_ready=True)
+        for ordering, prices in (("price", [1000, 1500, 2000, 2500, 3000]), ("-price", [3000, 2500, 2000, 1500, 1000])):
+            results = self.get_all_pages({"page_size": 2, "ordering": ordering})
+            self.assertEqual([cottage["price"] for cottage in results], prices + [None] * 3)
+            self.assertEqual(len({cottage["id"] for cottage in results}), 8)
+
+        last_page = self.client.get(self.list_url, {"page_size": 2, "ordering": "price"})
+        pages = [last_page.data["results"]]
+        while last_page.data["next"]:
+            last_page = self.client.get(last_page.data["next"])
+            pages.append(last_page.data["results"])
+        previous_page = last_page
+        for page in reversed(pages[:-1]):
+            previous_page = self.client.get(previous_page.data["previous"])
+            self.assertEqual(previous_page.data["results"], page)
+
+    def test_previous_page(self):
+        first_page = self.client.get(self.list_url, {"page_size": 2, "ordering": "-price"})
+        self.assertIsNone(first_page.data["previous"])
+        second_page = self.client.get(first_page.data["next"])
+        previous_page = self.client.get(second_page.data["previous"])
+        self.assertEqual(previous_page.data["results"], first_page.data["results"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.list_url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CottageOccupiedDatesTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        for start, end, rent_status in ((1, 3, 1), (3, 5, 2), (4, 6, 1), (8, 9, 3), (-10, 2, 4)):
+            UserCottageRent.objects.create(
+                cottage=self.cottage1, user=self.user2, status=rent_status,
+                start_date=self.today + datetime.timedelta(days=start),
+                end_date=self.today + datetime.timedelta(days=end)
+            )
+
+    def test_occupied_periods(self):
+        periods = get_occupied_periods(self.cottage1.id, self.today, self.today + datetime.timedelta(days=30))
+        self.assertEqual(periods, [(self.today, self.today + datetime.timedelta(days=6))])
+
+    def test_occupancy_bitmap(self):
+        periods = [(self.today + datetime.timedelta(days=1), self.today + datetime.timedelta(days=3)),
+                   (self.today + datetime.timedelta(days=8), self.today + datetime.timedelta(days=20))]
+        bitmap = base64.b64decode(encode_occupancy_bitmap(periods, self.today, 10))
+        self.assertEqual(bitmap, bytes([0b01100000, 0b11000000]))
+
+    def test_detail_occupied_dates(self):
+        url = reverse("cottage-detail", args=[self.cottage1.id])
+        response = self.client.get(url, {"occupancy_format": "bitmap"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        occupied_dates = response.json()["occupied_dates"]
+        self.assertEqual(occupied_dates["periods"], [
+            {"start_date": str(self.today), "end_date": str(self.today + datetime.timedelta(days=6))}
+        ])
+        self.assertIn("bitmap", occupied_dates)
+
+
+class CottageCacheTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        invalidate_cottage_cache(self.cottage1.pk)
+        self.list_url = reverse("cottage-list")
+        self.detail_url = reverse("cottage-detail", args=[self.cottage1.id])
+
+    def test_cached_responses(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        Cottage.objects.filter(pk=self.cottage1.pk).update(name="Renamed")
+        self.assertEqual(self.client.get(self.list_url).data["results"][0]["name"], "Family")
+        self.assertEqual(self.client.get(self.detail_url).data["name"], "Family")
+
+        self.cottage1.refresh_from_db()
+        self.cottage1.save()
+        self.assertEqual(self.client.get(self.list_url).data["results"][0]["name"], "Renamed")
+        self.assertEqual(self.client.get(self.detail_url).data["name"], "Renamed")
+
+    def test_rent_invalidates_cache(self):
+        params = {"start_date": "2024-07-10", "end_date": "2024-07-12"}
+        self.assertEqual(len(self.client.get(self.list_url, params).data["results"]), 1)
+        UserCottageRent.objects.create(
+            cottage=self.cottage1, user=self.user2, status=1,
+            start_date=datetime.date(2024, 7, 11), end_date=datetime.date(2024, 7, 13)
+        )
+        self.assertEqual(len(self.client.get(self.list_url, params).data["results"]), 0)
+
+    def test_rent_keeps_cards_cached(self):
+        suggest_key = get_cottage_suggest_cache_key("fam")
+        self.client.get(self.list_url)
+        Cottage.objects.filter(pk=self.cottage1.pk).update(name="Renamed")
+        UserCottageRent.objects.create(
+            cottage=self.cottage1, user=self.user2, status=1,
+            start_date=datetime.date(2024, 7, 11), end_date=datetime.date(2024, 7, 13)
+        )
+        self.assertEqual(self.client.get(self.list_url).data["results"][0]["name"], "Family")
+        self.assertEqual(get_cottage_suggest_cache_key("fam"), suggest_key)
+
+    def test_review_invalidates_cache(self):
+        self.assertEqual(self.client.get(self.detail_url).data["average_rating"], 5.0)
+        UserCottageReview.objects.create(
+            cottage=self.cottage1, user=self.user2, comment="Плохо", location_rating=1,
+            cleanliness_rating=1, communication_rating=1, value_rating=1
+        )
+        self.assertEqual(self.client.get(self.detail_url).data["average_rating"], 3.0)
+
+
+class CottageQuoteTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        # 2030-06-03 is Monday
+        self.weekend = CottagePriceRule.objects.create(cottage=self.cottage1, name="Выходные", weekdays=[4, 5],
+                                                       price=12000, priority=1)
+        CottagePriceRule.objects.create(cottage=self.cottage1, name="Сезон", start_date=datetime.date(2030, 6, 10),
+                                        end_date=datetime.date(2030, 6, 16), price=11000)
+
+    def test_stay_price(self):
+        for start_date, end_date, total in (
+            (datetime.date(2030, 6, 3), datetime.date(2030, 6, 10), 9500 * 5 + 12000 * 2),
+            (datetime.date(2030, 6, 9), datetime.date(2030, 6, 12), 9500 + 11000 * 2),
+            (datetime.date(2030, 6, 14), datetime.date(2030, 6, 17), 12000 * 2 + 11000),
+        ):
+            self.assertEqual(get_stay_price(self.cottage1, start_date, end_date), total)
+
+    def test_price_rule_validation(self):
+        self.weekend.full_clean()
+        for weekdays in ([7], ["5"], [True], {"5": 1}):
+            self.weekend.weekdays = weekdays
+            with self.assertRaises(ValidationError):
+                self.weekend.full_clean()
+        rule = CottagePriceRule(cottage=self.cottage1, start_date=datetime.date(2030, 6, 16),
+                                end_date=datetime.date(2030, 6, 10), price=11000)
+        with self.assertRaises(ValidationError):
+            rule.full_clean()
+
+    def test_batch_quotes_are_cached_per_cottage(self):
+        data = {"cottage_ids": [self.cottage1.id, "00000000-0000-0000-0000-000000000000"],
+                "start_date": "2030-06-03", "end_date": "2030-06-10"}
+        response = self.client.post(reverse("cottage-quotes"), data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["data"], [{"cottage_id": str(self.cottage1.id), "start_date": "2030-06-03",
+                                                  "end_date": "2030-06-10", "nights": 7, "total": "71500.00"}])
+        start_date, end_date = datetime.date(2030, 6, 3), datetime.date(2030, 6, 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_stay_quotes([self.cottage1.id], start_date, end_date)[0]["total"], "71500.00")
+
+        self.weekend.price = 10000
+        self.weekend.save()
+        self.assertEqual(get_stay_quotes([self.cottage1.id], start_date, end_date)[0]["total"], "67500.00")
+        response = self.client.post(reverse("cottage-quotes"), {**data, "end_date": "2030-06-03"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CottageGeoFilterTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.list_url = reverse("cottage-list")
+        self.cottages = {}
+        for name, latitude, longitude in (("Center", 43.02, 44.68), ("Near", 43.05, 44.70),
+                                          ("Far", 42.80, 44.30), ("Chukotka", 65.0, 179.95)):
+            self.cottages[name] = Cottage.objects.create(
+                owner=self.user1, town=self.town1, category=self.category1, name=name, price=1000,
+                latitude=latitude, longitude=longitude, is_ready=True
+            )
+
+    def get_names(self, params: dict) -> list[str]:
+        response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [cottage["name"] for cottage in response.data["results"]]
+
+    def test_grid_cell(self):
+        self.assertEqual(get_grid_cell(-90, -180), 0)
+        self.assertEqual(get_grid_cell(90, 180), GRID_ROWS * GRID_COLUMNS - 1)
+        self.assertEqual(self.cottages["Center"].geo_cell, get_grid_cell(43.02, 44.68))
+
+    def test_bbox(self):
+        self.assertCountEqual(self.get_names({"bbox": "43,44.6,43.1,44.8"}), ["Center", "Near"])
+        self.assertCountEqual(self.get_names({"bbox": "64,179.9,66,-179.9"}), ["Chukotka"])
+        response = self.client.get(self.list_url, {"bbox": "43,44.6,43.1"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_near_sorted_by_distance(self):
+        params = {"near": "43.06,44.71", "radius_km": 50, "ordering": "distance"}
+        self.assertEqual(self.get_names(params), ["Near", "Center", "Far"])
+        self.assertEqual(self.get_names({"near": "43.06,44.71", "radius_km": 5}), ["Near"])
+
+    def test_near_with_dates(self):
+        UserCottageRent.objects.create(
+            cottage=self.cottages["Near"], user=self.user2, status=1,
+            start_date=datetime.date(2024, 7, 10), end_date=datetime.date(2024, 7, 15)
+        )
+        params = {"near": "43.06,44.71", "radius_km": 50, "ordering": "distance",
+                  "start_date": "2024-07-11", "end_date": "2024-07-12"}
+        self.assertEqual(self.get_names(params), ["Center", "Far"])
+
+
+class CottageListFilterTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        self.list_url = reverse("cottage-list")
+        self.town2 = Town.objects.create(name="Fiagdon", description="Поселок")
+        for name, town, price, guests, rating in (("Small", self.town1, 3000, 2, 4.0),
+                                                  ("Medium", self.town1, 6000, 4, 4.8),
+                                                  ("Large", self.town2, 12000, 10, 4.5)):
+            cottage = Cottage.objects.create(
+                owner=self.user1, town=town, category=self.category1, name=name, price=price,
+                guests=guests, beds=guests, rooms=guests // 2, is_ready=True
+            )
+            Cottage.objects.filter(pk=cottage.pk).update(average_rating=rating)
+
+    def get_names(self, params: dict) -> list[str]:
+        response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [cottage["name"] for cottage in response.data["results"]]
+
+    def test_filters(self):
+        self.assertEqual(self.get_names({"price_min": 5000, "price_max": 15000, "ordering": "price"}),
+                         ["Medium", "Large"])
+        self.assertEqual(self.get_names({"guests": 4, "rooms": 5}), ["Large"])
+        self.assertEqual(self.get_names({"town": self.town1.id}), ["Medium", "Small"])
+        self.assertEqual(self.get_names({"town": self.town1.id, "average_rating_min": 4.5}), ["Medium"])
+        self.assertEqual(len(self.get_names({"category": self.category1.id})), 3)
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.list_url, {"town": "unknown"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CottageCardSerializerTest(APITestCaseWithSetUp):
+
+    def test_card_representation(self):
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        image = CottageImage.objects.create(cottage=self.cottage1, image="cottage_images/1/фото 1.jpg")
+        cottage = Cottage.objects.get_cottages_list().get(pk=self.cottage1.pk)
+        self.assertEqual(CottageInfoWithRatingSerializer(cottage).data, {
+            "id": str(self.cottage1.id),
+            "town": {"id": str(self.town1.id), "name": "Vladikavkaz"},
+            "category": {"id": str(self.category1.id), "name": "cottage"},
+            "name": "Family",
+            "price": 9500,
+            "guests": 5,
+            "total_area": 50,
+            "beds": 4,
+            "rooms": 3,
+            "average_rating": 5.0,
+            "images": [{"id": str(image.id), "image": image.image.url, "order": image.order}],
+        })
+
+
+class GenerateSampleDataTest(APITestCaseWithSetUp):
+
+    def test_generate_sample_data(self):
+        ready_count = Cottage.objects.filter(is_ready=True).count()
+        call_command("generate_sample_data", users=3, towns=1, cottages=5, images=2, reviews=2, rents=3, chats=1,
+                     messages=2, seed=1, stdout=StringIO())
+        cottages = Cottage.objects.filter(is_ready=True, name__startswith="Cottage ")
+        self.assertEqual(Cottage.objects.filter(is_ready=True).count(), ready_count + 5)
+        self.assertEqual(CottageImage.objects.filter(cottage__in=cottages).count(), 10)
+        for cottage in cottages:
+            self.assertEqual(cottage.reviews_count, 2)
+            self.assertGreater(cottage.average_rating, 0)
+            self.assertEqual(cottage.geo_cell, get_grid_cell(cottage.latitude, cottage.longitude))
+            rents = list(cottage.rents.order_by("start_date"))
+            self.assertEqual(len(rents), 3)
+            for previous, following in zip(rents, rents[1:]):
+                self.assertLessEqual(previous.end_date, following.start_date)
+
+
+class CottageQueryBudgetTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        invalidate_cottage_cache()
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        CottageImage.objects.create(cottage=self.cottage1, image="cottage_images/1/1.jpg")
+
+    def test_cottage_list_query_count_is_constant(self):
+        url = reverse("cottage-list")
+        queries = self.get_query_count(url)
+        call_command("generate_sample_data", users=2, towns=1, cottages=10, chats=0, stdout=StringIO())
+        self.assertQueryBudget(url, queries)
+        self.assertQueryBudget(url, queries, {"guests": 2, "ordering": "price"})
+
+    def test_cottage_detail_query_budget(self):
+        self.assertQueryBudget(reverse("cottage-detail", args=[self.cottage1.id]), 3)
+
+    def test_server_timing(self):
+        url = reverse("cottage-detail", args=[self.cottage1.id])
+        response = self.client.get(url)
+        self.assertIn('cache;desc="hits=0 misses=1"', response["Server-Timing"])
+        response = self.client.get(url)
+        self.assertIn('db;desc="queries=0"', response["Server-Timing"])
+        self.assertIn('cache;desc="hits=1 misses=0"', response["Server-Timing"])
+
+
+class CottageSearchTest(APITestCaseWithSetUp):
+
+    def get_params(self, data: dict) -> dict:
+        serializer = CottageSearchSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def test_card_from_document_matches_serializer(self):
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        CottageImage.objects.create(cottage=self.cottage1, image="cottage_images/1/1.jpg")
+        CottageImage.objects.create(cottage=self.cottage1, image="cottage_images/1/2.jpg")
+        document = CottageDocument()
+        source = document.prepare(document.get_queryset().get(pk=self.cottage1.pk))
+        source = json.loads(JSONSerializer().dumps(source))
+        cottage = Cottage.objects.get_cottages_list().get(pk=self.cottage1.pk)
+        self.assertEqual(get_cottage_card(source), CottageInfoWithRatingSerializer(cottage).data)
+        self.assertEqual(source["amenities"], self.cottage1.amenities)
+        self.assertTrue(source["is_ready"])
+
+    def test_build_search(self):
+        params = self.get_params({"query": "Family", "price_min": 1000, "guests": 4, "town": str(self.town1.id),
+                                  "amenities": "wifi, tv", "ordering": "price", "page": 3, "page_size": 10})
+        body = build_cottage_search(params).to_dict()
+        filters = body["query"]["bool"]["filter"]
+        self.assertIn({"term": {"is_ready": True}}, filters)
+        self.assertIn({"range": {"price": {"gte": 1000.0}}}, filters)
+        self.assertIn({"range": {"guests": {"gte": 4}}}, filters)
+        self.assertIn({"term": {"town.id": str(self.town1.id)}}, filters)
+        self.assertIn({"term": {"amenities": "tv"}}, filters)
+        self.assertEqual(body["query"]["bool"]["must"][0]["multi_match"]["query"], "Family")
+        self.assertEqual(body["sort"], [{"price": "asc"}, {"id": "asc"}])
+        self.assertEqual((body["from"], body["size"]), (20, 11))
+        self.assertIn("images", body["_source"])
+
+    def test_build_search_after_cursor(self):
+        cursor = encode_search_cursor(40, [3000.0, str(self.cottage1.id)], "pit-id")
+        params = self.get_params({"ordering": "price", "page": 1000, "page_size": 20, "cursor": cursor})
+        search = build_cottage_search(params)
+        body = search.to_dict()
+        self.assertEqual(body["search_after"], [3000.0, str(self.cottage1.id)])
+        self.assertEqual(body["pit"]["id"], "pit-id")
+        self.assertEqual(body["size"], 21)
+        self.assertNotIn("from", body)
+        self.assertIsNone(search._index)
+        params = self.get_params({"cursor": encode_search_cursor(40)})
+        self.assertEqual(build_cottage_search(params).to_dict()["from"], 40)
+
+    def test_next_cursor(self):
+        hits = [{"_id": str(number), "_source": {}, "sort": [number, str(number)]} for number in range(3)]
+        params = self.get_params({"page_size": 2})
+        response = ElasticResponse(build_cottage_search(params), {"hits": {"total": {"value": 5}, "hits": hits}})
+        cursor = decode_search_cursor(get_next_cursor(params, response))
+        self.assertEqual(cursor, {"offset": 2, "after": [1, "1"], "pit": None})
+
+        params = self.get_params({"page_size": 2, "cursor": encode_search_cursor(2, [1, "1"], "pit-1")})
+        response = ElasticResponse(build_cottage_search(params),
+                                   {"hits": {"total": {"value": 5}, "hits": hits}, "pit_id": "pit-2"})
+        cursor = decode_search_cursor(get_next_cursor(params, response))
+        self.assertEqual(cursor, {"offset": 4, "after": [1, "1"], "pit": "pit-2"})
+
+    def test_point_in_time_is_opened_by_second_page(self):
+        params = self.get_params({"page_size": 2})
+        with mock.patch("cottages.search.open_point_in_time", return_value="pit-1") as open_point_in_time:
+            self.assertEqual(with_point_in_time(params), params)
+            params = self.get_params({"page_size": 2, "cursor": encode_search_cursor(2, [1, "1"])})
+            self.assertEqual(with_point_in_time(params)["cursor"]["pit"], "pit-1")
+            params = self.get_params({"page_size": 2, "cursor": encode_search_cursor(4, [3, "3"], "pit-2")})
+            self.assertEqual(with_point_in_time(params), params)
+        open_point_in_time.assert_called_once()
+
+    def test_invalid_search_params(self):
+        response = self.client.get(reverse("cottage-search"), {"ordering": "name"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse("cottage-search"), {"page": 1000, "page_size": 100})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse("cottage-search"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_not_matching_ordering(self):
+        url = reverse("cottage-search")
+        for after in (["3000", str(self.cottage1.id)], [3000.0], [True, str(self.cottage1.id)]):
+            response = self.client.get(url, {"ordering": "price", "cursor": encode_search_cursor(20, after)})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("cursor", response.data)
+        response = self.client.get(url, {"cursor": encode_search_cursor(20, [3000.0, str(self.cottage1.id)])})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_rejected_by_elasticsearch(self):
+        node = NodeConfig("http", "localhost", 9200)
+        bad_request = BadRequestError("bad", ApiResponseMeta(400, "1.1", HttpHeaders(), 0.0, node), {})
+        not_found = NotFoundError("gone", ApiResponseMeta(404, "1.1", HttpHeaders(), 0.0, node), {})
+        cursor = encode_search_cursor(20, [3000.0, str(self.cottage1.id)], "pit-1")
+        with mock.patch.object(Search, "execute", side_effect=bad_request):
+            response = self.client.get(reverse("cottage-search"), {"ordering": "price", "cursor": cursor})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("cursor", response.data)
+        with mock.patch.object(Search, "execute", side_effect=not_found) as execute:
+            response = self.client.get(reverse("cottage-search"), {"ordering": "price", "cursor": cursor})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(execute.call_count, 2)
+
+    def test_suggest_single_request(self):
+        cottages_header, cottages_body, towns_header, towns_body = build_suggest_search("fam").to_dict()
+        self.assertEqual((cottages_header["index"], towns_header["index"]), (["cottage"], ["town"]))
+        self.assertEqual(cottages_body["_source"], ["id", "name", "town_name"])
+        self.assertEqual(set(cottages_body["suggest"]), {"name_suggestions", "town_name_suggestions"})
+        self.assertEqual(towns_body["suggest"]["name_suggestions"]["prefix"], "fam")
+        self.assertEqual(towns_body["size"], 0)
+
+    def test_suggest_cached_per_prefix(self):
+        data = {"cottages": [{"id": str(self.cottage1.id), "name": "Family", "town_name": "Vladikavkaz"}],
+                "towns": []}
+        invalidate_cottage_cache()
+        cache.set(get_cottage_suggest_cache_key("fam"), data)
+        response = self.client.get(reverse("cottage-suggest"), {"query": " Fam "})
+        self.assertEqual(response.data, data)
+        response = self.client.get(reverse("cottage-suggest"), {"query": ""})
+        self.assertEqual(response.data, {"cottages": [], "towns": []})
+
+    @override_settings(SEARCH_PRICE_FACET_INTERVAL=5000)
+    def test_facets(self):
+        params = self.get_params({"query": "Family", "facets": "true"})
+        search = build_cottage_search(params, with_facets=True)
+        aggs = search.to_dict()["aggs"]
+        self.assertEqual(aggs["categories"]["terms"]["field"], "category.id")
+        self.assertEqual(aggs["guests"]["range"]["ranges"][-1], {"key": "9+", "from": 9})
+        self.assertNotIn("aggs", build_cottage_search(params).to_dict())
+        response = ElasticResponse(search, {"hits": {"total": {"value": 1}, "hits": []}, "aggregations": {
+            "categories": {"buckets": [{"key": "c1", "doc_count": 3, "top": {"hits": {"hits": [
+                {"_source": {"category": {"name": "cottage"}}}]}}}]},
+            "towns": {"buckets": []},
+            "guests": {"buckets": [{"key": "1-2", "from": 1, "to": 3, "doc_count": 2}]},
+            "price": {"buckets": [{"key": 5000.0, "doc_count": 3}]},
+        }})
+        self.assertEqual(get_facets(response.aggregations), {
+            "categories": [{"id": "c1", "name": "cottage", "count": 3}],
+            "towns": [],
+            "guests": [{"key": "1-2", "count": 2}],
+            "price": [{"from": 5000, "to": 10000, "count": 3}],
+        })
+
+
+@override_settings(ELASTICSEARCH_DSL_AUTOSYNC=True)
+class SearchIndexQueueTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        SearchIndexQueue.objects.all().delete()
+
+    def get_queued(self) -> set[tuple[str, str]]:
+        return set(SearchIndexQueue.objects.values_list("model", "object_id"))
+
+    def test_updates_are_coalesced(self):
+        for price in (1000, 2000, 3000):
+            self.cottage1.price = price
+            self.cottage1.save()
+        self.assertEqual(self.get_queued(), {("cottages.Cottage", str(self.cottage1.id))})
+        self.assertGreaterEqual(get_index_lag(), 0)
+
+    def test_related_changes(self):
+        self.town1.name = "Alagir"
+        self.town1.save()
+        self.assertEqual(self.get_queued(), {("towns.Town", str(self.town1.id))})
+        image = CottageImage.objects.create(cottage=self.cottage1, image="cottage_images/1/1.jpg")
+        SearchIndexQueue.objects.all().delete()
+        image.delete()
+        self.assertEqual(self.get_queued(), {("cottages.Cottage", str(self.cottage1.id))})
+
+    def test_review_updates_cottage_document(self):
+        UserCottageReview.objects.create(cottage=self.cottage1, user=self.user2, location_rating=1,
+                                         cleanliness_rating=1, communication_rating=1, value_rating=1)
+        self.assertIn(("cottages.Cottage", str(self.cottage1.id)), self.get_queued())
+
+    def test_pending_updates(self):
+        self.town1.name = "Alagir"
+        self.town1.save()
+        deleted = Cottage.objects.create(owner=self.user1, category=self.category1, name="Deleted", guests=1,
+                                         beds=1, rooms=1, total_area=10, parking_places=0,
+                                         check_in_time=datetime.time(hour=12), check_out_time=datetime.time(hour=12))
+        deleted_id = str(deleted.id)
+        deleted.delete()
+        updates = {document: (instances, deleted_pks) for document, instances, deleted_pks
+                   in get_pending_updates(list(SearchIndexQueue.objects.all()), 100)}
+        cottages, deleted_ids = updates[CottageDocument]
+        self.assertEqual([cottage.id for cottage in cottages], [self.cottage1.id])
+        self.assertEqual(cottages[0].town.name, "Alagir")
+        self.assertEqual(deleted_ids, {deleted_id})
+        self.assertEqual(updates[TownDocument], ([self.town1], set()))
+
+    def test_pending_updates_are_chunked(self):
+        call_command("generate_sample_data", users=2, towns=1, cottages=5, chats=0, stdout=StringIO())
+        town = Cottage.objects.exclude(town=None).latest("pk").town
+        SearchIndexQueue.objects.all().delete()
+        SearchIndexQueue.objects.enqueue(Town, [town.pk])
+        chunks = [(len(instances), len(deleted_pks)) for document, instances, deleted_pks
+                  in get_pending_updates(list(SearchIndexQueue.objects.all()), 2) if document is CottageDocument]
+        self.assertEqual(sum(indexed for indexed, _ in chunks), town.cottage_set.count())
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(indexed + deleted <= 2 for indexed, deleted in chunks))
+
+    def test_queue_is_restored_on_failure(self):
+        self.cottage1.save()
+        queued_at = SearchIndexQueue.objects.get().queued_at
+        with mock.patch.object(CottageDocument, "update", side_effect=TransportConnectionError("down")):
+            with self.assertRaises(TransportConnectionError):
+                flush_index_queue(100)
+        self.assertEqual(list(SearchIndexQueue.objects.values_list("object_id", "queued_at", "claimed_at")),
+                         [(str(self.cottage1.id), queued_at, None)])
+
+    def test_claimed_entries_stay_queued(self):
+        self.cottage1.save()
+        self.town1.save()
+        self.assertEqual(len(SearchIndexQueue.objects.claim(1)), 1)
+        self.assertEqual(len(SearchIndexQueue.objects.claim(10)), 1)
+        self.assertEqual(SearchIndexQueue.objects.claim(10), [])
+        self.assertEqual(SearchIndexQueue.objects.count(), 2)
+        with override_settings(SEARCH_INDEX_CLAIM_TIMEOUT=0):
+            entries = SearchIndexQueue.objects.claim(10)
+        self.assertEqual(len(entries), 2)
+        self.cottage1.save()
+        SearchIndexQueue.objects.complete(entries)
+        self.assertEqual(list(SearchIndexQueue.objects.values_list("object_id", "claimed_at")),
+                         [(str(self.cottage1.id), None)])
+
+    def test_pk_ranges(self):
+        call_command("generate_sample_data", users=2, towns=1, cottages=5, chats=0, stdout=StringIO())
+        pks = sorted(Cottage.objects.values_list("pk", flat=True))
+        self.assertEqual(get_pk_ranges(Cottage.objects.all(), 4), [(pks[0], pks[4]), (pks[4], None)])
+        self.assertEqual(get_pk_ranges(Cottage.objects.none(), 4), [])
+
+    def test_queue_is_flushed_during_reindex(self):
+        self.cottage1.save()
+        written = []
+        cache.set(REINDEX_TARGETS_KEY, {CottageDocument._index._name: "cottages-new"})
+        try:
+            with mock.patch.object(CottageDocument, "update") as update, \
+                    mock.patch("cottages.indexing.bulk", side_effect=lambda client, actions: written.extend(actions)):
+                self.assertEqual(flush_index_queue(100), 1)
+                self.assertEqual(flush_index_queue(100), 0)
+        finally:
+            cache.delete(REINDEX_TARGETS_KEY)
+        self.assertEqual([cottage.id for cottage in update.call_args.args[0]], [self.cottage1.id])
+        self.assertEqual([(action["_index"], action["_id"]) for action in written],
+                         [("cottages-new", self.cottage1.id)])
+        self.assertIsNotNone(SearchIndexQueue.objects.get().written_at)
+        self.assertEqual(get_index_lag(), 0)
+
+        written.clear()
+        with mock.patch("cottages.indexing.bulk", side_effect=lambda client, actions: written.extend(actions)):
+            self.assertEqual(replay_written_changes(CottageDocument, "cottages-new", 100), 1)
+        self.assertEqual([(action["_index"], action["_id"]) for action in written],
+                         [("cottages-new", self.cottage1.id)])
+
+        self.cottage1.save()
+        self.assertIsNone(SearchIndexQueue.objects.get().written_at)
+        with mock.patch.object(CottageDocument, "update"):
+            self.assertEqual(flush_index_queue(100), 1)
+        self.assertFalse(SearchIndexQueue.objects.exists())
+
+
+class UnavailableSearchBackend(SearchBackend):
+    unavailable_errors = (TransportConnectionError,)
+
+    def search_cottages(self, params, request):
+        raise TransportConnectionError("Connection refused")
+
+    def suggest(self, query):
+        raise TransportConnectionError("Connection refused")
+
+
+@override_settings(SEARCH_BACKEND="cottages.search_backends.LocalSearchBackend", SEARCH_FALLBACK_BACKEND="")
+class LocalSearchBackendTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        Cottage.objects.filter(pk=self.cottage1.pk).update(is_ready=True)
+        self.cottage2 = Cottage.objects.create(
+            owner=self.user1, town=self.town1, category=self.category1, name="Лесной домик", price=3000, guests=2,
+            beds=1, rooms=1, total_area=30, parking_places=1, check_in_time=datetime.time(hour=12),
+            check_out_time=datetime.time(hour=12), amenities=["wifi"], is_ready=True,
+        )
+        local_suggest_index.load()
+
+    def test_prefix_index(self):
+        index = PrefixIndex()
+        index.load([("1", "Лесной домик"), ("2", "Домик у реки")])
+        self.assertEqual(index.find("дом", 5), ["1", "2"])
+        self.assertEqual(index.find("лес", 5), ["1"])
+        index.add("1", "Шале")
+        self.assertEqual(index.find("дом", 5), ["2"])
+        index.remove("2")
+        self.assertEqual(index.find("дом", 5), [])
+
+    def test_suggest(self):
+        response = self.client.get(reverse("cottage-suggest"), {"query": "ДОМ"})
+        self.assertEqual(response.data["cottages"],
+                         [{"id": str(self.cottage2.id), "name": "Лесной домик", "town_name": "Vladikavkaz"}])
+        response = self.client.get(reverse("cottage-suggest"), {"query": "vlad"})
+        self.assertEqual(response.data["towns"], [{"id": str(self.town1.id), "name": "Vladikavkaz"}])
+        self.assertEqual(len(response.data["cottages"]), 2)
+
+    def test_suggest_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.town1.name = "Alagir"
+            self.town1.save()
+            self.cottage2.delete()
+        self.assertEqual(local_suggest_index.suggest("fam")["cottages"][0]["town_name"], "Alagir")
+        self.assertEqual(local_suggest_index.suggest("лес")["cottages"], [])
+
+    def test_search(self):
+        response = self.client.get(reverse("cottage-search"), {"query": "домик", "amenities": "wifi"})
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["results"][0]["id"], str(self.cottage2.id))
+        response = self.client.get(reverse("cottage-search"), {"ordering": "price", "page_size": 1})
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["results"][0]["name"], "Лесной домик")
+        self.assertIsNotNone(response.data["next"])
+        response = self.client.get(response.data["next"])
+        self.assertEqual([card["name"] for card in response.data["results"]], ["Family"])
+        self.assertIsNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
+        response = self.client.get(reverse("cottage-search"), {"guests": 4, "town": str(self.town1.id)})
+        self.assertEqual([card["name"] for card in response.data["results"]], ["Family"])
+
+    def test_fallback(self):
+        backend = FallbackSearchBackend(UnavailableSearchBackend(), LocalSearchBackend())
+        self.assertEqual(backend.suggest("лес")["cottages"][0]["id"], str(self.cottage2.id))
+
+    @override_settings(SEARCH_PRICE_FACET_INTERVAL=5000)
+    def test_search_facets(self):
+        invalidate_cottage_cache()
+        response = self.client.get(reverse("cottage-search"), {"facets": "true", "page_size": 1})
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["facets"], {
+            "categories": [{"id": str(self.category1.id), "name": "cottage", "count": 2}],
+            "towns": [{"id": str(self.town1.id), "name": "Vladikavkaz", "count": 2}],
+            "guests": [{"key": "1-2", "count": 1}, {"key": "3-4", "count": 0}, {"key": "5-8", "count": 1},
+                       {"key": "9+", "count": 0}],
+            "price": [{"from": 0, "to": 5000, "count": 1}, {"from": 5000, "to": 10000, "count": 1}],
+        })
+        response = self.client.get(reverse("cottage-search"), {"facets": "true", "page": 2, "page_size": 1})
+        self.assertIn('cache;desc="hits=1', response["Server-Timing"])
+        self.assertNotIn("facets", self.client.get(reverse("cottage-search")).data)
+
+
+@override_settings(SEARCH_ANALYTICS_ENABLED=True, SEARCH_ANALYTICS_BUFFER="cottages.analytics.LocalEventBuffer",
+                   SEARCH_ANALYTICS_TOP_RESULTS=2)
+class SearchAnalyticsTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        get_event_buffer.cache_clear()
+        self.addCleanup(get_event_buffer.cache_clear)
+
+    def test_events_are_buffered_and_flushed_in_batches(self):
+        deleted = Cottage.objects.create(
+            owner=self.user1, town=self.town1, category=self.category1, name="Удален", price=1000, guests=1,
+            beds=1, rooms=1, total_area=10, parking_places=0, check_in_time=datetime.time(hour=12),
+            check_out_time=datetime.time(hour=12),
+        )
+        record_search_event(SearchEvent.SEARCH, " Family ", [self.cottage1.id, deleted.id, self.cottage1.id])
+        record_search_event(SearchEvent.SUGGEST, "xyz")
+        record_search_event(SearchEvent.VIEW, cottage_ids=[deleted.id])
+        self.assertEqual(SearchEvent.objects.count(), 0)
+        deleted.delete()
+
+        self.assertEqual(flush_event_buffer(2), 2)
+        self.assertEqual(flush_event_buffer(2), 1)
+        self.assertEqual(flush_event_buffer(2), 0)
+        self.assertEqual(set(SearchEvent.objects.values_list("kind", "query", "cottage_id")), {
+            (SearchEvent.SEARCH, "family", self.cottage1.id),
+            (SearchEvent.SUGGEST, "xyz", None),
+        })
+
+    def test_views_record_events(self):
+        cache.set(get_cottage_suggest_cache_key("fam"), {"cottages": [{"id": str(self.cottage1.id)}], "towns": []})
+        self.client.get(reverse("cottage-detail", args=[self.cottage1.id]))
+        self.client.get(reverse("cottage-suggest"), {"query": " "})
+        response = self.client.get(reverse("cottage-suggest"), {"query": "fam"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        events = get_event_buffer().pop(10)
+        self.assertEqual([(event["kind"], event["cottages"]) for event in events],
+                         [(SearchEvent.VIEW, [str(self.cottage1.id)])])
+
+    def test_popularity_is_suggest_weight(self):
+        SearchEvent.objects.create(kind=SearchEvent.SEARCH, query="fam", cottage=self.cottage1)
+        SearchEvent.objects.create(kind=SearchEvent.SUGGEST, query="fa", cottage=self.cottage1)
+        SearchEvent.objects.create(kind=SearchEvent.VIEW, cottage=self.cottage1)
+        SearchEvent.objects.create(kind=SearchEvent.VIEW, cottage=self.cottage1,
+                                   created_at=timezone.now() - datetime.timedelta(days=365))
+        today = timezone.localdate()
+        UserCottageRent.objects.create(cottage=self.cottage1, user=self.user1, status=2, start_date=today,
+                                       end_date=today + datetime.timedelta(days=2))
+        document = CottageDocument()
+        source = document.prepare(document.get_queryset().get(pk=self.cottage1.pk))
+        self.assertEqual(source["name_suggest"], {"input": [self.cottage1.name], "weight": 1 + 5 + 20})
+        self.assertEqual(source["town_name_suggest"]["weight"], 26)
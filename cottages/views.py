@@ -1,36 +1,41 @@
 from datetime import datetime
 from uuid import UUID
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Max
 from django.http import Http404
-from django_filters.rest_framework import DjangoFilterBackend
+from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.search_base import Request as ElasticRequest, Response as ElasticResponse
 from rest_framework import status
 from rest_framework.decorators import api_view
-from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from cottages.documents import CottageDocument, TownDocument
-from cottages.models import Cottage, CottageImage
+from core.metrics import record_cache_lookup
+from cottages.analytics import record_search_event
+from cottages.cache import get_cottage_detail_cache_key, get_cottage_list_cache_key
+from cottages.filters import CottageFilter
+from cottages.models import Cottage, CottageImage, SearchEvent
+from cottages.pagination import CottageKeysetPagination
 from cottages.permissions import IsOwnerOrReadOnly
+from cottages.pricing import get_stay_quotes
+from cottages.search_backends import get_search_backend
 from cottages.serializers import (
     CottageCreateUpdateSerializer,
     CottageDetailSerializer,
     CottageInfoWithRatingSerializer,
+    CottageQuoteSerializer,
+    CottageSearchSerializer,
     ImageUpdateSerializer,
 )
 
 
 class CottageList(APIView):
     permission_classes = [IsOwnerOrReadOnly]
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
-    filterset_fields = ["name", "price", "average_rating"]
-    ordering_fields = ["price", "average_rating"]
-    ordering = ["-average_rating"]
+    filterset_class = CottageFilter
+    pagination_class = CottageKeysetPagination
 
     def get_queryset(self):
         pass
@@ -41,13 +46,30 @@ class CottageList(APIView):
         end_date = request.query_params.get('end_date')
         if start_date and end_date:
             try:
-                datetime.strptime(start_date, '%Y-%m-%d')
-                datetime.strptime(end_date, '%Y-%m-%d')
+                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
             except ValueError:
                 return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
-        queryset = Cottage.objects.get_cottages_list(start_date=start_date, end_date=end_date)
-        serializer = CottageInfoWithRatingSerializer(queryset, many=True)
-        return Response(serializer.data)
+            if start_date >= end_date:
+                return Response({"error": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            start_date = end_date = None
+        params = {**request.query_params.dict(), "start_date": start_date, "end_date": end_date,
+                  "host": request.get_host()}
+        cache_key = get_cottage_list_cache_key(params.items(), with_dates=start_date is not None)
+        data = cache.get(cache_key)
+        record_cache_lookup(data is not None)
+        if data is None:
+            queryset = Cottage.objects.get_cottages_list(start_date=start_date, end_date=end_date)
+            filterset = self.filterset_class(request.query_params, queryset=queryset)
+            if not filterset.is_valid():
+                return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(filterset.qs, request, view=self)
+            serializer = CottageInfoWithRatingSerializer(page, many=True)
+            data = paginator.get_paginated_response(serializer.data).data
+            cache.set(cache_key, data, settings.COTTAGES_CACHE_TIMEOUT)
+        return Response(data)
 
     # noinspection PyMethodMayBeStatic
     def post(self, request: Request) -> Response:
@@ -71,11 +93,21 @@ class CottageDetail(APIView):
 
     # noinspection PyMethodMayBeStatic
     def get(self, request: Request, cottage_id: UUID) -> Response:
-        cottage = Cottage.objects.get_cottage_by_id(cottage_id)
-        if cottage is None:
-            raise Http404("Cottage does not exist")
-        serializer = CottageDetailSerializer(instance=cottage)
-        return Response(serializer.data)
+        occupancy_format = request.query_params.get("occupancy_format")
+        cache_key = get_cottage_detail_cache_key(
+            cottage_id, [("occupancy_format", occupancy_format), ("date", timezone.localdate())]
+        )
+        data = cache.get(cache_key)
+        record_cache_lookup(data is not None)
+        if data is None:
+            cottage = Cottage.objects.get_cottage_by_id(cottage_id)
+            if cottage is None:
+                raise Http404("Cottage does not exist")
+            serializer = CottageDetailSerializer(instance=cottage, context={"occupancy_format": occupancy_format})
+            data = serializer.data
+            cache.set(cache_key, data, settings.COTTAGES_CACHE_TIMEOUT)
+        record_search_event(SearchEvent.VIEW, cottage_ids=[cottage_id])
+        return Response(data)
 
     def put(self, request: Request, cottage_id: UUID) -> Response:
         cottage = self.get_object(cottage_id)
@@ -92,55 +124,39 @@ class CottageDetail(APIView):
         return Response({'status': 'Cottage deleted successfully'}, status=status.HTTP_200_OK)
 
 
+@swagger_auto_schema(
+    method="get",
+    query_serializer=CottageSearchSerializer,
+)
 @api_view(['GET'])
-def cottage_search(request):
-    query = request.query_params.get('query', '')
-    search = CottageDocument.search().query("multi_match", query=query, fields=['name', 'town.name'])
-    response = search.execute()
-    cottage_ids = [hit.id for hit in response]
-    cottages = Cottage.objects.get_cottages_list().filter(id__in=cottage_ids)
-    serializer = CottageInfoWithRatingSerializer(cottages, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+def cottage_search(request: Request) -> Response:
+    serializer = CottageSearchSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+    data = get_search_backend().search_cottages(params, request)
+    if params["query"] and params["page"] == 1 and "cursor" not in params:
+        record_search_event(SearchEvent.SEARCH, params["query"], [card["id"] for card in data["results"]])
+    return Response(data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
-def cottage_suggest(request):
+def cottage_suggest(request: Request) -> Response:
     query = request.query_params.get('query', '')
+    return Response(get_search_backend().suggest(query), status.HTTP_200_OK)
+
 
-    search: Search = CottageDocument.search()
-    suggest: Search = search.suggest('name_suggestions', query, completion={'field': 'name.suggest'})
-    suggest: Search = suggest.suggest('town_name_suggestions', query, completion={'field': 'town_name.suggest'})
-    response: ElasticResponse = suggest.execute()
-    cottage_name_suggestions = [
-        {
-            'id': option._source.id,
-            'name': option._source.name,
-            'town_name': option._source.town_name
-        }
-        for option in response.suggest.name_suggestions[0].options
-    ]
-
-    cottage_town_suggestions = [
-        {
-            'id': option._source.id,
-            'name': option._source.name,
-            'town_name': option._source.town_name
-        }
-        for option in response.suggest.town_name_suggestions[0].options
-    ]
-    cottage_suggestions = cottage_name_suggestions + cottage_town_suggestions
-    search = TownDocument.search()
-    suggest: Search = search.suggest('name_suggestions', query, completion={'field': 'name.suggest'})
-    response: ElasticResponse = suggest.execute()
-    town_suggestions = [
-        {
-            'id': option._source.id,
-            'name': option._source.name,
-        }
-        for option in response.suggest.name_suggestions[0].options
-    ]
-    data = {"cottages": cottage_suggestions, "towns": town_suggestions}
-    return Response(data, status.HTTP_200_OK)
+@swagger_auto_schema(
+    method="post",
+    request_body=CottageQuoteSerializer,
+)
+@api_view(['POST'])
+def cottage_quotes(request: Request) -> Response:
+    """Return total prices of the stay for many cottages, used by listings with dates"""
+    serializer = CottageQuoteSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+    data = get_stay_quotes(params["cottage_ids"], params["start_date"], params["end_date"])
+    return Response({"data": data}, status=status.HTTP_200_OK)
 
 
 @swagger_auto_schema(
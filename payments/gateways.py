@@ -0,0 +1,140 @@
+import abc
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from yookassa import Configuration
+from yookassa import Payment as UkassaPayment
+
+
+class GatewayError(Exception):
+    """Payment provider did not process the request"""
+
+
+@dataclass(frozen=True)
+class GatewayPayment:
+    id: str
+    status: str
+    amount: Decimal
+    confirmation_url: str
+    response: str
+
+
+def get_payment_response(payment_id: str, payment_status: str, amount: Decimal, confirmation_url: str,
+                         description: str = "") -> dict:
+    """Return payment object in IOKassa format"""
+    return {
+        "id": payment_id, "status": payment_status, "paid": payment_status == "succeeded", "test": True,
+        "refundable": False, "metadata": {}, "description": description,
+        "amount": {"value": str(amount), "currency": "RUB"},
+        "created_at": timezone.now().isoformat(timespec="milliseconds"),
+        "confirmation": {"type": "redirect", "confirmation_url": confirmation_url},
+    }
+
+
+class PaymentGateway(abc.ABC):
+    """Payment provider used by payments"""
+
+    @abc.abstractmethod
+    def create_payment(self, amount: Decimal, description: str, return_url: str,
+                       idempotence_key: str) -> GatewayPayment:
+        """Create payment, repeated calls with the same idempotence key return the same payment"""
+
+    @abc.abstractmethod
+    def get_status(self, payment_id: str) -> str:
+        """Return current status of payment in the provider"""
+
+
+class YooKassaGateway(PaymentGateway):
+
+    def __init__(self):
+        Configuration.configure(settings.YOOMONEY_SHOP_ID, settings.YOOMONEY_SHOP_SECRET)
+
+    def create_payment(self, amount: Decimal, description: str, return_url: str,
+                       idempotence_key: str) -> GatewayPayment:
+        payment = UkassaPayment.create({
+            "amount": {
+                "value": amount,
+                "currency": "RUB"
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": return_url
+            },
+            "capture": True,
+            "description": description
+        }, idempotence_key)
+        return GatewayPayment(id=payment.id, status=payment.status, amount=Decimal(str(payment.amount.value)),
+                              confirmation_url=payment.confirmation.confirmation_url, response=payment.json())
+
+    def get_status(self, payment_id: str) -> str:
+        return UkassaPayment.find_one(payment_id).status
+
+
+class FakeGateway(PaymentGateway):
+    """In-process IOKassa stand-in for load testing on a single machine.
+
+    Every call waits PAYMENTS_FAKE_LATENCY seconds and fails with PAYMENTS_FAKE_FAILURE_RATE probability.
+    Payment is pending for PAYMENTS_FAKE_CONFIRM_DELAY seconds, then it is succeeded with
+    PAYMENTS_FAKE_SUCCESS_RATE probability or canceled. Creation time is a part of payment id and the outcome
+    depends on the id only, so payments created by web processes are checked by Celery workers consistently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._payments: dict[str, GatewayPayment] = {}
+
+    # noinspection PyMethodMayBeStatic
+    def call_provider(self) -> None:
+        time.sleep(settings.PAYMENTS_FAKE_LATENCY)
+        if random.random() < settings.PAYMENTS_FAKE_FAILURE_RATE:
+            raise GatewayError("Fake payment gateway failure")
+
+    def create_payment(self, amount: Decimal, description: str, return_url: str,
+                       idempotence_key: str) -> GatewayPayment:
+        self.call_provider()
+        with self._lock:
+            if str(idempotence_key) not in self._payments:
+                payment_id = f"fake-{time.time_ns() // 1_000_000}-{uuid.uuid4().hex[:12]}"
+                confirmation_url = f"{return_url}?orderId={payment_id}"
+                self._payments[str(idempotence_key)] = GatewayPayment(
+                    id=payment_id, status="pending", amount=amount, confirmation_url=confirmation_url,
+                    response=json.dumps(get_payment_response(payment_id, "pending", amount, confirmation_url,
+                                                             description)),
+                )
+            return self._payments[str(idempotence_key)]
+
+    def get_status(self, payment_id: str) -> str:
+        self.call_provider()
+        return self.get_final_status(payment_id) or "pending"
+
+    # noinspection PyMethodMayBeStatic
+    def get_final_status(self, payment_id: str) -> str | None:
+        """Return status the payment has come to, None if it is pending"""
+        created_at = int(payment_id.split("-")[1]) / 1000
+        if time.time() - created_at < settings.PAYMENTS_FAKE_CONFIRM_DELAY:
+            return None
+        return "succeeded" if random.Random(payment_id).random() < settings.PAYMENTS_FAKE_SUCCESS_RATE else "canceled"
+
+    def get_notification(self, payment: GatewayPayment) -> dict | None:
+        """Return IOKassa webhook notification about payment, None if it is pending"""
+        payment_status = self.get_final_status(payment.id)
+        if payment_status is None:
+            return None
+        return {
+            "type": "notification", "event": f"payment.{payment_status}",
+            "object": get_payment_response(payment.id, payment_status, payment.amount, payment.confirmation_url),
+        }
+
+
+@lru_cache
+def get_payment_gateway() -> PaymentGateway:
+    return import_string(settings.PAYMENTS_GATEWAY)()
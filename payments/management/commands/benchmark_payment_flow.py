@@ -0,0 +1,132 @@
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cottages.models import Cottage
+from payments.gateways import FakeGateway, GatewayPayment, get_payment_gateway
+from payments.models import Payment, PaymentNotification, PaymentNotificationManager
+from payments.services import apply_notification_batch, check_payments
+from relations.models import UserCottageRent
+from users.models import User
+
+START_DATE = datetime.date(2100, 1, 1)
+
+
+def percentile(values: list[float], percent: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(round(percent / 100 * (len(ordered) - 1)), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Book cottages, check payments by the sweeper and apply webhooks end to end against the fake payment "
+            "gateway. Rents are created in the configured database and deleted afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bookings", type=int, default=200, help="Number of booking requests")
+        parser.add_argument("--concurrency", type=int, default=4, help="Parallel booking clients and status checks")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake gateway latency in seconds")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Fake gateway failure probability")
+        parser.add_argument("--success-rate", type=float, default=0.9, help="Probability of succeeded payment")
+
+    def handle(self, *args, **options):
+        cottages = list(Cottage.objects.filter(is_ready=True).values_list("id", flat=True)[:100])
+        user = User.objects.filter(is_active=True).first()
+        if not cottages or user is None:
+            raise CommandError("Create cottages and users first, for example with generate_sample_data")
+        logging.getLogger("core.requests").setLevel(logging.WARNING)
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        get_payment_gateway.cache_clear()
+        # notifications are applied by the command, not by Celery, other processes schedule them as usual
+        fake_gateway = override_settings(PAYMENTS_GATEWAY="payments.gateways.FakeGateway",
+                                         PAYMENTS_ASYNC_CREATION=False, PAYMENTS_FAKE_LATENCY=options["latency"],
+                                         PAYMENTS_FAKE_FAILURE_RATE=options["failure_rate"],
+                                         PAYMENTS_FAKE_SUCCESS_RATE=options["success_rate"],
+                                         PAYMENTS_FAKE_CONFIRM_DELAY=0)
+        with mock.patch.object(PaymentNotificationManager, "schedule_apply"), fake_gateway:
+            payment_ids = []
+            try:
+                payment_ids = self.book(cottages, user, options["bookings"], options["concurrency"])
+                self.send_webhooks(payment_ids[::2])
+                self.check_statuses(payment_ids[1::2], options["concurrency"])
+                self.report_statuses(payment_ids)
+            finally:
+                rents = UserCottageRent.objects.filter(user=user, cottage_id__in=cottages, start_date__gte=START_DATE)
+                PaymentNotification.objects.filter(
+                    ukassa_id__in=Payment.objects.filter(rent__in=rents).values("ukassa_id")
+                ).delete()
+                rents.delete()
+                get_payment_gateway.cache_clear()
+
+    def book(self, cottages: list, user: User, bookings: int, concurrency: int) -> list:
+
+        def post_booking(number: int) -> tuple[float, str | None]:
+            client = Client(SERVER_NAME="localhost", raise_request_exception=False)
+            client.force_login(user)
+            check_in = START_DATE + datetime.timedelta(days=number // len(cottages) * 2)
+            started = time.perf_counter()
+            try:
+                response = client.post(reverse("rents-create", args=[cottages[number % len(cottages)]]), {
+                    "start_date": check_in, "end_date": check_in + datetime.timedelta(days=1)
+                }, content_type="application/json")
+                payment_id = response.json()["data"]["id"] if response.status_code == 201 else None
+            except Exception:
+                payment_id = None
+            finally:
+                connection.close()
+            return (time.perf_counter() - started) * 1000, payment_id
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(post_booking, range(bookings)))
+        seconds = time.perf_counter() - started
+        timings = [timing for timing, _ in results]
+        payment_ids = [payment_id for _, payment_id in results if payment_id]
+        self.stdout.write(
+            f"book: {bookings / seconds:.1f} requests/s, p50 {percentile(timings, 50):.1f} ms, "
+            f"p95 {percentile(timings, 95):.1f} ms, {bookings - len(payment_ids)} errors"
+        )
+        return payment_ids
+
+    def send_webhooks(self, payment_ids: list) -> None:
+        gateway: FakeGateway = get_payment_gateway()
+        client = Client(SERVER_NAME="localhost")
+        notifications = [
+            gateway.get_notification(GatewayPayment(id=payment.ukassa_id, status=payment.status, amount=payment.amount,
+                                                    confirmation_url=payment.redirect_url, response=""))
+            for payment in Payment.objects.filter(pk__in=payment_ids)
+        ]
+        started = time.perf_counter()
+        errors = sum(
+            client.post(reverse("update-status"), notification, content_type="application/json").status_code != 200
+            for notification in notifications
+        )
+        received = time.perf_counter() - started
+        started = time.perf_counter()
+        while apply_notification_batch(batch_size=500):
+            pass
+        applied = time.perf_counter() - started
+        self.stdout.write(f"webhooks: {len(notifications) / received:.1f} received/s, "
+                          f"{len(notifications) / applied:.1f} applied/s, {errors} errors")
+
+    def check_statuses(self, payment_ids: list, concurrency: int) -> None:
+        """Check payments the way the status sweeper does, other payments of the database are not touched"""
+        payments = list(Payment.objects.filter(pk__in=payment_ids).order_by("created_at"))
+        started = time.perf_counter()
+        changed = sum(check_payments(payments[number:number + 100], timezone.now(), concurrency)
+                      for number in range(0, len(payments), 100))
+        seconds = time.perf_counter() - started
+        self.stdout.write(f"sweep: {len(payments) / seconds:.1f} checked/s, {changed} changed")
+
+    def report_statuses(self, payment_ids: list) -> None:
+        statuses = {}
+        for payment_status in Payment.objects.filter(pk__in=payment_ids).values_list("status", flat=True):
+            statuses[payment_status] = statuses.get(payment_status, 0) + 1
+        self.stdout.write("statuses: " + ", ".join(f"{name} {count}" for name, count in sorted(statuses.items())))
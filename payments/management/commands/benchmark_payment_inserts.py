@@ -0,0 +1,107 @@
+import datetime
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from cottages.models import Cottage
+from payments.models import Payment, PaymentResponseArchive
+from relations.models import UserCottageRent
+
+
+def build_legacy_payment_model() -> type[models.Model]:
+    """Payment as it was before the schema was slimmed, every column is indexed and response is inline"""
+
+    class LegacyPayment(models.Model):
+        id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_index=True)
+        rent_id = models.UUIDField(db_index=True)
+        ukassa_id = models.CharField(max_length=100, db_index=True)
+        redirect_url = models.URLField(db_index=True)
+        amount = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
+        status = models.CharField(max_length=50, db_index=True)
+        created_at = models.DateTimeField(db_index=True)
+        ukassa_response = models.JSONField(db_index=True)
+
+        class Meta:
+            apps = Apps()
+            app_label = "payments"
+            db_table = "payments_legacy_benchmark"
+
+    return LegacyPayment
+
+
+def get_ukassa_response(ukassa_id: str) -> str:
+    return json.dumps({
+        "id": ukassa_id, "status": "pending", "paid": False, "test": False, "refundable": False,
+        "amount": {"value": "9500.00", "currency": "RUB"}, "created_at": timezone.now().isoformat(),
+        "confirmation": {"type": "redirect", "confirmation_url": f"https://yoomoney.ru/checkout/payments/v2/"
+                                                                 f"contract?orderId={ukassa_id}"},
+        "recipient": {"account_id": "100500", "gateway_id": "100700"},
+        "description": "Cottage rent", "metadata": {"cms_name": "cottages", "order_id": ukassa_id},
+    })
+
+
+class Command(BaseCommand):
+    help = ("Measure single-row insert throughput of payments with the current schema and with the former one, "
+            "rows are written to the configured database and deleted afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=2000, help="Payments inserted per schema")
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        cottage = Cottage.objects.select_related("owner").first()
+        if cottage is None:
+            raise CommandError("Create a cottage first, for example with generate_sample_data")
+        start_date = datetime.date(2100, 1, 1)
+        rents = UserCottageRent.objects.bulk_create([
+            UserCottageRent(cottage=cottage, user=cottage.owner, status=3,
+                            start_date=start_date + datetime.timedelta(days=number),
+                            end_date=start_date + datetime.timedelta(days=number + 1))
+            for number in range(count)
+        ])
+        legacy_model = build_legacy_payment_model()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(legacy_model)
+        try:
+            self.report("former", legacy_model._meta.db_table, count / self.insert_legacy(legacy_model, rents))
+            self.report("current", Payment._meta.db_table, count / self.insert_current(rents))
+        finally:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.delete_model(legacy_model)
+            UserCottageRent.objects.filter(pk__in=[rent.pk for rent in rents]).delete()
+
+    @staticmethod
+    def insert_legacy(model: type[models.Model], rents: list[UserCottageRent]) -> float:
+        started = time.perf_counter()
+        for rent in rents:
+            ukassa_id = str(uuid.uuid4())
+            with transaction.atomic():
+                model.objects.create(rent_id=rent.pk, ukassa_id=ukassa_id, amount=Decimal("9500.00"),
+                                     redirect_url=f"https://yoomoney.ru/checkout?orderId={ukassa_id}",
+                                     status="pending", created_at=timezone.now(),
+                                     ukassa_response=get_ukassa_response(ukassa_id))
+        return time.perf_counter() - started
+
+    @staticmethod
+    def insert_current(rents: list[UserCottageRent]) -> float:
+        started = time.perf_counter()
+        for rent in rents:
+            ukassa_id = str(uuid.uuid4())
+            with transaction.atomic():
+                payment = Payment.objects.create(rent=rent, ukassa_id=ukassa_id, amount=Decimal("9500.00"),
+                                                 redirect_url=f"https://yoomoney.ru/checkout?orderId={ukassa_id}",
+                                                 status="pending")
+                PaymentResponseArchive.objects.archive(payment, get_ukassa_response(ukassa_id))
+        return time.perf_counter() - started
+
+    def report(self, name: str, table: str, rate: float) -> None:
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        indexes = sum(1 for constraint in constraints.values() if constraint["index"] or constraint["unique"])
+        self.stdout.write(f"{name:>8}: {rate:.0f} payments/s, {indexes} indexes on {table}")
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_remove_payment_payment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='redirect_url',
+            field=models.URLField(blank=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='ukassa_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='ukassa_response',
+            field=models.JSONField(blank=True, db_index=True, null=True),
+        ),
+    ]
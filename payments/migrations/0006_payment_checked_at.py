@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payment_pending_creation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время проверки статуса'),
+        ),
+    ]
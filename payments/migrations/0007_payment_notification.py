@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 12:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_payment_checked_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_key', models.CharField(max_length=150, unique=True, verbose_name='Ключ события')),
+                ('event', models.CharField(max_length=50, verbose_name='Событие')),
+                ('ukassa_id', models.CharField(max_length=100, verbose_name='ID платежа ЮKassa')),
+                ('status', models.CharField(max_length=50, verbose_name='Статус')),
+                ('payload', models.JSONField(verbose_name='Уведомление')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Время обработки')),
+            ],
+            options={
+                'verbose_name': 'Уведомление о платеже',
+                'verbose_name_plural': 'Уведомления о платежах',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paymentnotification',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['received_at'], name='payment_notification_new_idx'),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 4.2 on 2026-10-18 12:37
+
+import json
+import uuid
+import zlib
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def archive_responses(apps, schema_editor):
+    """Move provider responses to compressed archive in batches"""
+    Payment = apps.get_model("payments", "Payment")
+    PaymentResponseArchive = apps.get_model("payments", "PaymentResponseArchive")
+    now = django.utils.timezone.now()
+    batch = []
+    payments = Payment.objects.exclude(ukassa_response__isnull=True).values_list("id", "ukassa_response")
+    for payment_id, response in payments.iterator(chunk_size=1000):
+        if not isinstance(response, str):
+            response = json.dumps(response)
+        batch.append(PaymentResponseArchive(payment_id=payment_id, data=zlib.compress(response.encode()),
+                                            archived_at=now))
+        if len(batch) >= 1000:
+            PaymentResponseArchive.objects.bulk_create(batch)
+            batch = []
+    PaymentResponseArchive.objects.bulk_create(batch)
+
+
+def restore_responses(apps, schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    PaymentResponseArchive = apps.get_model("payments", "PaymentResponseArchive")
+    for archive in PaymentResponseArchive.objects.iterator(chunk_size=1000):
+        Payment.objects.filter(pk=archive.payment_id).update(
+            ukassa_response=zlib.decompress(archive.data).decode()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_payment_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentResponseArchive',
+            fields=[
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='response_archive', serialize=False, to='payments.payment', verbose_name='Платёж')),
+                ('data', models.BinaryField(verbose_name='Ответ ЮKassa (zlib)')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время сохранения')),
+            ],
+            options={
+                'verbose_name': 'Ответ ЮKassa',
+                'verbose_name_plural': 'Архив ответов ЮKassa',
+            },
+        ),
+        migrations.RunPython(archive_responses, restore_responses),
+        migrations.RemoveField(
+            model_name='payment',
+            name='ukassa_response',
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='redirect_url',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+        ),
+    ]
@@ -1,74 +1,179 @@
 import datetime
+import json
 import uuid
+import zlib
 from decimal import Decimal
+from typing import Union
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models, transaction
-from yookassa import Configuration
-from yookassa import Payment as UkassaPayment
+from django.utils import timezone
 
+from core.celery import app
+from cottages.pricing import get_stay_price
+from payments.gateways import GatewayPayment, get_payment_gateway
 from relations.models import UserCottageRent
 
-Configuration.account_id = settings.YOOMONEY_SHOP_ID
-Configuration.secret_key = settings.YOOMONEY_SHOP_SECRET
-
 
 class PaymentManager(models.Manager):
 
     def create_payment(self, rent: UserCottageRent, return_url: str = 'localhost:8000/cottages'):
         """ Create Payment and add it to DB """
-        ukassa_payment = self._create_ukassa_payment(rent, return_url)
-        new_payment = self.create(
-            rent=rent,
-            amount=ukassa_payment.amount.value,
-            ukassa_id=ukassa_payment.id,
-            redirect_url=ukassa_payment.confirmation["confirmation_url"],
-            status=ukassa_payment.status,
-            created_at=datetime.datetime.now(),
-            ukassa_response=ukassa_payment.json()
-        )
+        ukassa_payment = self._create_ukassa_payment(rent, self.get_rent_amount(rent), return_url)
+        with transaction.atomic():
+            new_payment = self.create(
+                rent=rent,
+                amount=ukassa_payment.amount,
+                ukassa_id=ukassa_payment.id,
+                redirect_url=ukassa_payment.confirmation_url,
+                status=ukassa_payment.status,
+                created_at=datetime.datetime.now(),
+            )
+            PaymentResponseArchive.objects.archive(new_payment, ukassa_payment.response)
         return new_payment
 
-    @staticmethod
-    def _create_ukassa_payment(rent: UserCottageRent, return_url: str) -> UkassaPayment:
-        """ Create IOKassa payment and return it """
-        payment = UkassaPayment.create({
-            "amount": {
-                "value": Decimal(str(rent.cottage.price)),
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": return_url
-            },
-            "capture": True,
-            "description": rent.__str__()
-        }, rent.id)
+    def create_pending_payment(self, rent: UserCottageRent, amount: Decimal | None = None) -> "Payment":
+        """Create payment without calling YooKassa, it is sent there by create_ukassa_payment task"""
+        if amount is None:
+            amount = self.get_rent_amount(rent)
+        return self.create(rent=rent, amount=amount, status=Payment.NEW)
+
+    def send_to_ukassa(self, payment_id: uuid.UUID,
+                       return_url: str = 'localhost:8000/cottages') -> Union["Payment", None]:
+        """Create IOKassa payment for new payment, rent is the idempotence key so retries create one payment"""
+        payment = self.select_related("rent__cottage").filter(pk=payment_id, status=Payment.NEW).first()
+        if payment is None:
+            return None
+        ukassa_payment = self._create_ukassa_payment(payment.rent, payment.amount, return_url)
+        payment.amount = ukassa_payment.amount
+        payment.ukassa_id = ukassa_payment.id
+        payment.redirect_url = ukassa_payment.confirmation_url
+        payment.status = ukassa_payment.status
+        with transaction.atomic():
+            payment.save(update_fields=["amount", "ukassa_id", "redirect_url", "status"])
+            PaymentResponseArchive.objects.archive(payment, ukassa_payment.response)
         return payment
 
+    @staticmethod
+    def get_rent_amount(rent: UserCottageRent) -> Decimal:
+        """Return price of all nights of the rent, raise ValueError if price of some night is not set"""
+        amount = get_stay_price(rent.cottage, rent.start_date, rent.end_date)
+        if amount is None:
+            raise ValueError(f"Price of rent {rent.pk} is not set")
+        return amount
+
+    @staticmethod
+    def _create_ukassa_payment(rent: UserCottageRent, amount: Decimal, return_url: str) -> GatewayPayment:
+        """ Create payment in PAYMENTS_GATEWAY and return it """
+        return get_payment_gateway().create_payment(amount, rent.__str__(), return_url, str(rent.id))
+
 
 class Payment(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_index=True)
-    rent = models.ForeignKey(UserCottageRent, on_delete=models.CASCADE, related_name='payments', db_index=True)
-    ukassa_id = models.CharField(max_length=100, db_index=True)
-    redirect_url = models.URLField(db_index=True)
-    amount = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
-    status = models.CharField(max_length=50, db_index=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
-    ukassa_response = models.JSONField(db_index=True)
+    NEW = "new"
+    ACTIVE_STATUSES = (NEW, "pending", "waiting_for_capture")
+    RENT_STATUSES = {"succeeded": 2, "canceled": 3}
+    # money taken by IOKassa is not lost if payment was canceled here first, succeeded follows canceled
+    STATUS_ORDER = {NEW: 0, "pending": 1, "waiting_for_capture": 2, "canceled": 3, "succeeded": 4}
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    rent = models.ForeignKey(UserCottageRent, on_delete=models.CASCADE, related_name='payments')
+    ukassa_id = models.CharField(max_length=100, blank=True, db_index=True)
+    redirect_url = models.URLField(blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    checked_at = models.DateTimeField(null=True, blank=True, verbose_name="Время проверки статуса")
 
     objects = PaymentManager()
 
     class Meta:
         verbose_name = 'Платёж'
         verbose_name_plural = 'Платежи'
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="payment_status_created_idx"),
+        ]
 
     def __str__(self):
         return f'Payment {self.id} for rent {self.rent}'
 
+    def can_change_status(self, status: str) -> bool:
+        """Return True if status follows the current one, succeeded payment is not changed"""
+        return self.STATUS_ORDER.get(status, 0) > self.STATUS_ORDER.get(self.status, 0)
+
     def change_payment_status(self, status: str):
         with transaction.atomic():
             self.status = status
             self.save()
-            self.rent.status = 2 if status == "succeeded" else 3
-            self.rent.save()
+            if status in self.RENT_STATUSES:
+                self.rent.status = self.RENT_STATUSES[status]
+                self.rent.save()
+
+
+class PaymentResponseArchiveManager(models.Manager):
+
+    def archive(self, payment: Payment, response: str) -> None:
+        """Store IOKassa response of payment compressed, it replaces the previous response"""
+        self.bulk_create(
+            [self.model(payment=payment, data=zlib.compress(response.encode()), archived_at=timezone.now())],
+            update_conflicts=True, unique_fields=["payment"], update_fields=["data", "archived_at"],
+        )
+
+
+class PaymentResponseArchive(models.Model):
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, primary_key=True,
+                                   related_name="response_archive", verbose_name="Платёж")
+    data = models.BinaryField(verbose_name="Ответ ЮKassa (zlib)")
+    archived_at = models.DateTimeField(default=timezone.now, verbose_name="Время сохранения")
+
+    objects = PaymentResponseArchiveManager()
+
+    class Meta:
+        verbose_name = 'Ответ ЮKassa'
+        verbose_name_plural = 'Архив ответов ЮKassa'
+
+    def __str__(self):
+        return f'Response for payment {self.payment_id}'
+
+    def get_response(self) -> dict:
+        return json.loads(zlib.decompress(self.data))
+
+
+class PaymentNotificationManager(models.Manager):
+    APPLY_SCHEDULED_KEY = "payments:notifications:apply-scheduled"
+
+    def receive(self, event: str, ukassa_id: str, status: str, payload: dict) -> None:
+        """Store IOKassa notification once, repeated deliveries of the event are ignored"""
+        notification = self.model(event_key=f"{event}:{ukassa_id}", event=event, ukassa_id=ukassa_id, status=status,
+                                  payload=payload)
+        self.bulk_create([notification], ignore_conflicts=True)
+        transaction.on_commit(self.schedule_apply)
+
+    def schedule_apply(self) -> None:
+        """Schedule one task per delay window, notifications received meanwhile are applied together"""
+        delay = settings.PAYMENTS_NOTIFICATIONS_APPLY_DELAY
+        if cache.add(self.APPLY_SCHEDULED_KEY, True, timeout=delay):
+            app.send_task("payments.tasks.apply_payment_notifications", countdown=delay)
+
+
+class PaymentNotification(models.Model):
+    event_key = models.CharField(max_length=150, unique=True, verbose_name="Ключ события")
+    event = models.CharField(max_length=50, verbose_name="Событие")
+    ukassa_id = models.CharField(max_length=100, verbose_name="ID платежа ЮKassa")
+    status = models.CharField(max_length=50, verbose_name="Статус")
+    payload = models.JSONField(verbose_name="Уведомление")
+    received_at = models.DateTimeField(default=timezone.now, verbose_name="Время получения")
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name="Время обработки")
+
+    objects = PaymentNotificationManager()
+
+    class Meta:
+        verbose_name = 'Уведомление о платеже'
+        verbose_name_plural = 'Уведомления о платежах'
+        indexes = [
+            models.Index(fields=["received_at"], condition=models.Q(processed_at__isnull=True),
+                         name="payment_notification_new_idx"),
+        ]
+
+    def __str__(self):
+        return self.event_key
@@ -0,0 +1,151 @@
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from cottages.cache import invalidate_cottage_availability
+from payments.gateways import get_payment_gateway
+from payments.models import Payment, PaymentNotification
+from relations.models import UserCottageRent
+
+logger = logging.getLogger(__name__)
+
+
+def get_ukassa_status(ukassa_id: str) -> str | None:
+    """Return status of IOKassa payment or None if it is not available now"""
+    try:
+        return get_payment_gateway().get_status(ukassa_id)
+    except Exception as error:
+        logger.warning("Status of payment %s is not received: %s", ukassa_id, error)
+        return None
+
+
+def get_payments_due_for_check(now: datetime.datetime, batch_size: int) -> list[Payment]:
+    """Return active payments not checked for PAYMENTS_CHECK_INTERVAL seconds, never checked go first"""
+    checked_before = now - datetime.timedelta(seconds=settings.PAYMENTS_CHECK_INTERVAL)
+    return list(
+        Payment.objects.filter(status__in=Payment.ACTIVE_STATUSES).filter(
+            Q(checked_at__isnull=True) | Q(checked_at__lt=checked_before)
+        ).order_by(F("checked_at").asc(nulls_first=True), "created_at")[:batch_size]
+    )
+
+
+def get_changed_rent(payment: Payment) -> UserCottageRent | None:
+    """Return rent of payment with status following the payment status, None if it is not changed or already saved.
+
+    Rent canceled before its payment succeeded is restored at once if the period is still free, otherwise it stays
+    canceled and the payment has to be refunded.
+    """
+    if payment.status not in Payment.RENT_STATUSES:
+        return None
+    rent = payment.rent
+    rent_status = Payment.RENT_STATUSES[payment.status]
+    if rent.status == 3 and rent_status != 3:
+        if not UserCottageRent.objects.restore_if_available(rent, rent_status):
+            logger.error("Payment %s succeeded after its rent %s was canceled and the period is taken, "
+                         "it has to be refunded", payment.pk, rent.pk)
+        return None
+    rent.status = rent_status
+    return rent
+
+
+def check_payments(payments: list[Payment], now: datetime.datetime, concurrency: int) -> int:
+    """Query IOKassa statuses with bounded concurrency and apply changes in bulk, return number of changed.
+
+    Payments not paid in PAYMENTS_TIMEOUT seconds are canceled together with their rents, unless their status
+    is not received now, payments not sent to IOKassa are canceled without it.
+    """
+    ukassa_ids = [payment.ukassa_id for payment in payments if payment.ukassa_id]
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(ukassa_ids)), 1)) as executor:
+        statuses = dict(zip(ukassa_ids, executor.map(get_ukassa_status, ukassa_ids)))
+
+    expired_before = now - datetime.timedelta(seconds=settings.PAYMENTS_TIMEOUT)
+    changed = {}
+    for payment in payments:
+        status = statuses.get(payment.ukassa_id) if payment.ukassa_id else payment.status
+        if status is None:
+            continue
+        if status in Payment.ACTIVE_STATUSES and payment.created_at < expired_before:
+            status = "canceled"
+        if status != payment.status:
+            changed[payment.pk] = status
+
+    with transaction.atomic():
+        Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(checked_at=now)
+        # statuses changed meanwhile by webhook are not overwritten
+        locked = [
+            payment for payment in Payment.objects.select_for_update().select_related("rent").filter(
+                pk__in=changed
+            ).order_by("pk")
+            if payment.can_change_status(changed[payment.pk])
+        ]
+        rents = []
+        for payment in locked:
+            payment.status = changed[payment.pk]
+            rent = get_changed_rent(payment)
+            if rent is not None:
+                rents.append(rent)
+        Payment.objects.bulk_update(locked, ["status"])
+        UserCottageRent.objects.bulk_update(rents, ["status"])
+        # bulk update does not send signals of rents
+        invalidate_cottage_availability(
+            payment.rent.cottage_id for payment in locked if payment.status in Payment.RENT_STATUSES
+        )
+    return len(locked)
+
+
+def sweep_payment_statuses(batch_size: int, concurrency: int, max_batches: int) -> int:
+    """Check all payments due for a check in batches, return number of changed payments"""
+    now = timezone.now()
+    changed = 0
+    for _ in range(max_batches):
+        payments = get_payments_due_for_check(now, batch_size)
+        if not payments:
+            break
+        changed += check_payments(payments, now, concurrency)
+    return changed
+
+
+def apply_notification_batch(batch_size: int) -> int:
+    """Apply one batch of received IOKassa notifications in order of receipt, return number of processed.
+
+    Notification changes payment only if its status follows the current one, so repeated and late
+    notifications are no-ops. Rows of the batch are locked, parallel workers take other batches.
+    Notification of payment succeeded for a rent whose period was taken meanwhile is processed and logged for refund,
+    so it does not block later notifications.
+    """
+    with transaction.atomic():
+        notifications = list(PaymentNotification.objects.select_for_update(skip_locked=True).filter(
+            processed_at__isnull=True
+        ).order_by("received_at")[:batch_size])
+        if not notifications:
+            return 0
+        payments = {
+            payment.ukassa_id: payment
+            for payment in Payment.objects.select_for_update().select_related("rent").filter(
+                ukassa_id__in={notification.ukassa_id for notification in notifications}
+            ).order_by("pk")
+        }
+        changed, rents = {}, {}
+        for notification in notifications:
+            payment = payments.get(notification.ukassa_id)
+            if payment is None or not payment.can_change_status(notification.status):
+                continue
+            payment.status = notification.status
+            changed[payment.pk] = payment
+            rent = get_changed_rent(payment)
+            if rent is not None:
+                rents[rent.pk] = rent
+        Payment.objects.bulk_update(changed.values(), ["status"])
+        UserCottageRent.objects.bulk_update(rents.values(), ["status"])
+        invalidate_cottage_availability(
+            payment.rent.cottage_id for payment in changed.values() if payment.status in Payment.RENT_STATUSES
+        )
+        PaymentNotification.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+            processed_at=timezone.now()
+        )
+    return len(notifications)
@@ -1,31 +1,49 @@
 from uuid import UUID
 
 from celery import shared_task
-from yookassa import Payment as UkassaPayment
+from django.conf import settings
+from django.core.cache import cache
 
-from payments.models import Payment
+from payments.models import Payment, PaymentNotification
+from payments.services import apply_notification_batch, sweep_payment_statuses
 
-
-@shared_task
-def check_and_update_payment_status(payment_id: UUID):
-    """Check status and update it for schedule"""
-    payment = Payment.objects.select_related('rent').filter(id=payment_id).first()
-    ukassa_payment = UkassaPayment.find_one(payment.ukassa_id)
-    if ukassa_payment.status != payment.status:
-        payment.change_payment_status(ukassa_payment.status)
-
-
-@shared_task
-def finally_update_payment_status(payment_id: UUID):
-    """Check status and finally update it"""
-    payment = Payment.objects.select_related('rent').filter(id=payment_id).first()
-    if payment and payment.status != "succeeded":
-        payment.change_payment_status("canceled")
+SWEEP_LOCK_KEY = "payments:sweep-statuses"
 
 
 @shared_task
-def schedule_check_and_update_payment_status(payment_id: UUID):
-    """Check and update status every 10 minutes and finally check after hour"""
-    for minute in range(0, 60, 10):
-        check_and_update_payment_status.apply_async((payment_id,), countdown=minute * 2)
-    finally_update_payment_status.apply_async((payment_id,), countdown=60 * 2)
+def sweep_payments():
+    """Check statuses of all pending payments, runs periodically by Celery beat, one sweep at a time"""
+    if not cache.add(SWEEP_LOCK_KEY, True, timeout=settings.PAYMENTS_SWEEP_INTERVAL * 5):
+        return 0
+    try:
+        return sweep_payment_statuses(settings.PAYMENTS_SWEEP_BATCH_SIZE, settings.PAYMENTS_SWEEP_CONCURRENCY,
+                                      settings.PAYMENTS_SWEEP_MAX_BATCHES)
+    finally:
+        cache.delete(SWEEP_LOCK_KEY)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_ukassa_payment(self, payment_id: UUID):
+    """Create IOKassa payment for new payment, its status is checked by sweep_payments, rent is canceled if it fails"""
+    try:
+        Payment.objects.send_to_ukassa(payment_id)
+    except Exception as error:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=error, countdown=2 ** self.request.retries)
+        payment = Payment.objects.select_related('rent').filter(id=payment_id, status=Payment.NEW).first()
+        if payment:
+            payment.change_payment_status("canceled")
+        raise
+
+
+@shared_task(bind=True, max_retries=5)
+def apply_payment_notifications(self) -> int:
+    """Apply received IOKassa notifications in batches until none is left, also runs periodically by Celery beat"""
+    cache.delete(PaymentNotification.objects.APPLY_SCHEDULED_KEY)
+    total = 0
+    try:
+        while processed := apply_notification_batch(settings.PAYMENTS_NOTIFICATIONS_BATCH_SIZE):
+            total += processed
+    except Exception as error:
+        raise self.retry(exc=error, countdown=2 ** self.request.retries)
+    return total
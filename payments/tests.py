@@ -1,3 +1,314 @@
-from django.test import TestCase
+import datetime
+import json
+import zlib
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps.registry import Apps
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from core.tests_setup import APITestCaseWithSetUp, APITransactionTestCaseWithSetUp
+from cottages.cache import get_cottage_detail_cache_key
+from payments.gateways import FakeGateway, GatewayError, GatewayPayment, get_payment_gateway, get_payment_response
+from payments.models import Payment, PaymentManager, PaymentNotification, PaymentResponseArchive
+from payments.services import apply_notification_batch, check_payments, sweep_payment_statuses
+from relations.models import UserCottageRent
+
+
+def get_ukassa_payment(ukassa_id: str = "2d8e1b36-000f-5000-8000-1a2b3c4d5e6f") -> GatewayPayment:
+    confirmation_url = f"https://yoomoney.ru/checkout?orderId={ukassa_id}"
+    response = get_payment_response(ukassa_id, "pending", Decimal("9500.00"), confirmation_url)
+    return GatewayPayment(id=ukassa_id, status="pending", amount=Decimal("9500.00"),
+                          confirmation_url=confirmation_url, response=json.dumps(response))
+
+
+@override_settings(PAYMENTS_ASYNC_CREATION=True)
+class PaymentCreationTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        self.rent_data = {"start_date": start_date, "end_date": start_date + datetime.timedelta(days=2)}
+
+    def test_rent_does_not_wait_for_ukassa(self):
+        self.client.force_login(self.user2)
+        with mock.patch.object(PaymentManager, "_create_ukassa_payment") as create_ukassa_payment, \
+                mock.patch("relations.views.create_ukassa_payment") as task, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("rents-create", args=[self.cottage1.id]), self.rent_data,
+                                        format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data["data"]["status"], response.data["data"]["redirect_url"]), (Payment.NEW, ""))
+        self.assertEqual(str(task.delay.call_args.args[0]), response.data["data"]["id"])
+        create_ukassa_payment.assert_not_called()
+
+        response = self.client.get(reverse("get-status", args=[response.data["data"]["id"]]))
+        self.assertEqual(response.data["data"]["status"], Payment.NEW)
+
+    def test_rent_without_price_is_rejected(self):
+        self.cottage1.price = None
+        self.cottage1.save()
+        self.client.force_login(self.user2)
+        response = self.client.post(reverse("rents-create", args=[self.cottage1.id]), self.rent_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cottage1.rents.filter(user=self.user2).exists())
+
+    @override_settings(PAYMENTS_ASYNC_CREATION=False)
+    def test_rent_is_canceled_if_ukassa_fails(self):
+        self.client.force_login(self.user2)
+        with mock.patch.object(PaymentManager, "_create_ukassa_payment", side_effect=GatewayError("Unavailable")):
+            with self.assertLogs("relations.views", "ERROR"):
+                response = self.client.post(reverse("rents-create", args=[self.cottage1.id]), self.rent_data,
+                                            format="json")
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        payment = Payment.objects.select_related("rent").get(rent__user=self.user2)
+        self.assertEqual((payment.status, payment.rent.status), ("canceled", 3))
+        self.assertEqual(response.data["data"]["id"], str(payment.id))
+        self.assertEqual(response.data["data"]["status"], "canceled")
+
+    def test_rent_amount_is_required(self):
+        rent = self.cottage1.rents.create(user=self.user2, status=1, **self.rent_data)
+        self.cottage1.price = None
+        self.cottage1.save()
+        rent.refresh_from_db()
+        with self.assertRaises(ValueError):
+            Payment.objects.create_pending_payment(rent)
+        self.assertFalse(rent.payments.exists())
+
+    def test_send_to_ukassa_once(self):
+        rent = self.cottage1.rents.create(user=self.user2, status=1, **self.rent_data)
+        payment = Payment.objects.create_pending_payment(rent)
+        self.assertEqual(payment.amount, Decimal("19000.00"))
+        with mock.patch.object(PaymentManager, "_create_ukassa_payment", return_value=get_ukassa_payment()) as create:
+            sent = Payment.objects.send_to_ukassa(payment.id)
+            self.assertIsNone(Payment.objects.send_to_ukassa(payment.id))
+        create.assert_called_once()
+        self.assertEqual(create.call_args.args[1], Decimal("19000.00"))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.ukassa_id), ("pending", sent.ukassa_id))
+        self.assertTrue(payment.redirect_url.startswith("https://yoomoney.ru/"))
+        self.assertEqual(payment.response_archive.get_response()["id"], sent.ukassa_id)
+
+
+class PaymentSweepTest(APITestCaseWithSetUp):
+
+    def create_payment(self, days: int, ukassa_status: str) -> Payment:
+        start_date = timezone.localdate() + datetime.timedelta(days=days)
+        rent = self.cottage1.rents.create(user=self.user2, status=1, start_date=start_date,
+                                          end_date=start_date + datetime.timedelta(days=1))
+        return Payment.objects.create(rent=rent, amount=9500, status=ukassa_status, ukassa_id=f"ukassa-{days}")
+
+    def test_sweep_applies_changes_in_bulk(self):
+        paid, waiting, expired, succeeded = (self.create_payment(days, ukassa_status) for days, ukassa_status in (
+            (10, "pending"), (20, "pending"), (30, "pending"), (40, "succeeded")
+        ))
+        Payment.objects.filter(pk=expired.pk).update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        provider_statuses = {paid.ukassa_id: "succeeded", waiting.ukassa_id: "pending", expired.ukassa_id: "pending"}
+        with mock.patch("payments.services.get_payment_gateway") as get_gateway:
+            get_status = get_gateway.return_value.get_status
+            get_status.side_effect = provider_statuses.__getitem__
+            self.assertEqual(sweep_payment_statuses(batch_size=2, concurrency=4, max_batches=10), 2)
+            self.assertEqual(get_status.call_count, 3)
+            self.assertEqual(sweep_payment_statuses(batch_size=2, concurrency=4, max_batches=10), 0)
+            self.assertEqual(get_status.call_count, 3)
+
+        statuses = {payment.pk: (payment.status, payment.rent.status)
+                    for payment in Payment.objects.select_related("rent")}
+        self.assertEqual(statuses, {
+            paid.pk: ("succeeded", 2), waiting.pk: ("pending", 1), expired.pk: ("canceled", 3),
+            succeeded.pk: ("succeeded", 1),
+        })
+        self.assertIsNotNone(Payment.objects.get(pk=waiting.pk).checked_at)
+
+    def test_sweep_invalidates_cottage_availability(self):
+        payment = self.create_payment(10, "pending")
+        detail_key = get_cottage_detail_cache_key(self.cottage1.pk, [])
+        with mock.patch("payments.services.get_payment_gateway") as get_gateway, \
+                self.captureOnCommitCallbacks(execute=True):
+            get_gateway.return_value.get_status.return_value = "canceled"
+            self.assertEqual(check_payments([payment], timezone.now(), concurrency=1), 1)
+        self.assertNotEqual(get_cottage_detail_cache_key(self.cottage1.pk, []), detail_key)
+
+    def test_overlapping_rents_are_not_restored_together(self):
+        first, second = self.create_payment(10, "pending"), self.create_payment(11, "pending")
+        UserCottageRent.objects.filter(pk__in=[first.rent_id, second.rent_id]).update(
+            status=3, end_date=timezone.localdate() + datetime.timedelta(days=13)
+        )
+        with mock.patch("payments.services.get_payment_gateway") as get_gateway, \
+                self.assertLogs("payments.services", "ERROR"):
+            get_gateway.return_value.get_status.return_value = "succeeded"
+            self.assertEqual(sweep_payment_statuses(batch_size=10, concurrency=4, max_batches=1), 2)
+        statuses = sorted(Payment.objects.values_list("status", "rent__status"))
+        self.assertEqual(statuses, [("succeeded", 2), ("succeeded", 3)])
+
+    def test_expired_payment_is_not_canceled_without_status(self):
+        unknown, new = self.create_payment(10, "pending"), self.create_payment(20, Payment.NEW)
+        Payment.objects.filter(pk=new.pk).update(ukassa_id="")
+        Payment.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        with mock.patch("payments.services.get_payment_gateway") as get_gateway:
+            get_gateway.return_value.get_status.side_effect = GatewayError("Unavailable")
+            self.assertEqual(sweep_payment_statuses(batch_size=10, concurrency=4, max_batches=1), 1)
+        statuses = {payment.pk: (payment.status, payment.rent.status)
+                    for payment in Payment.objects.select_related("rent")}
+        self.assertEqual(statuses, {unknown.pk: ("pending", 1), new.pk: ("canceled", 3)})
+
+
+class PaymentNotificationTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        rent = self.cottage1.rents.create(user=self.user2, status=1, start_date=start_date,
+                                          end_date=start_date + datetime.timedelta(days=1))
+        self.payment = Payment.objects.create(rent=rent, amount=9500, status="pending", ukassa_id="ukassa-1")
+
+    def get_notification(self, ukassa_status: str) -> dict:
+        payment = get_ukassa_payment(self.payment.ukassa_id).response
+        return {"type": "notification", "event": f"payment.{ukassa_status}",
+                "object": {**json.loads(payment), "status": ukassa_status}}
+
+    def test_webhook_is_stored_once(self):
+        for _ in range(2):
+            response = self.client.post(reverse("update-status"), self.get_notification("succeeded"), format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(PaymentNotification.objects.values_list("event_key", flat=True)),
+                         ["payment.succeeded:ukassa-1"])
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, "pending")
+        response = self.client.post(reverse("update-status"), {**self.get_notification("canceled"), "object": "x"},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("update-status"), {"event": "refund.succeeded"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(PaymentNotification.objects.count(), 1)
+
+    def test_late_notifications_are_ignored(self):
+        for ukassa_status in ("succeeded", "waiting_for_capture", "canceled"):
+            notification = self.get_notification(ukassa_status)
+            PaymentNotification.objects.receive(notification["event"], self.payment.ukassa_id, ukassa_status,
+                                                notification)
+        self.assertEqual(apply_notification_batch(batch_size=10), 3)
+        self.assertEqual(apply_notification_batch(batch_size=10), 0)
+        payment = Payment.objects.select_related("rent").get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.rent.status), ("succeeded", 2))
+        self.assertFalse(PaymentNotification.objects.filter(processed_at__isnull=True).exists())
+
+    def receive(self, ukassa_status: str) -> None:
+        notification = self.get_notification(ukassa_status)
+        PaymentNotification.objects.receive(notification["event"], self.payment.ukassa_id, ukassa_status,
+                                            notification)
+
+    def test_succeeded_after_cancel_restores_rent(self):
+        self.payment.change_payment_status("canceled")
+        self.receive("succeeded")
+        self.assertEqual(apply_notification_batch(batch_size=10), 1)
+        payment = Payment.objects.select_related("rent").get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.rent.status), ("succeeded", 2))
+
+    def test_succeeded_after_cancel_keeps_taken_period(self):
+        self.payment.change_payment_status("canceled")
+        rent = self.payment.rent
+        other_rent = self.cottage1.rents.create(user=self.user1, status=1, start_date=rent.start_date,
+                                                end_date=rent.end_date)
+        self.receive("succeeded")
+        other = Payment.objects.create(rent=other_rent, amount=9500, status="pending", ukassa_id="ukassa-2")
+        PaymentNotification.objects.receive("payment.succeeded", other.ukassa_id, "succeeded", {})
+        with self.assertLogs("payments.services", "ERROR"):
+            self.assertEqual(apply_notification_batch(batch_size=10), 2)
+        statuses = {payment.pk: (payment.status, payment.rent.status)
+                    for payment in Payment.objects.select_related("rent")}
+        self.assertEqual(statuses, {self.payment.pk: ("succeeded", 3), other.pk: ("succeeded", 2)})
+        self.assertFalse(PaymentNotification.objects.filter(processed_at__isnull=True).exists())
+
+
+class PaymentResponseArchiveTest(APITestCaseWithSetUp):
+
+    def test_archive_replaces_response(self):
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        rent = self.cottage1.rents.create(user=self.user2, status=1, start_date=start_date,
+                                          end_date=start_date + datetime.timedelta(days=1))
+        payment = Payment.objects.create(rent=rent, amount=9500, status="pending", ukassa_id="ukassa-1")
+        PaymentResponseArchive.objects.archive(payment, get_ukassa_payment("ukassa-1").response)
+        PaymentResponseArchive.objects.archive(payment, get_ukassa_payment("ukassa-2").response)
+        self.assertEqual(PaymentResponseArchive.objects.filter(payment=payment).count(), 1)
+        self.assertEqual(PaymentResponseArchive.objects.get(payment=payment).get_response()["id"], "ukassa-2")
+
+
+class SlimPaymentMigrationTest(APITransactionTestCaseWithSetUp):
+    before = [("payments", "0007_payment_notification")]
+    after = [("payments", "0008_slim_payment")]
+
+    @staticmethod
+    def migrate(targets: list[tuple[str, str]]) -> Apps:
+        """Migrate database to targets and return their models"""
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_responses_are_archived_and_restored(self):
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes("payments"))
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        rent = self.cottage1.rents.create(user=self.user2, status=1, start_date=start_date,
+                                          end_date=start_date + datetime.timedelta(days=1))
+        response = get_ukassa_payment().response
+        payments = self.migrate(self.before).get_model("payments", "Payment").objects
+        archived, empty = (
+            payments.create(rent_id=rent.pk, amount=9500, status="pending", ukassa_id=ukassa_id,
+                            ukassa_response=ukassa_response, created_at=timezone.now())
+            for ukassa_id, ukassa_response in (("ukassa-1", response), ("", None))
+        )
+
+        archives = self.migrate(self.after).get_model("payments", "PaymentResponseArchive").objects
+        self.assertEqual(list(archives.values_list("payment_id", flat=True)), [archived.pk])
+        self.assertEqual(zlib.decompress(archives.get().data).decode(), response)
+
+        payments = self.migrate(self.before).get_model("payments", "Payment").objects
+        self.assertEqual(payments.get(pk=archived.pk).ukassa_response, response)
+        self.assertIsNone(payments.get(pk=empty.pk).ukassa_response)
+
+
+@override_settings(PAYMENTS_GATEWAY="payments.gateways.FakeGateway", PAYMENTS_FAKE_LATENCY=0,
+                   PAYMENTS_FAKE_FAILURE_RATE=0, PAYMENTS_FAKE_SUCCESS_RATE=1, PAYMENTS_FAKE_CONFIRM_DELAY=0)
+class FakeGatewayTest(APITestCaseWithSetUp):
+
+    def setUp(self):
+        super().setUp()
+        get_payment_gateway.cache_clear()
+        self.addCleanup(get_payment_gateway.cache_clear)
+
+    def test_booking_flow_with_fake_gateway(self):
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        self.client.force_login(self.user2)
+        with self.settings(PAYMENTS_ASYNC_CREATION=False):
+            response = self.client.post(reverse("rents-create", args=[self.cottage1.id]), {
+                "start_date": start_date, "end_date": start_date + datetime.timedelta(days=2)
+            }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment = Payment.objects.select_related("rent", "response_archive").get(pk=response.data["data"]["id"])
+        self.assertEqual(payment.status, "pending")
+        self.assertEqual(payment.response_archive.get_response()["id"], payment.ukassa_id)
+
+        gateway = get_payment_gateway()
+        fake_payment = gateway.create_payment(payment.amount, "", "", str(payment.rent.id))
+        self.assertEqual(fake_payment.id, payment.ukassa_id)
+        response = self.client.post(reverse("update-status"), gateway.get_notification(fake_payment),
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(apply_notification_batch(batch_size=10), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "succeeded")
+
+    def test_fake_gateway_outcomes(self):
+        gateway = FakeGateway()
+        payment = gateway.create_payment(Decimal("100.00"), "", "http://localhost", "key")
+        with self.settings(PAYMENTS_FAKE_CONFIRM_DELAY=60):
+            self.assertEqual(gateway.get_status(payment.id), "pending")
+            self.assertIsNone(gateway.get_notification(payment))
+        with self.settings(PAYMENTS_FAKE_SUCCESS_RATE=0):
+            self.assertEqual(gateway.get_status(payment.id), "canceled")
+        with self.settings(PAYMENTS_FAKE_FAILURE_RATE=1), self.assertRaises(GatewayError):
+            gateway.get_status(payment.id)
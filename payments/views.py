@@ -6,7 +6,7 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from yookassa.domain.notification import WebhookNotification
 
-from payments.models import Payment
+from payments.models import Payment, PaymentNotification
 from payments.serializers import PaymentSerializer
 
 
@@ -21,14 +21,13 @@ def get_payment_status_view(request: Request, payment_id: UUID) -> Response:
 
 @api_view(["POST"])
 def change_payment_status_view(request: Request) -> Response:
+    """Store IOKassa notification and acknowledge it, it is applied to payment by a Celery task"""
     data = request.data
     try:
         notification_object = WebhookNotification(data)
     except Exception:
         return Response({"status": "error webhook"}, status=status.HTTP_400_BAD_REQUEST)
     ukassa_info = notification_object.object
-    ukassa_id = ukassa_info.id
-    ukassa_status = ukassa_info.status
-    payment = Payment.objects.select_related("rent").filter(ukassa_id=ukassa_id)
-    payment.change_payment_status(ukassa_status)
-    return Response(status.HTTP_204_NO_CONTENT)
+    if str(notification_object.event).startswith("payment.") and ukassa_info is not None:
+        PaymentNotification.objects.receive(notification_object.event, ukassa_info.id, ukassa_info.status, data)
+    return Response(status=status.HTTP_200_OK)
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 11:47
+
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+import relations.models
+
+
+def get_conflicting_rents(rents) -> list:
+    """Return ids of active rents ending before start or overlapping an earlier active rent of the cottage"""
+    conflicting = list(rents.filter(start_date__gt=models.F("end_date")).values_list("pk", flat=True))
+    periods = {}
+    for pk, cottage_id, start_date, end_date in rents.filter(start_date__lt=models.F("end_date")).values_list(
+        "pk", "cottage_id", "start_date", "end_date"
+    ).order_by("cottage_id", "start_date", "pk"):
+        if any(start_date < kept_end and kept_start < end_date for kept_start, kept_end in periods.get(cottage_id, [])):
+            conflicting.append(pk)
+        else:
+            periods.setdefault(cottage_id, []).append((start_date, end_date))
+    return conflicting
+
+
+def check_conflicting_rents(apps, schema_editor):
+    """Stop migration if active rents conflict, they are resolved by hand, for example canceled in admin"""
+    UserCottageRent = apps.get_model("relations", "UserCottageRent")
+    rents = UserCottageRent.objects.using(schema_editor.connection.alias).exclude(status=3)
+    conflicting = get_conflicting_rents(rents)
+    if conflicting:
+        raise RuntimeError(
+            "Active rents ending before start or overlapping other active rents of the cottage have to be canceled "
+            "or moved before the migration: " + ", ".join(str(pk) for pk in conflicting)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('relations', '0005_alter_usercottagerent_status'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(check_conflicting_rents, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usercottagerent',
+            constraint=relations.models.PostgresExclusionConstraint(condition=models.Q(('status', 3), _negated=True), expressions=[('cottage', '='), (relations.models.DateRange('start_date', 'end_date'), '&&')], name='rent_active_period_excl'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 import uuid
 
-from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateRangeField, RangeOperators
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, models, transaction
+from django.db.models import Func, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
 from users.models import User
 
@@ -13,6 +18,7 @@ class UserCottageReview(models.Model):
         (4, 'Хорошо'),
         (5, 'Отлично'),
     ]
+    RATING_FIELDS = ("location_rating", "cleanliness_rating", "communication_rating", "value_rating")
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     cottage = models.ForeignKey("cottages.Cottage", on_delete=models.CASCADE, related_name="reviews",
                                 verbose_name="Коттедж")
@@ -25,10 +31,25 @@ class UserCottageReview(models.Model):
     rating = models.FloatField(blank=True, null=True, editable=False)
 
     def save(self, *args, **kwargs):
-        ratings_sum = self.location_rating + self.cleanliness_rating + self.communication_rating + self.value_rating
-        avg_rating = ratings_sum / 4.0
-        self.rating = avg_rating
-        super().save(*args, **kwargs)
+        ratings = self.get_ratings()
+        self.rating = sum(ratings.values()) / 4.0
+        cottages = self._meta.get_field("cottage").related_model.objects
+        with transaction.atomic():
+            previous = None if self._state.adding else self._get_saved_ratings()
+            previous_cottage_id = previous.pop("cottage_id") if previous else None
+            super().save(*args, **kwargs)
+            if previous and previous_cottage_id != self.cottage_id:
+                cottages.update_rating_summary(previous_cottage_id, removed=previous)
+                previous = None
+            cottages.update_rating_summary(self.cottage_id, added=ratings, removed=previous)
+
+    def get_ratings(self) -> dict[str, int]:
+        """Return ratings of review by dimension"""
+        return {field: getattr(self, field) for field in self.RATING_FIELDS}
+
+    def _get_saved_ratings(self) -> dict | None:
+        """Return cottage_id and ratings of review as they are stored in DB"""
+        return self.__class__.objects.filter(pk=self.pk).values("cottage_id", *self.RATING_FIELDS).first()
 
     class Meta:
         verbose_name = 'Отзыв коттеджа'
@@ -38,6 +59,12 @@ class UserCottageReview(models.Model):
         return f'{self.cottage} - {self.user}'
 
 
+@receiver(post_delete, sender=UserCottageReview)
+def remove_review_from_rating_summary(sender, instance, **kwargs):
+    cottages = sender._meta.get_field("cottage").related_model.objects
+    cottages.update_rating_summary(instance.cottage_id, removed=instance.get_ratings())
+
+
 class UserCottageLike(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     cottage = models.ForeignKey("cottages.Cottage", on_delete=models.CASCADE, related_name="likes",
@@ -52,6 +79,92 @@ class UserCottageLike(models.Model):
         return f'{self.cottage} - {self.user}'
 
 
+class DateRange(Func):
+    function = "daterange"
+    output_field = DateRangeField()
+
+
+class PostgresExclusionConstraint(ExclusionConstraint):
+    """Exclusion constraint created on PostgreSQL only, on other databases overlaps are prevented by row locks"""
+
+    def constraint_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().remove_sql(model, schema_editor)
+
+    def validate(self, model, instance, exclude=None, using=DEFAULT_DB_ALIAS):
+        if connections[using].vendor == "postgresql":
+            super().validate(model, instance, exclude=exclude, using=using)
+
+
+class UserCottageRentManager(models.Manager):
+    PERIOD_EXCLUSION_CONSTRAINT = "rent_active_period_excl"
+
+    def get_overlapping_rents(self, start_date, end_date) -> models.QuerySet:
+        """Return not canceled rents intersecting period from start_date to end_date"""
+        rents = self.exclude(status=3)
+        if connections[self.db].vendor == "postgresql":
+            return rents.alias(period=DateRange("start_date", "end_date")).filter(
+                period__overlap=(start_date, end_date)
+            )
+        return rents.filter(start_date__lt=end_date, end_date__gt=start_date)
+
+    def create_rent_if_available(self, cottage_id, user: User, start_date, end_date,
+                                 status: int = 1) -> "UserCottageRent | None":
+        """Create rent if the period is free, return None if it is occupied.
+
+        Bookings of one cottage are serialized by a lock of the cottage row held only for the check and insert,
+        bookings of other cottages are not blocked. On PostgreSQL the exclusion constraint is the last guard.
+        """
+        cottages = self.model._meta.get_field("cottage").related_model.objects
+        try:
+            with transaction.atomic(using=self.db):
+                list(cottages.select_for_update(no_key=True).filter(pk=cottage_id).values_list("pk", flat=True))
+                if self.get_overlapping_rents(start_date, end_date).filter(cottage_id=cottage_id).exists():
+                    return None
+                return self.create(cottage_id=cottage_id, user=user, start_date=start_date, end_date=end_date,
+                                   status=status)
+        except IntegrityError as error:
+            if self.is_period_conflict(error):
+                return None
+            raise
+
+    def restore_if_available(self, rent: "UserCottageRent", status: int) -> bool:
+        """Give canceled rent the status if its period is still free, return False if it is occupied.
+
+        The cottage is locked as for a new booking, so rents restored in one transaction do not overlap.
+        """
+        cottages = self.model._meta.get_field("cottage").related_model.objects
+        try:
+            with transaction.atomic(using=self.db):
+                list(cottages.select_for_update(no_key=True).filter(pk=rent.cottage_id).values_list("pk", flat=True))
+                if self.get_overlapping_rents(rent.start_date, rent.end_date).filter(
+                        cottage_id=rent.cottage_id).exclude(pk=rent.pk).exists():
+                    return False
+                self.filter(pk=rent.pk).update(status=status)
+        except IntegrityError as error:
+            if self.is_period_conflict(error):
+                return False
+            raise
+        rent.status = status
+        return True
+
+    def is_period_conflict(self, error: IntegrityError) -> bool:
+        """Return True if error is a violation of the exclusion constraint of active periods"""
+        diagnostics = getattr(error.__cause__, "diag", None)
+        return getattr(diagnostics, "constraint_name", None) == self.PERIOD_EXCLUSION_CONSTRAINT
+
+
 class UserCottageRent(models.Model):
     STATUS_CHOICES = [
         (1, 'Забронирован'),
@@ -67,9 +180,20 @@ class UserCottageRent(models.Model):
     start_date = models.DateField(verbose_name="Дата заезда")
     end_date = models.DateField(verbose_name="Дата выезда")
 
+    objects = UserCottageRentManager()
+
     class Meta:
         verbose_name = 'Аренда коттеджа'
         verbose_name_plural = 'Аренды коттеджа'
+        # GiST index of the constraint is used for availability lookups
+        constraints = [
+            PostgresExclusionConstraint(
+                name="rent_active_period_excl",
+                expressions=[("cottage", RangeOperators.EQUAL),
+                             (DateRange("start_date", "end_date"), RangeOperators.OVERLAPS)],
+                condition=~Q(status=3),
+            ),
+        ]
 
     def __str__(self):
         return f'{self.cottage} - {self.user}'
@@ -32,3 +32,9 @@ class UserCottageRentSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserCottageRent
         fields = ['id', "start_date", "end_date", "status", "cottage"]
+
+    # noinspection PyMethodMayBeStatic
+    def validate(self, attrs):
+        if attrs['start_date'] >= attrs['end_date']:
+            raise serializers.ValidationError("Дата выезда должна быть позже даты заезда")
+        return attrs
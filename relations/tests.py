@@ -1,7 +1,20 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from threading import Barrier, Event
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.test import skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
-from core.tests_setup import APITestCaseWithSetUp
+from core.tests_setup import APITestCaseWithSetUp, APITransactionTestCaseWithSetUp
+from cottages.models import Cottage
+from relations.models import UserCottageRent
 
 
 class CottageReviewViewSetTest(APITestCaseWithSetUp):
@@ -48,3 +61,109 @@ class CottageReviewViewSetTest(APITestCaseWithSetUp):
         self.client.force_login(self.user1)
         response = self.client.delete(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class CottageRentTest(APITestCaseWithSetUp):
+
+    def test_create_rent_if_available(self):
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        end_date = start_date + datetime.timedelta(days=3)
+        rents = UserCottageRent.objects
+        rent = rents.create_rent_if_available(self.cottage1.id, self.user1, start_date, end_date)
+        self.assertEqual((rent.status, rent.cottage_id), (1, self.cottage1.id))
+        self.assertIsNone(rents.create_rent_if_available(self.cottage1.id, self.user2, start_date + datetime.timedelta(
+            days=1), end_date + datetime.timedelta(days=1)))
+        self.assertIsNotNone(rents.create_rent_if_available(self.cottage1.id, self.user2, end_date,
+                                                            end_date + datetime.timedelta(days=2)))
+        rent.status = 3
+        rent.save()
+        self.assertIsNotNone(rents.create_rent_if_available(self.cottage1.id, self.user2, start_date, end_date))
+
+    def test_booking_locks_only_its_cottage(self):
+        start_date = timezone.localdate() + datetime.timedelta(days=10)
+        with CaptureQueriesContext(connection) as queries:
+            UserCottageRent.objects.create_rent_if_available(self.cottage1.id, self.user1, start_date,
+                                                             start_date + datetime.timedelta(days=3))
+        # EXPLAIN statements of silk profiler are skipped
+        cottage_queries = [query["sql"] for query in queries if 'FROM "cottages_cottage"' in query["sql"] and
+                           not query["sql"].startswith(connection.ops.explain_prefix)]
+        self.assertEqual(len(cottage_queries), 1)
+        self.assertIn('WHERE "cottages_cottage"."id" = ', cottage_queries[0])
+
+    def test_migration_reports_conflicting_rents(self):
+        migration = import_module("relations.migrations.0006_rent_active_period")
+        schema_editor = SimpleNamespace(connection=connection)
+        migration.check_conflicting_rents(apps, schema_editor)
+        start_date = datetime.date(2024, 1, 9)
+        rents = [
+            UserCottageRent.objects.create(cottage=self.cottage1, user=self.user2, status=rent_status,
+                                           start_date=start_date + datetime.timedelta(days=start),
+                                           end_date=start_date + datetime.timedelta(days=end))
+            for rent_status, start, end in ((1, 0, 14), (2, 6, 8), (1, 12, 11), (1, 10, 10), (1, 14, 16), (3, 0, 2))
+        ]
+        with self.assertRaises(RuntimeError) as error:
+            migration.check_conflicting_rents(apps, schema_editor)
+        for rent in rents:
+            self.assertEqual(str(rent.pk) in str(error.exception), rent in rents[1:3])
+        self.assertEqual(UserCottageRent.objects.filter(pk__in=[rent.pk for rent in rents], status=3).count(), 1)
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentCottageRentTest(APITransactionTestCaseWithSetUp):
+    THREADS = 32
+
+    def book(self, cottage_id, offset: int, barrier: Barrier | None = None) -> UserCottageRent | None:
+        start_date = timezone.localdate() + datetime.timedelta(days=10 + offset)
+        if barrier:
+            barrier.wait()
+        try:
+            return UserCottageRent.objects.create_rent_if_available(cottage_id, self.user1, start_date,
+                                                                    start_date + datetime.timedelta(days=3))
+        finally:
+            connection.close()
+
+    def clone_cottage(self) -> Cottage:
+        cottage = Cottage.objects.get(pk=self.cottage1.pk)
+        cottage.pk = None
+        cottage.save()
+        return cottage
+
+    def test_concurrent_bookings_do_not_overlap(self):
+        cottages = [self.cottage1.id] + [self.clone_cottage().pk for _ in range(self.THREADS // 2 - 1)]
+        tasks = [(self.cottage1.id, number % 3) for number in range(self.THREADS // 2)]
+        tasks += [(cottage_id, 0) for cottage_id in cottages[1:]] + [(cottages[0], 20)]
+        barrier = Barrier(len(tasks))
+        with ThreadPoolExecutor(len(tasks)) as executor:
+            results = list(executor.map(lambda task: self.book(*task, barrier=barrier), tasks))
+
+        booked = [rent for rent in results if rent is not None]
+        self.assertEqual(len({rent.cottage_id for rent in booked}), len(cottages))
+        for cottage_id in cottages:
+            rents = list(Cottage.objects.get(pk=cottage_id).rents.exclude(status=3).order_by("start_date"))
+            for previous, current in zip(rents, rents[1:]):
+                self.assertLessEqual(previous.end_date, current.start_date)
+        self.assertEqual(UserCottageRent.objects.filter(cottage_id__in=cottages[1:]).count(), len(cottages) - 1)
+        self.assertEqual(len([rent for rent in booked if rent.cottage_id == cottages[0]]), 2)
+
+    def test_booking_is_not_blocked_by_other_cottage(self):
+        other = self.clone_cottage()
+        locked, release = Event(), Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(Cottage.objects.select_for_update().filter(pk=self.cottage1.pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(2) as executor:
+            holder = executor.submit(hold_lock)
+            self.assertTrue(locked.wait(10))
+            try:
+                rent = executor.submit(self.book, other.pk, 0).result(timeout=5)
+            finally:
+                release.set()
+            holder.result()
+        self.assertEqual(rent.cottage_id, other.pk)
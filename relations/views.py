@@ -1,5 +1,8 @@
+import logging
 from uuid import UUID
 
+from django.conf import settings
+from django.db import transaction
 from django.http import Http404
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
@@ -10,13 +13,16 @@ from rest_framework.views import APIView
 
 from cottages.models import Cottage
 from cottages.permissions import IsAuthorOrReadOnly
+from cottages.pricing import get_stay_price
 from cottages.serializers import CottageCreateUpdateSerializer, CottageInfoWithRatingSerializer
 from payments.models import Payment
 from payments.serializers import PaymentSerializer
-from payments.tasks import schedule_check_and_update_payment_status
+from payments.tasks import create_ukassa_payment
 from relations.models import UserCottageLike, UserCottageRent, UserCottageReview
 from relations.serializers import UserCottageRentSerializer, UserCottageReviewSerializer
 
+logger = logging.getLogger(__name__)
+
 
 class UserCottageReviewList(APIView):
     permission_classes = [IsAuthorOrReadOnly]
@@ -78,20 +84,37 @@ def create_cottage_rent_view(request: Request, cottage_id: UUID) -> Response:
 
     start_date = serializer.validated_data['start_date']
     end_date = serializer.validated_data['end_date']
-    cottage = Cottage.objects.filter(pk=cottage_id).prefetch_related('rents').first()
+    cottage = Cottage.objects.filter(pk=cottage_id).first()
     if not cottage:
         raise Http404("Cottage does not exist")
-    if cottage.is_available(start_date, end_date):
-        rent = serializer.save(user=request.user, cottage_id=cottage_id, status=1)
-        payment = Payment.objects.create_payment(rent)
-        schedule_check_and_update_payment_status.delay(payment.id)
-        payment_serializer = PaymentSerializer(payment)
-        return Response({
-            "status": "success",
-            "data": payment_serializer.data
-        }, status=status.HTTP_201_CREATED)
-    else:
-        return Response({"error": "Коттедж занят в указанные даты"}, status=status.HTTP_400_BAD_REQUEST)
+    amount = get_stay_price(cottage, start_date, end_date)
+    if amount is None:
+        return Response({"error": "Стоимость коттеджа в указанные даты не задана"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    # rent is not left without payment, it is sent to IOKassa after commit so the cottage is not locked meanwhile
+    with transaction.atomic():
+        rent = UserCottageRent.objects.create_rent_if_available(cottage.pk, request.user, start_date, end_date)
+        if rent is None:
+            return Response({"error": "Коттедж занят в указанные даты"}, status=status.HTTP_400_BAD_REQUEST)
+        rent.cottage = cottage
+        payment = Payment.objects.create_pending_payment(rent, amount)
+        if settings.PAYMENTS_ASYNC_CREATION:
+            transaction.on_commit(lambda: create_ukassa_payment.delay(payment.id))
+    if not settings.PAYMENTS_ASYNC_CREATION:
+        try:
+            payment = Payment.objects.send_to_ukassa(payment.id)
+        except Exception:
+            logger.exception("payment %s was not created by IOKassa, rent %s is canceled", payment.id, rent.id)
+            payment.change_payment_status("canceled")
+            return Response({
+                "error": "Платёжная система недоступна, бронирование отменено",
+                "data": PaymentSerializer(payment).data
+            }, status=status.HTTP_502_BAD_GATEWAY)
+    payment_serializer = PaymentSerializer(payment)
+    return Response({
+        "status": "success",
+        "data": payment_serializer.data
+    }, status=status.HTTP_201_CREATED)
 
 
 @api_view(["GET"])